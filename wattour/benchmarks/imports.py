@@ -0,0 +1,53 @@
+"""Import time benchmark of the wattour packages, each imported in a fresh interpreter.
+
+Run with: python -m wattour.benchmarks.imports [repeats]
+
+Exits with status 1 if a package takes longer than its budget (the best of repeats runs) or imports one of the heavy
+dependencies that are only needed on use.
+"""
+
+import json
+import os
+import subprocess
+import sys
+
+# seconds, with headroom for slower machines; numpy and pandas alone take about 0.4 s
+IMPORT_BUDGETS = {
+    "wattour.core": 1.0,
+    "wattour.optimization": 1.0,
+    "wattour.forecasting.pjm": 1.2,
+}
+LAZY_DEPENDENCIES = ["dotenv", "gurobipy", "matplotlib", "pandera", "scipy", "sklearn", "xgboost"]
+
+_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+print(json.dumps([time.perf_counter() - start, sorted(name for name in sys.modules if "." not in name)]))
+"""
+
+
+def measure_import(module: str) -> tuple[float, list[str]]:
+    """Import module in a fresh interpreter without PJM_API_KEY; return the seconds and lazy dependencies imported."""
+    env = {key: value for key, value in os.environ.items() if key != "PJM_API_KEY"}
+    output = subprocess.run(  # noqa: S603 (runs this interpreter on a fixed script)
+        [sys.executable, "-c", _SCRIPT.format(module=module)], capture_output=True, text=True, check=True, env=env
+    ).stdout
+    seconds, modules = json.loads(output)
+    return seconds, [name for name in LAZY_DEPENDENCIES if name in modules]
+
+
+def main(repeats: int = 3) -> int:
+    failed = False
+    print(f"{'package':<26} {'import (s)':>10} {'budget (s)':>10}  lazy dependencies imported")
+    for module, budget in IMPORT_BUDGETS.items():
+        runs = [measure_import(module) for _ in range(repeats)]
+        seconds = min(seconds for seconds, _ in runs)
+        imported = runs[0][1]
+        failed |= seconds > budget or bool(imported)
+        print(f"{module:<26} {seconds:>10.3f} {budget:>10.2f}  {', '.join(imported) or '-'}")
+    return int(failed)
+
+
+if __name__ == "__main__":
+    sys.exit(main(*map(int, sys.argv[1:])))
@@ -0,0 +1,66 @@
+"""Memory per node of LMPTimeseriesBase: column storage, node views, detached nodes and Gurobi decision variables.
+
+Run with: python -m wattour.benchmarks.memory [nodes]
+
+Memory is measured with tracemalloc, so it counts the Python objects and NumPy buffers allocated, not Gurobi's own
+memory. The decision container holds a placeholder instead of Gurobi variables, which need a license for large models.
+"""
+
+import sys
+import tracemalloc
+from typing import Any, Callable
+
+import numpy as np
+import pandas as pd
+
+from wattour.core.lmp import LMP
+from wattour.core.lmp_timeseries_base import LMPTimeseriesBase
+from wattour.optimization.results import LMPDecisionVariables
+
+
+def make_timeseries(nodes: int) -> LMPTimeseriesBase:
+    df = pd.DataFrame(
+        {
+            "timestamp": pd.date_range("2021-01-01", periods=nodes - 1, freq="5min", tz="UTC", unit="ns"),
+            "price": 50 + np.random.default_rng(0).normal(0, 10, nodes - 1).cumsum(),
+        }
+    )
+    return LMPTimeseriesBase().create_branch_from_df(df)
+
+
+def traced_bytes(build: Callable[[], Any]) -> int:
+    """Bytes still allocated by build() when it returns."""
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        result = build()
+        allocated = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    del result
+    return allocated
+
+
+def decision_container(ts: LMPTimeseriesBase) -> list[LMPDecisionVariables]:
+    # one shared placeholder, so that only the container and its tuples are counted
+    var = object()
+    is_dummy = ts.column("is_dummy").tolist()
+    return [LMPDecisionVariables(soe=var) if dummy else LMPDecisionVariables(var, var, var) for dummy in is_dummy]
+
+
+def main(nodes: int = 100_000) -> None:
+    ts = make_timeseries(nodes)
+    timestamp = pd.Timestamp("2021-01-01", tz="UTC")
+    measurements = {
+        "tree storage": traced_bytes(lambda: make_timeseries(nodes)),
+        "node views (get_node_list)": traced_bytes(ts.get_node_list),
+        "detached LMP nodes": traced_bytes(lambda: [LMP(price=1.0, timestamp=timestamp) for _ in range(nodes)]),
+        "decision_vars container": traced_bytes(lambda: decision_container(ts)),
+    }
+    print(f"{nodes} nodes")
+    for name, allocated in measurements.items():
+        print(f"{name:<28} {allocated / nodes:8.1f} bytes per node")
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,72 @@
+"""Round-trip benchmark of the JSON (serialize/deserialize) and .npz (save/load) formats of LMPTimeseriesBase.
+
+Run with: python -m wattour.benchmarks.serialization [branches] [steps]
+
+The JSON format nests every node in its parent, so the json module can't encode branches longer than a few hundred
+steps; the default is a day of 5-minute prices.
+"""
+
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from wattour.core.lmp_timeseries_base import LMPTimeseriesBase
+
+
+def make_timeseries(branches: int, steps: int) -> LMPTimeseriesBase:
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({"timestamp": pd.date_range("2021-01-01", periods=steps + 1, freq="5min", tz="UTC", unit="ns")})
+    prices = 50 + rng.normal(0, 10, (branches, steps + 1)).cumsum(axis=1)
+    df = df.join(pd.DataFrame({f"price_{i}": row for i, row in enumerate(prices)}))
+
+    ts = LMPTimeseriesBase().create_branch_from_df(df.iloc[:1].rename(columns={"price_0": "price"}), add_dummy=False)
+    ts.create_branches_from_df(df.iloc[1:], price_columns=list(df.columns[1:]), on_node=ts.head)
+    ts.calc_coefficients()
+    return ts
+
+
+def timed(function):
+    start = time.perf_counter()
+    result = function()
+    return result, time.perf_counter() - start
+
+
+def main(branches: int = 300, steps: int = 288) -> None:
+    ts = make_timeseries(branches, steps)
+    print(f"{ts._n} nodes ({branches} branches x {steps} steps)")
+
+    with tempfile.TemporaryDirectory() as directory:
+        json_path = Path(directory) / "tree.json"
+        npz_path = Path(directory) / "tree.npz"
+
+        def write_json():
+            json_path.write_text(json.dumps(ts.serialize()))
+
+        def read_json():
+            with json_path.open() as file:
+                return LMPTimeseriesBase.deserialize(json.load(file))
+
+        _, json_write = timed(write_json)
+        json_loaded, json_read = timed(read_json)
+        _, npz_write = timed(lambda: ts.save(npz_path))
+        npz_loaded, npz_read = timed(lambda: LMPTimeseriesBase.load(npz_path))
+        # first pass over the memory-mapped arrays, which is when they are read from disk
+        _, npz_touch = timed(lambda: [npz_loaded.column(name).sum() for name in LMPTimeseriesBase.node_type.columns])
+
+        for loaded in (json_loaded, npz_loaded):
+            if not np.array_equal(loaded.column("price"), ts.column("price")):
+                raise ValueError("The round trip changed the prices")
+
+        print(f"{'format':<6} {'size (MB)':>10} {'write (s)':>10} {'read (s)':>10}")
+        print(f"{'json':<6} {json_path.stat().st_size / 1e6:>10.2f} {json_write:>10.3f} {json_read:>10.3f}")
+        print(f"{'npz':<6} {npz_path.stat().st_size / 1e6:>10.2f} {npz_write:>10.3f} {npz_read:>10.4f}")
+        print(f"npz first touch of all columns: {npz_touch:.4f} s")
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
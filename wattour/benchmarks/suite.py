@@ -0,0 +1,243 @@
+"""Benchmark suite of tree building, model assembly and solving on synthetic price trees.
+
+Run with:
+    python -m wattour.benchmarks.suite run [--sizes 1000,10000,100000] [--output results.json]
+    python -m wattour.benchmarks.suite compare baseline.json [results.json] [--threshold 0.25]
+
+Cases are chain (one branch) and bushy (multi-stage, see build_scenario_tree) trees of hourly and 5-minute prices of
+about the given numbers of nodes; sizes up to 1,000,000 work, but solving takes a while past 100,000 nodes. Every
+operation is timed (best of --repeat runs) and its peak traced memory measured in a separate run. run saves the results
+as JSON, to be kept as a baseline; compare runs the baseline's cases again (or reads results.json) and exits with
+status 1 if an operation got slower by more than threshold (and more than a millisecond) or its peak memory grew by
+more than threshold.
+"""
+
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Any, Callable, NamedTuple, Optional
+
+import numpy as np
+import pandas as pd
+
+from wattour.core import GenericBattery
+from wattour.core.lmp import LMP
+from wattour.core.lmp_timeseries_base import LMPTimeseriesBase
+from wattour.core.scenario_tree import build_scenario_tree
+from wattour.optimization.backends import HighsBackend
+from wattour.optimization.battery_lp import build_battery_lp
+from wattour.optimization.chain import ChainBackend
+
+SHAPES = ("chain", "bushy")
+FREQUENCIES = {"hourly": "h", "5min": "5min"}
+DEFAULT_SIZES = (1_000, 10_000, 100_000)
+BUSHY_STEPS = {"hourly": 168, "5min": 288}  # a week of hourly and a day of 5-minute prices per scenario
+BUSHY_STAGES = (1 / 8, 1 / 4, 1 / 2)  # of the horizon
+
+
+class Case(NamedTuple):
+    shape: str
+    frequency: str
+    size: int
+
+    @property
+    def name(self) -> str:
+        return f"{self.shape}-{self.frequency}-{self.size}"
+
+
+class Operation(NamedTuple):
+    name: str
+    setup: Callable[[LMPTimeseriesBase], Any]  # fresh input of every run, so mutating operations can be repeated
+    run: Callable[[Any], Any]
+
+
+def make_battery() -> GenericBattery:
+    return GenericBattery(
+        usable_capacity=10,
+        charge_rate=5,
+        discharge_rate=5,
+        charge_efficiency=0.95,
+        discharge_efficiency=0.95,
+        self_discharge_rate=0.0,
+    )
+
+
+def make_prices(num: int, steps: int, seed: int = 0) -> np.ndarray:
+    """Draw num random walk price scenarios of steps prices, shape (num, steps)."""
+    rng = np.random.default_rng(seed)
+    return 40 + rng.normal(0, 3, (num, steps)).cumsum(axis=1)
+
+
+def make_chain_df(case: Case) -> pd.DataFrame:
+    timestamps = pd.date_range("2020-01-01", periods=case.size - 1, freq=FREQUENCIES[case.frequency], tz="UTC")
+    return pd.DataFrame({"timestamp": timestamps, "price": make_prices(1, len(timestamps))[0]})
+
+
+def make_tree(case: Case) -> LMPTimeseriesBase:
+    """Build a chain of case.size nodes (with its dummy), or a bushy tree of at most case.size nodes."""
+    if case.shape == "chain":
+        return LMPTimeseriesBase().create_branch_from_df(make_chain_df(case))
+
+    steps = BUSHY_STEPS[case.frequency]
+    freq = pd.Timedelta(FREQUENCIES[case.frequency] if case.frequency != "hourly" else "1h")
+    timestamps = pd.date_range("2020-01-01", periods=steps + 1, freq=freq, tz="UTC")
+    tree = LMPTimeseriesBase()
+    tree.append(None, LMP(price=40.0, timestamp=timestamps[0]))
+    scenarios = make_prices(max(1, case.size // steps * 2), steps)
+    stages = [int(steps * stage) for stage in BUSHY_STAGES]
+    return build_scenario_tree(tree, timestamps[1:].asi8, scenarios, stages, case.size - 1)
+
+
+def operations(case: Case) -> list[Operation]:
+    battery = make_battery()
+
+    def build(data):
+        return make_tree(case) if case.shape == "bushy" else LMPTimeseriesBase().create_branch_from_df(data)
+
+    def with_coefficients(tree: LMPTimeseriesBase) -> LMPTimeseriesBase:
+        tree = tree.copy()
+        if tree.head.coefficient is None:  # type: ignore[union-attr]
+            tree.calc_coefficients()
+        return tree
+
+    ops = [
+        Operation("build", lambda tree: make_chain_df(case) if case.shape == "chain" else None, build),
+        Operation("calc_coefficients", lambda tree: tree.copy(), lambda tree: tree.calc_coefficients()),
+        Operation("copy", lambda tree: tree, lambda tree: tree.copy()),
+        Operation("serialize", lambda tree: tree, lambda tree: tree.serialize()),
+        Operation("deserialize", lambda tree: tree.serialize(), LMPTimeseriesBase.deserialize),
+        Operation(
+            "merge_trees",
+            lambda tree: (tree.copy(), tree),
+            lambda trees: LMPTimeseriesBase.merge_trees(*trees),
+        ),
+        Operation("assemble", with_coefficients, lambda tree: build_battery_lp(battery, tree)),
+        Operation("solve_highs", with_coefficients, lambda tree: HighsBackend().solve(battery, tree, 0, 0)),
+    ]
+    if case.shape == "chain":
+        ops.append(Operation("solve_chain", with_coefficients, lambda tree: ChainBackend().solve(battery, tree, 0, 0)))
+    return ops
+
+
+def measure(operation: Operation, tree: LMPTimeseriesBase, repeat: int) -> tuple[float, float]:
+    """Best wall time of repeat runs in seconds, and peak traced memory of one more run in MB."""
+    seconds = np.inf
+    for _ in range(repeat):
+        data = operation.setup(tree)
+        start = time.perf_counter()
+        operation.run(data)
+        seconds = min(seconds, time.perf_counter() - start)
+        del data
+
+    data = operation.setup(tree)
+    tracemalloc.start()
+    try:
+        operation.run(data)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return seconds, peak / 1e6
+
+
+def run_suite(cases: list[Case], repeat: int = 3, log: Callable[[str], None] = print) -> dict:
+    results = []
+    for case in cases:
+        tree = make_tree(case)
+        for operation in operations(case):
+            seconds, peak_mb = measure(operation, tree, repeat)
+            results.append(
+                {
+                    "case": case.name,
+                    "operation": operation.name,
+                    "nodes": tree._n,
+                    "seconds": seconds,
+                    "peak_mb": peak_mb,
+                }
+            )
+            log(f"{case.name:<22} {operation.name:<18} {tree._n:>9} nodes {seconds:>10.4f} s {peak_mb:>10.2f} MB")
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "created": pd.Timestamp.now(tz="UTC").isoformat(),
+            "repeat": repeat,
+        },
+        "results": results,
+    }
+
+
+def compare(baseline: dict, current: dict, threshold: float = 0.25, min_seconds: float = 1e-3) -> list[str]:
+    """Describe every operation of current that got slower or used more memory than in baseline beyond threshold."""
+    previous = {(result["case"], result["operation"]): result for result in baseline["results"]}
+    regressions = []
+    for result in current["results"]:
+        old = previous.get((result["case"], result["operation"]))
+        if old is None:
+            continue
+        name = f"{result['case']} {result['operation']}"
+        if result["seconds"] > old["seconds"] * (1 + threshold) and result["seconds"] - old["seconds"] > min_seconds:
+            regressions.append(f"{name}: {old['seconds']:.4f} s -> {result['seconds']:.4f} s")
+        if result["peak_mb"] > old["peak_mb"] * (1 + threshold) and result["peak_mb"] - old["peak_mb"] > 0.1:
+            regressions.append(f"{name}: {old['peak_mb']:.2f} MB -> {result['peak_mb']:.2f} MB")
+    return regressions
+
+
+def parse_case(name: str) -> Case:
+    shape, frequency, size = name.rsplit("-", 2)
+    return Case(shape, frequency, int(size))
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m wattour.benchmarks.suite", description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    run_parser = commands.add_parser("run", help="run the suite and save the results")
+    run_parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)))
+    run_parser.add_argument("--shapes", default=",".join(SHAPES))
+    run_parser.add_argument("--frequencies", default=",".join(FREQUENCIES))
+    run_parser.add_argument("--repeat", type=int, default=3)
+    run_parser.add_argument("--output", default="benchmark_results.json")
+    compare_parser = commands.add_parser("compare", help="compare results with a baseline")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument(
+        "results", nargs="?", help="results to compare; by default the baseline's cases are run again"
+    )
+    compare_parser.add_argument("--threshold", type=float, default=0.25)
+    compare_parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    if args.command == "run":
+        cases = [
+            Case(shape, frequency, int(size))
+            for shape in args.shapes.split(",")
+            for frequency in args.frequencies.split(",")
+            for size in args.sizes.split(",")
+        ]
+        results = run_suite(cases, args.repeat)
+        with Path(args.output).open("w") as file:
+            json.dump(results, file, indent=2)
+        print(f"Saved {len(results['results'])} results to {args.output}")
+        return 0
+
+    with Path(args.baseline).open() as file:
+        baseline = json.load(file)
+    if args.results:
+        with Path(args.results).open() as file:
+            current = json.load(file)
+    else:
+        cases = list(dict.fromkeys(parse_case(result["case"]) for result in baseline["results"]))
+        current = run_suite(cases, args.repeat)
+
+    regressions = compare(baseline, current, args.threshold)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    print(f"{len(regressions)} regressions beyond {args.threshold:.0%}")
+    return int(bool(regressions))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,25 +1,96 @@
 from __future__ import annotations
 
 import datetime
-from dataclasses import dataclass
-from typing import Optional
+import math
+from typing import Any, ClassVar, Optional
+
+import numpy as np
+import pandas as pd
 
 from wattour.core.utils.tree import Node
 
 
+def to_epoch_ns(timestamp: datetime.datetime) -> int:
+    """Convert a timestamp to nanoseconds since the epoch (UTC). Naive timestamps are taken to be in UTC."""
+    return pd.Timestamp(timestamp).as_unit("ns").value
+
+
+def from_epoch_ns(value: int, tz: Optional[datetime.tzinfo] = datetime.timezone.utc) -> pd.Timestamp:
+    """Convert nanoseconds since the epoch back to a timestamp in tz, or a naive one if tz is None."""
+    return pd.Timestamp(value) if tz is None else pd.Timestamp(value, tz=tz)
+
+
 # helper class for individual nodes (linked list / graph)
 # TODO: we should make as many params required as possible
-@dataclass
 class LMP(Node["LMP"]):
-    price: float  # presumably $ / MW
-    timestamp: datetime.datetime
-    elapsed_time: Optional[datetime.timedelta] = None  # time that elapsed between previous node and this one
-    coefficient: Optional[float] = None  # coefficient to weight given node (important in optimization)
-    is_dummy: bool = False
+    # timestamps are stored as UTC epoch nanoseconds, elapsed times as hours and missing values as NaN. Timestamps are
+    # read back in the time zone of the tree's head (naive if it was naive), or their own while the node is detached.
+
+    __slots__ = ()
+
+    columns: ClassVar[dict[str, Any]] = {
+        **Node.columns,
+        "price": np.float64,  # presumably $ / MW
+        "timestamp": np.int64,
+        "elapsed_hours": np.float64,  # time that elapsed between previous node and this one
+        "coefficient": np.float64,  # coefficient to weight given node (important in optimization)
+    }
+
+    def __init__(
+        self,
+        price: float,
+        timestamp: datetime.datetime,
+        elapsed_time: Optional[datetime.timedelta] = None,
+        coefficient: Optional[float] = None,
+        is_dummy: bool = False,
+    ):
+        super().__init__(is_dummy)
+        self.price = price
+        self.timestamp = timestamp
+        self.elapsed_time = elapsed_time
+        self.coefficient = coefficient
+
+    @property
+    def price(self) -> float:
+        return float(self._get("price"))
+
+    @price.setter
+    def price(self, value: float) -> None:
+        self._set("price", value)
 
-    def __post_init__(self):
-        """Init Node parent."""
-        super().__init__(self.is_dummy)
+    @property
+    def timestamp(self) -> pd.Timestamp:
+        tz = self._values["tz"] if self._tree is None else self._tree.tz  # type: ignore[index, attr-defined]
+        return from_epoch_ns(int(self._get("timestamp")), tz)
+
+    @timestamp.setter
+    def timestamp(self, value: datetime.datetime) -> None:
+        if self._tree is None:
+            self._values["tz"] = value.tzinfo  # type: ignore[index]
+        self._set("timestamp", to_epoch_ns(value))
+
+    @property
+    def elapsed_hours(self) -> Optional[float]:
+        hours = float(self._get("elapsed_hours"))
+        return None if math.isnan(hours) else hours
+
+    @property
+    def elapsed_time(self) -> Optional[datetime.timedelta]:
+        hours = self.elapsed_hours
+        return None if hours is None else datetime.timedelta(hours=hours)
+
+    @elapsed_time.setter
+    def elapsed_time(self, value: Optional[datetime.timedelta]) -> None:
+        self._set("elapsed_hours", math.nan if value is None else value.total_seconds() / 3600)
+
+    @property
+    def coefficient(self) -> Optional[float]:
+        coefficient = float(self._get("coefficient"))
+        return None if math.isnan(coefficient) else coefficient
+
+    @coefficient.setter
+    def coefficient(self, value: Optional[float]) -> None:
+        self._set("coefficient", math.nan if value is None else value)
 
     def validate(self, prev: LMP) -> None:
         if not self.timestamp or not prev.timestamp:
@@ -31,3 +102,22 @@ class LMP(Node["LMP"]):
 
     def enrich(self, prev: LMP) -> None:
         self.elapsed_time = self.timestamp - prev.timestamp
+
+    def __eq__(self, other: object) -> bool:
+        """Compare the values of two LMPs, like the fields of a dataclass."""
+        if other.__class__ is not self.__class__:
+            return NotImplemented
+        return self._key() == other._key()  # type: ignore[attr-defined]
+
+    # mutable and compared by value, so not hashable
+    __hash__ = None  # type: ignore[assignment]
+
+    def _key(self) -> tuple:
+        return (self.price, self.timestamp, self.elapsed_time, self.coefficient, self.is_dummy)
+
+    def __repr__(self) -> str:
+        """Show the node's values, e.g. when printing a list of nodes."""
+        return (
+            f"LMP(price={self.price!r}, timestamp={self.timestamp!r}, elapsed_time={self.elapsed_time!r}, "
+            f"coefficient={self.coefficient!r}, is_dummy={self.is_dummy!r})"
+        )
@@ -1,56 +1,107 @@
 from __future__ import annotations
 
 import datetime
-from typing import Optional, Self
+import json
+import math
+import os
+from pathlib import Path
+from typing import IO, Optional, Self
 
+import numpy as np
 import pandas as pd
-import pandera as pa
-from matplotlib import pyplot as plt
 from pandas.api.types import is_numeric_dtype
-from pandera.typing import Series
 
 from wattour.core.utils.tree import Tree
 
-from .lmp import LMP
+from .lmp import LMP, from_epoch_ns, to_epoch_ns
+from .scenario_reduction import ScenarioReduction, reduce_scenarios
 
+NS_PER_HOUR = 3_600_000_000_000
 
-class LMPDataFrame(pa.DataFrameModel):
-    price: Series
-    timestamp: Series[pd.DatetimeTZDtype] = pa.Field(dtype_kwargs={"unit": "ns", "tz": "UTC"})
 
-    # temporary, until decide float or int
-    @pa.check("price")
-    def check_is_number(self, column_header: Series):
-        return is_numeric_dtype(column_header)
+def __getattr__(name: str):
+    # pandera (and the schemas built on it) is imported on first use, as it is slow to import
+    if name == "LMPDataFrame":
+        from .schemas import LMPDataFrame
+
+        return LMPDataFrame
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def transform(df: pd.DataFrame, column_map: dict[str, str]) -> pd.DataFrame:
+    from .schemas import LMPDataFrame
+
     new_df = df[column_map.keys()].rename(columns=column_map)
     LMPDataFrame.validate(new_df)
     return new_df
 
 
+def timestamps_to_epoch_ns(timestamps: pd.Series) -> np.ndarray:
+    """Convert a timestamp column to UTC epoch nanoseconds. Naive timestamps are taken to be in UTC."""
+    return pd.DatetimeIndex(timestamps).as_unit("ns").asi8
+
+
 class LMPTimeseriesBase(Tree[LMP]):
+    node_type = LMP
+    indexed_columns = ("timestamp",)
+
     def __init__(self) -> None:
         super().__init__()
+        # time zone timestamps are read back in: the head's, or UTC (as required of DataFrames) until there is one
+        self.tz: Optional[datetime.tzinfo] = datetime.timezone.utc
+
+    def append(self, existing_node: Optional[LMP], new_node: LMP):
+        if existing_node is None and self.head is None:
+            self.tz = new_node.timestamp.tzinfo
+        super().append(existing_node, new_node)
+
+    def copy(self) -> Self:
+        new_tree = super().copy()
+        new_tree.tz = self.tz
+        return new_tree
+
+    def timestamps(self, node_ids: np.ndarray) -> pd.DatetimeIndex:
+        """Return the timestamps of the given nodes in the time zone of the timeseries."""
+        timestamps = pd.to_datetime(self.column("timestamp")[node_ids], utc=True)
+        return timestamps.tz_localize(None) if self.tz is None else timestamps.tz_convert(self.tz)
+
+    def _save_extra(self) -> dict[str, np.ndarray]:
+        return {"_tz": np.array("" if self.tz is None else str(self.tz))}
+
+    def _load_extra(self, arrays: dict[str, np.ndarray]) -> None:
+        if "_tz" in arrays:
+            name = str(arrays["_tz"])
+            self.tz = pd.Timestamp(0, tz=name).tzinfo if name else None
 
     def serialize(self) -> dict:
         """Serialize the timeseries to a dictionary."""
         if self.head is None:
             raise ValueError("Timeseries is empty")
 
-        def serialize_node(node: LMP) -> dict:
-            return {
-                "timestamp": node.timestamp.isoformat(),
-                "price": node.price,
-                "coefficient": node.coefficient,
-                "elapsed_time": node.elapsed_time.total_seconds() if node.elapsed_time else None,
-                "is_dummy": node.dummy,
-                "children": [serialize_node(child) for child in node.next],
+        ptr, child_ids = self.child_index()
+        ptr_list, child_list = ptr.tolist(), child_ids.tolist()
+        timestamps = self.column("timestamp").tolist()
+        prices = self.column("price").tolist()
+        coefficients = self.column("coefficient").tolist()
+        elapsed_hours = self.column("elapsed_hours").tolist()
+        is_dummy = self.column("is_dummy").tolist()
+
+        # children are serialized before their parent
+        serialized: list[Optional[dict]] = [None] * len(timestamps)
+        for node_id in self.postorder_ids().tolist():
+            coefficient = coefficients[node_id]
+            elapsed_seconds = round(elapsed_hours[node_id] * 3600, 6)
+            serialized[node_id] = {
+                "timestamp": from_epoch_ns(timestamps[node_id], self.tz).isoformat(),
+                "price": prices[node_id],
+                "coefficient": None if math.isnan(coefficient) else coefficient,
+                "elapsed_time": elapsed_seconds if elapsed_seconds and not math.isnan(elapsed_seconds) else None,
+                "is_dummy": is_dummy[node_id],
+                "children": [serialized[child] for child in child_list[ptr_list[node_id] : ptr_list[node_id + 1]]],
             }
 
         return {
-            "nodes": serialize_node(self.head),
+            "nodes": serialized[0],
             "branches": self.branches,
             "size": self.size,
             "dummies": self.dummy_nodes,
@@ -59,27 +110,62 @@ class LMPTimeseriesBase(Tree[LMP]):
     @classmethod
     def deserialize(cls, data: dict) -> Self:
         """Deserialize the timeseries from a dictionary."""
-
-        def deserialize_node(node_data: dict) -> LMP:
-            node = LMP(
-                timestamp=pd.Timestamp(node_data["timestamp"]),
-                price=node_data["price"],
-                coefficient=node_data.get("coefficient"),
-                elapsed_time=datetime.timedelta(seconds=node_data["elapsed_time"])
-                if node_data["elapsed_time"]
-                else None,
-                is_dummy=node_data["is_dummy"],
-            )
-            node.next = [deserialize_node(child) for child in node_data["children"]]
-            return node
+        parents: list[int] = []
+        timestamps: list[str] = []
+        prices: list[float] = []
+        coefficients: list[float] = []
+        elapsed_hours: list[float] = []
+        is_dummy: list[bool] = []
+
+        # pre-order walk, so every node gets its id before its children
+        stack: list[tuple[dict, int]] = [(data["nodes"], -1)]
+        while stack:
+            node_data, parent = stack.pop()
+            node_id = len(parents)
+            coefficient = node_data.get("coefficient")
+            parents.append(parent)
+            timestamps.append(node_data["timestamp"])
+            prices.append(node_data["price"])
+            coefficients.append(math.nan if coefficient is None else coefficient)
+            elapsed_hours.append(node_data["elapsed_time"] / 3600 if node_data["elapsed_time"] else math.nan)
+            is_dummy.append(node_data["is_dummy"])
+            stack.extend((child, node_id) for child in reversed(node_data["children"]))
 
         instance = cls()
+        instance.tz = pd.Timestamp(timestamps[0]).tzinfo
+        instance._push_many(
+            np.array(parents, dtype=np.int64),
+            {
+                "is_dummy": is_dummy,
+                "price": prices,
+                "timestamp": timestamps_to_epoch_ns(pd.to_datetime(timestamps, utc=True, format="ISO8601")),
+                "elapsed_hours": elapsed_hours,
+                "coefficient": coefficients,
+            },
+        )
         instance.size = data["size"]
         instance.branches = data["branches"]
         instance.dummy_nodes = data["dummies"]
-        instance.head = deserialize_node(data["nodes"])
         return instance
 
+    @classmethod
+    def load(cls, file: str | os.PathLike | IO[bytes], mmap: bool = True) -> Self:
+        """Read a timeseries written by save, or a JSON file in the format of serialize."""
+        if isinstance(file, (str, os.PathLike)):
+            with Path(file).open("rb") as raw:
+                magic = raw.read(4)
+        else:
+            position = file.tell()
+            magic = file.read(4)
+            file.seek(position)
+
+        if magic == b"PK\x03\x04":  # .npz files are zip archives
+            return super().load(file, mmap)
+        if isinstance(file, (str, os.PathLike)):
+            with Path(file).open("rb") as raw:
+                return cls.deserialize(json.load(raw))
+        return cls.deserialize(json.load(file))
+
     def create_branch_from_df(
         self, lmp_df: pd.DataFrame, add_dummy: bool = True, on_node: Optional[LMP] = None
     ) -> Self:
@@ -87,23 +173,113 @@ class LMPTimeseriesBase(Tree[LMP]):
 
         Dataframe format must be [timestamp, lmp]. Returns the final node in the branch.
         """
+        from .schemas import LMPDataFrame
+
         LMPDataFrame.validate(lmp_df)
         if lmp_df.empty:
             raise ValueError("The lmp_df DataFrame has no rows.")
 
-        prev_node = on_node if on_node else self.head
-        for _, row in lmp_df.iterrows():
-            cur_node = LMP(timestamp=row["timestamp"], price=row["price"])
-            self.append(prev_node, cur_node)
-            prev_node = cur_node
+        return self.create_branches_from_arrays(
+            timestamps_to_epoch_ns(lmp_df["timestamp"]), lmp_df["price"].to_numpy(), add_dummy, on_node
+        )
 
-        if add_dummy and prev_node:
-            if not prev_node.elapsed_time:
-                raise ValueError("Previous node does not have an elapsed time")
+    def create_branches_from_df(
+        self,
+        lmp_df: pd.DataFrame,
+        price_columns: Optional[list[str]] = None,
+        add_dummy: bool = True,
+        on_node: Optional[LMP] = None,
+    ) -> Self:
+        """Populate the lmptimeseries with one sibling branch per price column of a dataframe.
 
-            self.append_dummy(
-                prev_node, LMP(price=0, timestamp=prev_node.timestamp + prev_node.elapsed_time, is_dummy=True)
-            )
+        Dataframe format must be [timestamp, price_0, ..., price_k] (e.g. the output of XGBRegressorBase.predict_to_df).
+        price_columns defaults to every column but timestamp.
+        """
+        if "timestamp" not in lmp_df.columns:
+            raise ValueError("The lmp_df DataFrame has no timestamp column.")
+        if lmp_df.empty:
+            raise ValueError("The lmp_df DataFrame has no rows.")
+
+        if price_columns is None:
+            price_columns = [column for column in lmp_df.columns if column != "timestamp"]
+        for column in price_columns:
+            if not is_numeric_dtype(lmp_df[column]):
+                raise ValueError(f"Price column '{column}' is not numeric.")
+
+        return self.create_branches_from_arrays(
+            timestamps_to_epoch_ns(lmp_df["timestamp"]), lmp_df[price_columns].to_numpy().T, add_dummy, on_node
+        )
+
+    def create_branches_from_arrays(
+        self, timestamps: np.ndarray, prices: np.ndarray, add_dummy: bool = True, on_node: Optional[LMP] = None
+    ) -> Self:
+        """Populate the lmptimeseries with sibling branches that share timestamps.
+
+        timestamps are UTC epoch nanoseconds of shape (T,) and prices has shape (T,) for a single branch or
+        (branches, T). Branches start at on_node (or the head); an empty tree takes the first row of a single branch as
+        its head.
+        """
+        timestamps = np.asarray(timestamps, dtype=np.int64)
+        prices = np.atleast_2d(np.asarray(prices, dtype=np.float64))
+        num_branches, length = prices.shape
+        if length == 0 or num_branches == 0:
+            raise ValueError("No prices were given.")
+        if len(timestamps) != length:
+            raise ValueError("Timestamps and prices must have the same length.")
+
+        elapsed = np.empty(length, dtype=np.float64)
+        elapsed[1:] = np.diff(timestamps) / NS_PER_HOUR
+        if np.any(elapsed[1:] <= 0):
+            raise ValueError("The new_node timestamp must be greater than the prev_node timestamp.")
+
+        prev_node = on_node if on_node else self.head
+        if prev_node is None:
+            if num_branches > 1:
+                raise ValueError("Cannot add several branches to an empty timeseries.")
+            parent = -1
+            elapsed[0] = np.nan
+        else:
+            parent = self._index_of(prev_node)
+            if prev_node.dummy:
+                raise ValueError("Cannot add a node to a dummy node.")
+            elapsed[0] = (timestamps[0] - self._columns["timestamp"][parent]) / NS_PER_HOUR
+            if elapsed[0] <= 0:
+                raise ValueError("The new_node timestamp must be greater than the prev_node timestamp.")
+
+        if add_dummy:
+            if np.isnan(elapsed[-1]):
+                raise ValueError("Previous node does not have an elapsed time")
+            # the dummy closes the last interval, so it repeats its length
+            last_step = timestamps[-1] - (timestamps[-2] if length > 1 else self._columns["timestamp"][parent])
+            timestamps = np.append(timestamps, timestamps[-1] + last_step)
+            elapsed = np.append(elapsed, elapsed[-1])
+            prices = np.hstack([prices, np.zeros((num_branches, 1))])
+        branch_length = len(timestamps)
+
+        # node ids are assigned branch by branch, so every node but the first of a branch follows its parent
+        parents = np.arange(self._n - 1, self._n - 1 + num_branches * branch_length).reshape(num_branches, -1)
+        parents[:, 0] = parent
+        is_dummy = np.zeros((num_branches, branch_length), dtype=np.bool_)
+        is_dummy[:, -1] = add_dummy
+
+        had_children = parent >= 0 and self._num_children[parent] > 0
+        self._push_many(
+            parents.ravel(),
+            {
+                "is_dummy": is_dummy.ravel(),
+                "price": prices.ravel(),
+                "timestamp": np.tile(timestamps, num_branches),
+                "elapsed_hours": np.tile(elapsed, num_branches),
+                "coefficient": np.nan,
+            },
+        )
+
+        self.branches += num_branches if had_children else num_branches - 1
+        if parent < 0:
+            self.branches += 1
+        self.size += num_branches * branch_length
+        if add_dummy:
+            self.dummy_nodes += num_branches
 
         return self
 
@@ -112,26 +288,57 @@ class LMPTimeseriesBase(Tree[LMP]):
         if self.head is None:
             raise ValueError("Timeseries is empty")
 
-        # helper function for calc coefficients that calculates coefficients
-        # for a node's children and then recursively calls the function for children nodes
-        def calc_coefficients_helper(node: LMP):
-            if node.next and node.coefficient:
-                child_coefficient = node.coefficient / len(node.next)
-                for child_node in node.next:
-                    child_node.coefficient = child_coefficient
-                    calc_coefficients_helper(child_node)
-
-        self.head.coefficient = 1.0
-        calc_coefficients_helper(self.head)
+        # A node's coefficient is split evenly between its children, so it only changes below a branching node: it is
+        # resolved for the first node of every run of only children (each the child of the node before it) and copied
+        # along the run. Run starts are resolved a depth level at a time, parents first, with
+        # coefficient = parent's coefficient / parent's number of children.
+        parent = self.parent_ids()
+        num_children = self._num_children[: self._n]
+        is_start = (parent != np.arange(-1, self._n - 1)) | (num_children[parent] != 1)
+        is_start[0] = True
+        starts = np.flatnonzero(is_start)
+        run = np.cumsum(is_start) - 1
+
+        coefficients = np.ones(len(starts))
+        depth = self.depths()[starts]
+        order = np.argsort(depth, kind="stable")
+        # the first level is the head's
+        for level in np.split(order, np.flatnonzero(np.diff(depth[order])) + 1)[1:]:
+            start_parent = parent[starts[level]]
+            coefficients[level] = coefficients[run[start_parent]] / num_children[start_parent]
+        self.column("coefficient")[:] = coefficients[run]
 
     def weight_coefficients(self, weight: float) -> None:
         """Multiply the coefficients of the nodes by a weight."""
         if self.head is None:
             raise ValueError("Timeseries is empty")
 
-        for node in self.iter_nodes():
-            if node.coefficient:
-                node.coefficient *= weight
+        self.column("coefficient")[:] *= weight
+
+    def reduce_scenarios(
+        self, num_scenarios: Optional[int] = None, tolerance: float = 0.0, merge_tolerance: float = 0.0
+    ) -> ScenarioReduction:
+        """Return a reduced copy of the timeseries with at most num_scenarios branches (see reduce_scenarios)."""
+        return reduce_scenarios(self, num_scenarios, tolerance, merge_tolerance)
+
+    def ids_between(self, start: datetime.datetime, end: datetime.datetime) -> np.ndarray:
+        """Return the ids of the nodes with start <= timestamp < end, sorted by timestamp (ties in id order)."""
+        return self.ids_in_range("timestamp", to_epoch_ns(start), to_epoch_ns(end))
+
+    def time_slice(self, start: datetime.datetime, end: datetime.datetime, show_dummy: bool = False) -> pd.DataFrame:
+        """Return the nodes of every scenario with start <= timestamp < end, one row per node sorted by timestamp."""
+        node_ids = self.ids_between(start, end)
+        if not show_dummy:
+            node_ids = node_ids[~self.column("is_dummy")[node_ids]]
+        return pd.DataFrame(
+            {
+                "node_id": node_ids,
+                "timestamp": self.timestamps(node_ids),
+                "price": self.column("price")[node_ids],
+                "coefficient": self.column("coefficient")[node_ids],
+                "depth": self.depths()[node_ids],
+            }
+        )
 
     def get_node_list(self, show_dummy: bool = True) -> list[LMP]:
         """Create a list of all node objects."""
@@ -141,19 +348,22 @@ class LMPTimeseriesBase(Tree[LMP]):
 
     def plot(self) -> None:
         """Plot the timeseries with connections between each parent and child node."""
+        from matplotlib import pyplot as plt
+
         if self.head is None:
             raise ValueError("Timeseries is empty")
 
-        def plot_node(
-            node: LMP, parent_timestamp: Optional[datetime.datetime] = None, parent_price: Optional[float] = None
-        ):
-            if parent_timestamp is not None and parent_price is not None:
-                plt.plot([parent_timestamp, node.timestamp], [parent_price, node.price], "b-")  # type: ignore
-            for child in node.next:
-                if not child.dummy:
-                    plot_node(child, node.timestamp, node.price)
-
-        plot_node(self.head)
+        # one segment per edge to a non-dummy child, separated by NaT/NaN so they are drawn with a single call
+        parent = self.parent_ids()
+        edges = np.flatnonzero((parent >= 0) & ~self.column("is_dummy"))
+        timestamps = self.column("timestamp").astype("datetime64[ns]")
+        prices = self.column("price")
+        x = np.full((len(edges), 3), np.datetime64("NaT"), dtype="datetime64[ns]")
+        y = np.full((len(edges), 3), np.nan)
+        x[:, 0], x[:, 1] = timestamps[parent[edges]], timestamps[edges]
+        y[:, 0], y[:, 1] = prices[parent[edges]], prices[edges]
+
+        plt.plot(x.ravel(), y.ravel(), "b-")
         plt.xticks(rotation=90)
         plt.xlabel("Timestamp")
         plt.ylabel("Price")
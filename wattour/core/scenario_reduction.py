@@ -0,0 +1,176 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, NamedTuple, Optional
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from .lmp_timeseries_base import LMPTimeseriesBase
+
+
+class ScenarioReduction(NamedTuple):
+    timeseries: LMPTimeseriesBase
+    num_scenarios: int
+    # Distances are probability-weighted sums of |price difference| * hours ($ per MW). Multiplied by the battery's
+    # maximum charge/discharge rate they bound how much the expected revenue of a dispatch schedule can change.
+    distance: float  # selection_distance + merge_distance
+    selection_distance: float  # Kantorovich distance between the original and the selected scenarios
+    merge_distance: float  # error from merging the selected scenarios' prices into shared nodes
+
+
+def scenario_paths(timeseries: LMPTimeseriesBase) -> np.ndarray:
+    """Return the node ids of every root to leaf path (one scenario per leaf), shape (scenarios, path length)."""
+    parent = timeseries.parent_ids()
+    leaves = timeseries.leaf_ids()
+    depths = timeseries.depths()[leaves]
+    if np.any(depths != depths[0]):
+        raise ValueError("All scenarios must have the same length.")
+
+    paths = [leaves]
+    for _ in range(depths[0]):
+        paths.append(parent[paths[-1]])
+    return np.column_stack(paths[::-1])
+
+
+def reduce_scenarios(
+    timeseries: LMPTimeseriesBase,
+    num_scenarios: Optional[int] = None,
+    tolerance: float = 0.0,
+    merge_tolerance: float = 0.0,
+) -> ScenarioReduction:
+    """Reduce the scenarios (root to leaf paths) of a timeseries and merge them into a multi-stage tree.
+
+    Scenarios are selected by fast forward selection until num_scenarios are kept or the selection distance is at most
+    tolerance; the probability of every dropped scenario moves to its closest kept scenario. Kept scenarios then share
+    a node for as long as their prices stay within merge_tolerance ($/MWh) of each other, and each node's coefficient is
+    the probability of the scenarios passing through it. All scenarios must share their timestamps.
+    """
+    if timeseries.head is None:
+        raise ValueError("Timeseries is empty")
+    if num_scenarios is not None and num_scenarios < 1:
+        raise ValueError("num_scenarios must be at least 1")
+
+    paths = scenario_paths(timeseries)
+    timestamps = timeseries.column("timestamp")[paths]
+    if np.any(timestamps != timestamps[0]):
+        raise ValueError("All scenarios must share their timestamps.")
+    prices = timeseries.column("price")[paths]
+    elapsed_hours = timeseries.column("elapsed_hours")[paths[0]]
+    is_dummy = timeseries.column("is_dummy")[paths]
+
+    # a price is held until the next node, so it weighs as much as the next node's elapsed time
+    weights = np.append(elapsed_hours[1:], 0.0)
+    probabilities = _scenario_probabilities(timeseries, paths)
+
+    selected, selection_distance, probabilities = _forward_selection(
+        prices, weights, probabilities, num_scenarios, tolerance
+    )
+    prices, is_dummy = prices[selected], is_dummy[selected]
+
+    # walk forward through the stages, splitting the group of scenarios that share a node once their prices diverge
+    num_selected, length = prices.shape
+    head_coefficient = timeseries.head.coefficient or 1.0
+    node_of = np.zeros(num_selected, dtype=np.int64)  # node id of each scenario at the current stage
+    parents = [-1]
+    node_prices = [prices[0, 0]]
+    node_times = [0]
+    node_hours = [elapsed_hours[0]]
+    node_probabilities = [probabilities.sum()]
+    node_dummy = [is_dummy[0, 0]]
+    merge_distance = 0.0
+
+    for t in range(1, length):
+        # scenarios sorted by node, then price; a cluster ends at a new node or where it would get wider than
+        # merge_tolerance
+        order = np.lexsort((prices[:, t], node_of))
+        sorted_nodes = node_of[order].tolist()
+        sorted_prices = prices[order, t].tolist()
+        starts = [0]
+        for k in range(1, num_selected):
+            start = starts[-1]
+            if sorted_nodes[k] != sorted_nodes[start] or sorted_prices[k] - sorted_prices[start] > merge_tolerance:
+                starts.append(k)
+
+        next_node_of = np.empty_like(node_of)
+        for start, cluster in zip(starts, np.split(order, starts[1:])):
+            mass = probabilities[cluster].sum()
+            price = float(np.dot(probabilities[cluster], prices[cluster, t]) / mass)
+            merge_distance += weights[t] * float(np.dot(probabilities[cluster], np.abs(prices[cluster, t] - price)))
+            next_node_of[cluster] = len(parents)
+            parents.append(sorted_nodes[start])
+            node_prices.append(price)
+            node_times.append(t)
+            node_hours.append(elapsed_hours[t])
+            node_probabilities.append(mass)
+            node_dummy.append(bool(np.all(is_dummy[cluster, t])))
+        node_of = next_node_of
+
+    reduced = type(timeseries)()
+    reduced.tz = timeseries.tz
+    reduced._push_many(
+        np.array(parents, dtype=np.int64),
+        {
+            "is_dummy": node_dummy,
+            "price": node_prices,
+            "timestamp": timestamps[0][node_times],
+            "elapsed_hours": node_hours,
+            "coefficient": head_coefficient * np.array(node_probabilities),
+        },
+    )
+    ptr, _ = reduced.child_index()
+    reduced.size = len(parents)
+    reduced.branches = int(np.count_nonzero(np.diff(ptr) == 0))
+    reduced.dummy_nodes = int(np.count_nonzero(node_dummy))
+
+    return ScenarioReduction(
+        timeseries=reduced,
+        num_scenarios=num_selected,
+        distance=selection_distance + merge_distance,
+        selection_distance=selection_distance,
+        merge_distance=merge_distance,
+    )
+
+
+def _scenario_probabilities(timeseries: LMPTimeseriesBase, paths: np.ndarray) -> np.ndarray:
+    if timeseries.head.coefficient is not None:  # type: ignore[union-attr]
+        probabilities = timeseries.column("coefficient")[paths[:, -1]]
+    else:
+        # what calc_coefficients would give: every node splits its probability evenly between its children
+        num_children = np.diff(timeseries.child_index()[0])
+        probabilities = np.prod(1.0 / num_children[paths[:, :-1]], axis=1)
+    return probabilities / probabilities.sum()
+
+
+def _forward_selection(
+    prices: np.ndarray,
+    weights: np.ndarray,
+    probabilities: np.ndarray,
+    num_scenarios: Optional[int],
+    tolerance: float,
+) -> tuple[np.ndarray, float, np.ndarray]:
+    """Fast forward selection (Heitsch & Roemisch).
+
+    Returns the selected scenarios, the Kantorovich distance to the original distribution and the redistributed
+    probabilities of the selected scenarios.
+    """
+    num = len(prices)
+    distances = np.empty((num, num))
+    for i in range(num):
+        distances[i] = np.abs(prices - prices[i]) @ weights
+
+    selected: list[int] = []
+    closest = np.full(num, np.inf)  # distance of every scenario to its closest selected scenario
+    distance = np.inf
+    while len(selected) < num and (num_scenarios is None or len(selected) < num_scenarios) and distance > tolerance:
+        # distance to the original distribution if each candidate was selected next
+        candidate_distances = probabilities @ np.minimum(closest[:, None], distances)
+        candidate_distances[selected] = np.inf
+        best = int(np.argmin(candidate_distances))
+        selected.append(best)
+        closest = np.minimum(closest, distances[:, best])
+        distance = float(probabilities @ closest)
+
+    selected_ids = np.array(selected)
+    nearest = np.argmin(distances[:, selected_ids], axis=1)
+    redistributed = np.bincount(nearest, weights=probabilities, minlength=len(selected_ids))
+    return selected_ids, distance, redistributed
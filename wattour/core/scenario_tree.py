@@ -0,0 +1,193 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from .lmp_timeseries_base import NS_PER_HOUR, LMPTimeseriesBase
+
+if TYPE_CHECKING:
+    from .lmp import LMP
+
+
+def stage_branching(
+    segment_lengths: Sequence[int], max_nodes: int, max_scenarios: int, add_dummy: bool = True
+) -> list[int]:
+    """Pick the branching factor of every stage so that the tree has at most max_nodes nodes.
+
+    segment_lengths are the number of time steps before the first stage and between the stages (the last one up to the
+    end of the horizon). Stages get one more branch each in turn, from the first, while the tree stays within max_nodes
+    and has at most max_scenarios leaves, so the factors are balanced rather than spent on the cheapest stage.
+    """
+    trunk, *segments = segment_lengths
+    branching = [1] * len(segments)
+
+    def num_nodes(factors: list[int]) -> int:
+        count, leaves = trunk, 1
+        for factor, length in zip(factors, segments):
+            leaves *= factor
+            count += leaves * length
+        return count + (leaves if add_dummy else 0)
+
+    if num_nodes(branching) > max_nodes:
+        raise ValueError(f"A single branch needs {num_nodes(branching)} nodes, more than max_nodes ({max_nodes}).")
+
+    grew = True
+    while grew:
+        grew = False
+        for stage in range(len(segments)):
+            candidate = branching.copy()
+            candidate[stage] += 1
+            if num_nodes(candidate) <= max_nodes and np.prod(candidate) <= max_scenarios:
+                branching = candidate
+                grew = True
+    return branching
+
+
+def build_scenario_tree(
+    timeseries: LMPTimeseriesBase,
+    timestamps: np.ndarray,
+    scenarios: np.ndarray,
+    stages: Sequence[pd.Timedelta | int],
+    max_nodes: int,
+    probabilities: Optional[np.ndarray] = None,
+    add_dummy: bool = True,
+    on_node: Optional[LMP] = None,
+) -> LMPTimeseriesBase:
+    """Add a multi-stage tree of at most max_nodes nodes, built from price scenarios, to on_node (or the head).
+
+    timestamps are UTC epoch nanoseconds of shape (T,) and scenarios has shape (S, T). stages are where the tree
+    branches: offsets from the first timestamp or time step indices. Branching factors come from stage_branching. At
+    each stage, the scenarios of every node are sorted by their mean price until the next stage and cut into groups of
+    equal probability (quantiles), and each group becomes a child branch priced at the group's probability-weighted
+    mean. Coefficients are the probabilities of the nodes (times on_node's coefficient), so calc_coefficients must not
+    be called afterwards. Mutates and returns timeseries.
+    """
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    scenarios = np.atleast_2d(np.asarray(scenarios, dtype=np.float64))
+    num_scenarios, length = scenarios.shape
+    if length == 0 or num_scenarios == 0:
+        raise ValueError("No prices were given.")
+    if len(timestamps) != length:
+        raise ValueError("Timestamps and prices must have the same length.")
+    if np.any(np.diff(timestamps) <= 0):
+        raise ValueError("Timestamps must be increasing.")
+    if probabilities is None:
+        probabilities = np.full(num_scenarios, 1.0 / num_scenarios)
+    else:
+        probabilities = np.asarray(probabilities, dtype=np.float64) / np.sum(probabilities)
+
+    starts = set()
+    for stage in stages:
+        if isinstance(stage, (int, np.integer)):
+            if stage < 0:
+                raise ValueError("Stages must be within the horizon.")
+            starts.add(min(int(stage), length))
+        else:
+            starts.add(int(np.searchsorted(timestamps, timestamps[0] + pd.Timedelta(stage).value)))
+    starts = sorted(starts - {length})
+    bounds = [0, *starts, length]
+    branching = stage_branching(np.diff(bounds).tolist(), max_nodes, num_scenarios, add_dummy)
+
+    prev_node = on_node if on_node else timeseries.head
+    if prev_node is None:
+        if starts and starts[0] == 0:
+            raise ValueError("An empty timeseries can't branch at its head.")
+        parent = -1
+        parent_coefficient = 1.0
+        parent_time = None
+    else:
+        if prev_node.dummy:
+            raise ValueError("Cannot add a node to a dummy node.")
+        if timeseries.head.coefficient is None:  # type: ignore[union-attr]
+            timeseries.calc_coefficients()
+        parent = timeseries._index_of(prev_node)
+        parent_coefficient = float(timeseries.column("coefficient")[parent])
+        parent_time = int(timeseries.column("timestamp")[parent])
+        if timestamps[0] <= parent_time:
+            raise ValueError("The new_node timestamp must be greater than the prev_node timestamp.")
+
+    # nodes are laid out branch by branch, stage by stage; groups are the last node and the scenarios of each branch
+    first = timeseries._n
+    parents: list[np.ndarray] = []
+    prices: list[np.ndarray] = []
+    times: list[np.ndarray] = []
+    masses: list[np.ndarray] = []
+    num_new = 0
+    groups = [(parent, np.arange(num_scenarios))]
+    for stage, (start, end) in enumerate(zip(bounds[:-1], bounds[1:])):
+        if end == start:
+            continue
+        next_groups = []
+        for group_parent, group in groups:
+            if stage == 0:
+                children = [group]
+            else:
+                # equal probability quantiles of the scenarios' mean price over the segment: each scenario goes to the
+                # quantile its probability mass is centered in
+                order = group[np.argsort(scenarios[group, start:end].mean(axis=1), kind="stable")]
+                mass = probabilities[order]
+                centers = (np.cumsum(mass) - mass / 2) / mass.sum()
+                quantile = np.minimum((centers * branching[stage - 1]).astype(np.int64), branching[stage - 1] - 1)
+                children = np.split(order, np.flatnonzero(np.diff(quantile)) + 1)
+            for child in children:
+                mass = probabilities[child].sum()
+                branch_first = first + num_new
+                num_new += end - start
+                branch_parents = np.arange(branch_first - 1, branch_first - 1 + end - start)
+                branch_parents[0] = group_parent
+                parents.append(branch_parents)
+                prices.append(probabilities[child] @ scenarios[child, start:end] / mass)
+                times.append(np.arange(start, end))
+                masses.append(np.full(end - start, mass))
+                next_groups.append((branch_first + end - start - 1, child))
+        groups = next_groups
+
+    node_parents = np.concatenate(parents)
+    node_times = np.concatenate(times)
+    node_prices = np.concatenate(prices)
+    node_masses = np.concatenate(masses)
+    node_timestamps = timestamps[node_times]
+    is_dummy = np.zeros(len(node_parents), dtype=np.bool_)
+
+    if add_dummy:
+        if length == 1 and parent_time is None:
+            raise ValueError("Previous node does not have an elapsed time")
+        # the dummy closes the last interval, so it repeats its length
+        last_step = timestamps[-1] - (timestamps[-2] if length > 1 else parent_time)
+        leaves = np.array([leaf for leaf, _ in groups], dtype=np.int64)
+        node_parents = np.concatenate([node_parents, leaves])
+        node_prices = np.concatenate([node_prices, np.zeros(len(leaves))])
+        node_timestamps = np.concatenate([node_timestamps, np.full(len(leaves), timestamps[-1] + last_step)])
+        node_masses = np.concatenate([node_masses, [probabilities[group].sum() for _, group in groups]])
+        is_dummy = np.concatenate([is_dummy, np.ones(len(leaves), dtype=np.bool_)])
+
+    parent_timestamps = np.where(
+        node_parents >= first,
+        node_timestamps[np.maximum(node_parents - first, 0)],
+        parent_time if parent_time is not None else 0,
+    )
+    elapsed = (node_timestamps - parent_timestamps) / NS_PER_HOUR
+    elapsed[node_parents < 0] = np.nan
+
+    had_children = parent >= 0 and timeseries._num_children[parent] > 0
+    timeseries._push_many(
+        node_parents,
+        {
+            "is_dummy": is_dummy,
+            "price": node_prices,
+            "timestamp": node_timestamps,
+            "elapsed_hours": elapsed,
+            "coefficient": parent_coefficient * node_masses,
+        },
+    )
+
+    num_leaves = len(groups)
+    timeseries.branches += num_leaves if had_children else num_leaves - 1
+    if parent < 0:
+        timeseries.branches += 1
+    timeseries.size += len(node_parents)
+    if add_dummy:
+        timeseries.dummy_nodes += num_leaves
+    return timeseries
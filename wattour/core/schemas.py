@@ -0,0 +1,14 @@
+import pandas as pd
+import pandera as pa
+from pandas.api.types import is_numeric_dtype
+from pandera.typing import Series
+
+
+class LMPDataFrame(pa.DataFrameModel):
+    price: Series
+    timestamp: Series[pd.DatetimeTZDtype] = pa.Field(dtype_kwargs={"unit": "ns", "tz": "UTC"})
+
+    # temporary, until decide float or int
+    @pa.check("price")
+    def check_is_number(self, column_header: Series):
+        return is_numeric_dtype(column_header)
@@ -0,0 +1,46 @@
+import os
+import struct
+import zipfile
+from pathlib import Path
+from typing import IO
+
+import numpy as np
+
+# size of the fixed part of a zip local file header; the file name and extra field lengths are its last 4 bytes
+_LOCAL_HEADER_SIZE = 30
+
+
+def load_npz(file: str | os.PathLike | IO[bytes], mmap: bool = True) -> dict[str, np.ndarray]:
+    """Load all arrays of an .npz file.
+
+    With mmap, the uncompressed arrays of a file on disk are memory-mapped copy-on-write instead of read: loading costs
+    nothing up front, pages are read as they are touched and writes never reach the file. Compressed members, object
+    arrays and file objects are read normally.
+    """
+    if not mmap or not isinstance(file, (str, os.PathLike)):
+        with np.load(file) as data:
+            return {name: data[name] for name in data.files}
+
+    arrays = {}
+    with zipfile.ZipFile(file) as archive, Path(file).open("rb") as raw:
+        for info in archive.infolist():
+            name = info.filename.removesuffix(".npy")
+            raw.seek(info.header_offset)
+            name_length, extra_length = struct.unpack("<HH", raw.read(_LOCAL_HEADER_SIZE)[26:30])
+            raw.seek(info.header_offset + _LOCAL_HEADER_SIZE + name_length + extra_length)
+
+            if info.compress_type == zipfile.ZIP_STORED:
+                version = np.lib.format.read_magic(raw)
+                if version == (1, 0):
+                    shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(raw)
+                else:
+                    shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(raw)
+                if not dtype.hasobject and np.prod(shape) > 0:
+                    arrays[name] = np.memmap(
+                        file, dtype=dtype, mode="c", offset=raw.tell(), shape=shape, order="F" if fortran_order else "C"
+                    ).view(np.ndarray)
+                    continue
+
+            with archive.open(info) as member:
+                arrays[name] = np.lib.format.read_array(member)
+    return arrays
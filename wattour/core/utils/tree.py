@@ -1,24 +1,65 @@
 from __future__ import annotations
 
 import collections
-import uuid
+import os
 from abc import ABC, abstractmethod
-from typing import Generator, Generic, Optional, Self, TypeVar
+from typing import IO, Any, ClassVar, Generator, Generic, NamedTuple, Optional, Self, TypeVar
+
+import numpy as np
+
+from .npz import load_npz
 
 U = TypeVar("U", bound="BaseNode")
 
 
 class BaseNode(Generic[U], ABC):
+    # A node is either detached (it holds its own values until it is appended to a tree) or a lightweight view onto
+    # one row of a Tree's column storage. Attached nodes are identified by their tree-assigned, dense integer id.
+    # Nodes are slotted (subclasses must declare __slots__ too), so a view is three pointers and no __dict__.
+
+    __slots__ = ("_tree", "_index", "_values")
+
+    # per-node values stored by a Tree for this node type, as {attribute name: numpy dtype}
+    columns: ClassVar[dict[str, Any]] = {}
+
     def __init__(self):
-        self.id = uuid.uuid4()
-        self.next: list[U] = []
+        self._tree: Optional[Tree] = None
+        self._index = -1
+        self._values: Optional[dict[str, Any]] = {}
+
+    @classmethod
+    def _view(cls, tree: Tree, index: int) -> Self:
+        node = cls.__new__(cls)
+        node._tree = tree
+        node._index = index
+        node._values = None
+        return node
+
+    @property
+    def id(self) -> Optional[int]:
+        return self._index if self._tree is not None else None
+
+    @property
+    def next(self) -> list[U]:
+        if self._tree is None:
+            return []
+        return self._tree.children(self)
 
     @property
     @abstractmethod
     def dummy(self) -> bool: ...
 
-    def add(self, node: U):
-        self.next.append(node)
+    def _get(self, name: str) -> Any:
+        if self._tree is None:
+            return self._values[name]  # type: ignore[index]
+        return self._tree._columns[name][self._index]
+
+    def _set(self, name: str, value: Any) -> None:
+        if self._tree is None:
+            self._values[name] = value  # type: ignore[index]
+        else:
+            self._tree._columns[name][self._index] = value
+            self._tree._indexes.pop(name, None)
 
 
 #
@@ -29,10 +70,22 @@ T = TypeVar("T", bound="Node")
 class Node(BaseNode[T], ABC):
     # type of node that has value, validates input, and enriches input
 
+    __slots__ = ()
+
+    columns: ClassVar[dict[str, Any]] = {"is_dummy": np.bool_}
+
     def __init__(self, is_dummy: bool = False):
         super().__init__()
         self.is_dummy = is_dummy
 
+    @property
+    def is_dummy(self) -> bool:
+        return bool(self._get("is_dummy"))
+
+    @is_dummy.setter
+    def is_dummy(self, value: bool) -> None:
+        self._set("is_dummy", value)
+
     @property
     def dummy(self) -> bool:
         return self.is_dummy
@@ -49,54 +102,408 @@ class Node(BaseNode[T], ABC):
 V = TypeVar("V", bound=Node)
 
 
+class _SortedIndex(NamedTuple):
+    """The ids of the nodes with id < count sorted by a key (ties in id order), and their sorted keys.
+
+    Indexes are replaced rather than changed in place, so trees and their copies can share them.
+    """
+
+    order: np.ndarray
+    keys: np.ndarray
+    count: int
+
+
+def _extend_index(index: Optional[_SortedIndex], keys: np.ndarray) -> _SortedIndex:
+    """Merge the nodes added since index was built into it; keys holds the key of every node, indexed by id."""
+    count = 0 if index is None else index.count
+    if index is not None and count == len(keys):
+        return index
+
+    new_keys = keys[count:]
+    new_order = np.argsort(new_keys, kind="stable")
+    new_ids = new_order + count
+    new_keys = new_keys[new_order]
+    if index is None or count == 0:
+        return _SortedIndex(new_ids, new_keys, len(keys))
+    # new ids are larger than the indexed ones, so inserting them after equal keys keeps ties in id order
+    position = np.searchsorted(index.keys, new_keys, side="right")
+    return _SortedIndex(np.insert(index.order, position, new_ids), np.insert(index.keys, position, new_keys), len(keys))
+
+
+def _depths(parent: np.ndarray, first: int, depth: np.ndarray) -> np.ndarray:
+    """Depths of nodes stored at ids first onwards with the given parents; depth holds those of the ids before first."""
+    count = len(parent)
+    position = np.arange(count)
+    # nodes mostly come in runs where each is the child of the one before (branches), so only the depths of the runs'
+    # first nodes are resolved and the others count up from them
+    is_start = parent != position + first - 1
+    if count:
+        is_start[0] = True
+    starts = np.flatnonzero(is_start)
+    run = np.cumsum(is_start) - 1
+    offset = position - starts[run]
+
+    # a run starts below a node outside the batch, whose depth is known, or below a node of an earlier run; pointer
+    # jumping then doubles the distance to a run whose depth is known each round
+    start_parent = parent[starts]
+    ancestor = np.full(len(starts), -1, dtype=np.int64)
+    distance = np.zeros(len(starts), dtype=np.int64)
+    known = start_parent < first
+    has_parent = known & (start_parent >= 0)
+    distance[has_parent] = depth[start_parent[has_parent]] + 1
+    inside = np.flatnonzero(~known)
+    ancestor[inside] = run[start_parent[inside] - first]
+    distance[inside] = offset[start_parent[inside] - first] + 1
+    while len(inside):
+        step = ancestor[inside]
+        distance[inside] += distance[step]
+        ancestor[inside] = ancestor[step]
+        inside = inside[ancestor[inside] >= 0]
+    return distance[run] + offset
+
+
 # this is a little wrong bc i want it to work for different types of nodes
 class Tree(Generic[V]):
+    # Nodes are stored column-wise (struct of arrays): a parent index per node plus one array per entry of
+    # node_type.columns. Nodes are numbered in insertion order, so a parent always has a smaller id than its children
+    # and siblings are ordered by id. Node objects are only built on demand as views.
+    #
+    # Nodes are only ever added, so the depth of every node is stored as it is added, and the leaf list and the sorted
+    # indexes (on depth and indexed_columns) only merge in the nodes added since they were last queried. Setting an
+    # indexed value through a node drops that index; the arrays returned by column() must not be written to for them.
+
+    node_type: ClassVar[type[Node]] = Node
+    indexed_columns: ClassVar[tuple[str, ...]] = ()
+
     def __init__(self):
-        self.head: Optional[V] = None
         self.size = 0  # excludes dummies
         self.branches = 0
         self.dummy_nodes = 0
 
+        self._n = 0
+        self._parent = np.empty(0, dtype=np.int64)
+        self._num_children = np.empty(0, dtype=np.int64)
+        self._depth = np.empty(0, dtype=np.int64)
+        self._columns = {name: np.empty(0, dtype=dtype) for name, dtype in self.node_type.columns.items()}
+        self._reset_indexes()
+        self._invalidate()
+
+    def _reset_indexes(self) -> None:
+        self._indexes: dict[str, _SortedIndex] = {}
+        self._leaves = (np.empty(0, dtype=np.int64), 0)  # leaf ids among the first count nodes, count
+
+    def _invalidate(self) -> None:
+        """Drop the cached child index and traversal orders; called whenever the structure of the tree changes."""
+        self._csr: Optional[tuple[np.ndarray, np.ndarray]] = None
+        self._preorder: Optional[np.ndarray] = None
+        self._postorder: Optional[np.ndarray] = None
+
+    @property
+    def head(self) -> Optional[V]:
+        if self._n == 0:
+            return None
+        return self.node(0)
+
+    def node(self, node_id: int) -> V:
+        """Return a view of the node with the given id."""
+        if not 0 <= node_id < self._n:
+            raise IndexError(f"No node with id {node_id}")
+        return self.node_type._view(self, node_id)  # type: ignore[return-value]
+
+    def parent_ids(self) -> np.ndarray:
+        """Return the parent id of every node (-1 for the head), indexed by node id."""
+        return self._parent[: self._n]
+
+    def column(self, name: str) -> np.ndarray:
+        """Return the stored values of a node field for every node, indexed by node id."""
+        return self._columns[name][: self._n]
+
+    def depths(self) -> np.ndarray:
+        """Return the depth of every node (0 for the head), indexed by node id."""
+        return self._depth[: self._n]
+
+    def leaf_ids(self) -> np.ndarray:
+        """Return the ids of the nodes without children (the ends of the scenarios), in id order."""
+        leaves, count = self._leaves
+        if count < self._n:
+            num_children = self._num_children
+            # nodes only ever gain children, so earlier leaves are filtered and only the new nodes are scanned
+            new_leaves = count + np.flatnonzero(num_children[count : self._n] == 0)
+            leaves = np.concatenate([leaves[num_children[leaves] == 0], new_leaves])
+            self._leaves = (leaves, self._n)
+        return leaves
+
+    def ids_in_range(self, name: str, low: Any, high: Any) -> np.ndarray:
+        """Return the ids of the nodes whose depth (name="depth") or indexed column is in [low, high).
+
+        Ids are sorted by that value, ties in id order. A query is a binary search once the index has merged in the
+        nodes added since the previous query.
+        """
+        if name == "depth":
+            keys = self.depths()
+        elif name in self.indexed_columns:
+            keys = self.column(name)
+        else:
+            raise ValueError(f"No index on '{name}'")
+        index = _extend_index(self._indexes.get(name), keys)
+        self._indexes[name] = index
+        return index.order[np.searchsorted(index.keys, low) : np.searchsorted(index.keys, high)]
+
+    def ids_at_depth(self, depth: int) -> np.ndarray:
+        """Return the ids of the nodes at the given depth (the head's children are at depth 1), in id order."""
+        return self.ids_in_range("depth", depth, depth + 1)
+
+    def children(self, node: V) -> list[V]:
+        """Return views of the children of a node, in insertion order."""
+        ptr, child_ids = self.child_index()
+        index = self._index_of(node)
+        return [self.node_type._view(self, int(i)) for i in child_ids[ptr[index] : ptr[index + 1]]]  # type: ignore[misc]
+
+    def child_index(self) -> tuple[np.ndarray, np.ndarray]:
+        """Return the children of every node in CSR form.
+
+        The children of node i are child_ids[ptr[i]:ptr[i + 1]]. Built lazily and cached until the tree changes.
+        """
+        if self._csr is None:
+            parent = self._parent[: self._n]
+            order = np.argsort(parent, kind="stable")
+            ptr = np.zeros(self._n + 1, dtype=np.int64)
+            np.cumsum(self._num_children[: self._n], out=ptr[1:])
+            self._csr = (ptr, order[self._n - int(ptr[-1]) :])
+        return self._csr
+
+    # traversal: every tree algorithm walks the tree through these explicit-stack orders instead of recursing, so the
+    # depth of a tree is only limited by memory
+
+    def preorder_ids(self) -> np.ndarray:
+        """Return node ids in depth-first pre-order (each node before its children, children in insertion order).
+
+        This is a topological order of the tree. Cached until the tree changes.
+        """
+        if self._preorder is None:
+            ptr, child_ids = self.child_index()
+            ptr_list, child_list = ptr.tolist(), child_ids.tolist()
+            order = []
+            stack = [0] if self._n else []
+            while stack:
+                cur = stack.pop()
+                order.append(cur)
+                stack.extend(reversed(child_list[ptr_list[cur] : ptr_list[cur + 1]]))
+            self._preorder = np.array(order, dtype=np.int64)
+        return self._preorder
+
+    def postorder_ids(self) -> np.ndarray:
+        """Return node ids in depth-first post-order (each node after its children). Cached until the tree changes."""
+        if self._postorder is None:
+            ptr, child_ids = self.child_index()
+            ptr_list, child_list = ptr.tolist(), child_ids.tolist()
+            # node, then its subtrees from the last child to the first, is exactly post-order reversed
+            order = []
+            stack = [0] if self._n else []
+            while stack:
+                cur = stack.pop()
+                order.append(cur)
+                stack.extend(child_list[ptr_list[cur] : ptr_list[cur + 1]])
+            self._postorder = np.array(order[::-1], dtype=np.int64)
+        return self._postorder
+
+    def iter_preorder(self, show_dummy: bool = True) -> Generator[V]:
+        is_dummy = self._columns["is_dummy"]
+        for node_id in self.preorder_ids().tolist():
+            if show_dummy or not is_dummy[node_id]:
+                yield self.node_type._view(self, node_id)  # type: ignore[arg-type, misc]
+
+    def iter_postorder(self, show_dummy: bool = True) -> Generator[V]:
+        is_dummy = self._columns["is_dummy"]
+        for node_id in self.postorder_ids().tolist():
+            if show_dummy or not is_dummy[node_id]:
+                yield self.node_type._view(self, node_id)  # type: ignore[arg-type, misc]
+
+    def _index_of(self, node: V) -> int:
+        if node._tree is not self:
+            raise ValueError("Node does not belong to this tree.")
+        return node._index
+
+    def _reserve(self, count: int) -> None:
+        capacity = len(self._parent)
+        if self._n + count <= capacity:
+            return
+
+        capacity = max(2 * capacity, self._n + count, 16)
+
+        def grow(array: np.ndarray) -> np.ndarray:
+            grown = np.empty(capacity, dtype=array.dtype)
+            grown[: self._n] = array[: self._n]
+            return grown
+
+        self._parent = grow(self._parent)
+        self._num_children = grow(self._num_children)
+        self._depth = grow(self._depth)
+        self._columns = {name: grow(array) for name, array in self._columns.items()}
+
+    def _push(self, node: V, parent: int) -> int:
+        """Store a detached node as a child of the node with id parent (-1 for the head) and bind it to this tree."""
+        if node._tree is not None:
+            raise ValueError("Node already belongs to a tree.")
+        if not isinstance(node, self.node_type):
+            raise TypeError(f"Expected a {self.node_type.__name__} node")
+
+        self._reserve(1)
+        index = self._n
+        self._parent[index] = parent
+        self._num_children[index] = 0
+        self._depth[index] = self._depth[parent] + 1 if parent >= 0 else 0
+        for name, array in self._columns.items():
+            array[index] = node._values[name]  # type: ignore[index]
+        if parent >= 0:
+            self._num_children[parent] += 1
+
+        self._n += 1
+        self._invalidate()
+        node._tree = self
+        node._index = index
+        node._values = None
+        return index
+
+    def _push_many(self, parent: np.ndarray, values: dict[str, Any]) -> np.ndarray:
+        """Store several nodes at once and return their ids.
+
+        parent holds the parent id of each new node (parents must come before their children) and values an array or
+        scalar for each of node_type.columns. Nothing is validated or enriched; callers are expected to do that in bulk.
+        """
+        count = len(parent)
+        ids = np.arange(self._n, self._n + count)
+        if np.any(parent >= ids):
+            raise ValueError("Parents must be added before their children.")
+
+        self._reserve(count)
+        new = slice(self._n, self._n + count)
+        self._parent[new] = parent
+        self._num_children[new] = 0
+        self._depth[new] = _depths(parent, self._n, self._depth)
+        for name, array in self._columns.items():
+            array[new] = values[name]
+        self._n += count
+        np.add.at(self._num_children, parent[parent >= 0], 1)
+
+        self._invalidate()
+        return ids
+
+    def _extend(self, other: Tree[V], start: int, parent: int) -> None:
+        """Copy the nodes of other with id >= start; those whose parent has an id < start are attached to parent."""
+        count = other._n - start
+        if count <= 0:
+            return
+
+        self._reserve(count)
+        offset = self._n - start
+        other_parent = other._parent[start : other._n]
+        reattached = other_parent < start
+        new = slice(self._n, self._n + count)
+        self._parent[new] = np.where(reattached, parent, other_parent + offset)
+        self._num_children[new] = other._num_children[start : other._n]
+        # the node start is always reattached, and the nodes reattached by add_branch and merge_trees share a depth
+        self._depth[new] = other._depth[start : other._n] + (self._depth[parent] + 1 - other._depth[start])
+        for name, array in self._columns.items():
+            array[new] = other._columns[name][start : other._n]
+        self._num_children[parent] += np.count_nonzero(reattached)
+
+        self._n += count
+        self._invalidate()
+
     # ^^ i think append (or a prelude) will just become polymorphic and V will be bound to different node types
     def append(self, existing_node: V | None, new_node: V):
-        if not existing_node:
+        if existing_node is None:
             if self.head:
                 raise ValueError("Tree already has a head")
-            self.head = new_node
+            self._push(new_node, -1)
             self.branches += 1
         else:
+            parent = self._index_of(existing_node)
             new_node.validate(existing_node)
             new_node.enrich(existing_node)
-            existing_node.add(new_node)
+            self._push(new_node, parent)
 
-            if len(existing_node.next) > 1:
+            if self._num_children[parent] > 1:
                 self.branches += 1
 
         self.size += 1
 
     def copy(self) -> Self:
         new_tree = type(self)()
-
-        def copy_helper(old_node: V) -> V:
-            new_children = []
-            for child in old_node.next:
-                new_children.append(copy_helper(child))
-            old_node_attrs = vars(old_node).copy()
-            old_node_attrs.pop("next", None)
-            old_node_attrs.pop("id", None)
-            new_node = type(old_node)(**old_node_attrs)
-            new_node.next = new_children
-            return new_node
-
-        new_head = None
-        if self.head is not None:
-            new_head = copy_helper(self.head)
-        new_tree.head = new_head
+        new_tree._n = self._n
+        new_tree._parent = self._parent[: self._n].copy()
+        new_tree._num_children = self._num_children[: self._n].copy()
+        new_tree._depth = self._depth[: self._n].copy()
+        new_tree._columns = {name: array[: self._n].copy() for name, array in self._columns.items()}
         new_tree.size = self.size
         new_tree.branches = self.branches
         new_tree.dummy_nodes = self.dummy_nodes
+        # the structure is the same, and cached indexes are replaced rather than changed in place, so they can be shared
+        new_tree._csr = self._csr
+        new_tree._preorder = self._preorder
+        new_tree._postorder = self._postorder
+        new_tree._indexes = self._indexes.copy()
+        new_tree._leaves = self._leaves
         return new_tree
 
+    def __getstate__(self) -> dict[str, Any]:
+        """Pickle only the used part of the arrays and leave out what can be rebuilt, e.g. for worker processes."""
+        state = self.__dict__.copy()
+        state["_parent"] = self._parent[: self._n]
+        state["_columns"] = {name: array[: self._n] for name, array in self._columns.items()}
+        for name in ("_num_children", "_depth", "_indexes", "_leaves", "_csr", "_preorder", "_postorder"):
+            del state[name]
+        return state
+
+    def __setstate__(self, state: dict[str, Any]) -> None:
+        """Restore a pickled tree and rebuild the child counts, depths and indexes."""
+        self.__dict__.update(state)
+        parent = self._parent[1:] if self._n else self._parent
+        self._num_children = np.bincount(parent, minlength=self._n).astype(np.int64)
+        self._depth = _depths(self._parent[: self._n], 0, np.empty(0, dtype=np.int64))
+        self._reset_indexes()
+        self._invalidate()
+
+    def save(self, file: str | os.PathLike | IO[bytes]) -> None:
+        """Write the node arrays and counts to an uncompressed .npz file (see load)."""
+        np.savez(
+            file,
+            _parent=self._parent[: self._n],
+            _counts=np.array([self.size, self.branches, self.dummy_nodes], dtype=np.int64),
+            **{name: array[: self._n] for name, array in self._columns.items()},
+            **self._save_extra(),
+        )
+
+    def _save_extra(self) -> dict[str, np.ndarray]:
+        """Return the arrays a subclass saves along with the nodes; load passes them back to _load_extra."""
+        return {}
+
+    def _load_extra(self, arrays: dict[str, np.ndarray]) -> None:
+        pass
+
+    @classmethod
+    def load(cls, file: str | os.PathLike | IO[bytes], mmap: bool = True) -> Self:
+        """Read a tree written by save.
+
+        With mmap, a file on disk is memory-mapped copy-on-write: the arrays are not read until used and changes to the
+        tree never reach the file.
+        """
+        arrays = load_npz(file, mmap)
+        parent = arrays["_parent"].astype(np.int64, copy=False)
+        if len(parent) and (parent[0] != -1 or np.any(parent[1:] >= np.arange(1, len(parent)))):
+            raise ValueError("Parents must be stored before their children.")
+
+        tree = cls()
+        tree._n = len(parent)
+        tree._parent = parent
+        tree._num_children = np.bincount(parent[1:], minlength=tree._n).astype(np.int64)
+        tree._depth = _depths(parent, 0, tree._depth)
+        tree._columns = {name: arrays[name].astype(dtype, copy=False) for name, dtype in cls.node_type.columns.items()}
+        tree.size, tree.branches, tree.dummy_nodes = arrays["_counts"].tolist()
+        tree._load_extra(arrays)
+        return tree
+
     def append_dummy(self, existing_node: V, dummy_node: V):
         if not dummy_node.is_dummy:
             raise ValueError("new_node must have is_dummy=True")
@@ -109,28 +516,35 @@ class Tree(Generic[V]):
         if not self.head:
             raise ValueError("Timeseries is empty")
 
-        q = collections.deque([self.head])
+        ptr, child_ids = self.child_index()
+        is_dummy = self._columns["is_dummy"]
+        q = collections.deque([0])
         while q:
             cur = q.popleft()
-            if not show_dummy and cur.dummy:
+            if not show_dummy and is_dummy[cur]:
                 continue
 
-            yield cur
-            if cur.next:
-                q.extend(cur.next)
+            yield self.node_type._view(self, cur)  # type: ignore[misc]
+            q.extend(child_ids[ptr[cur] : ptr[cur + 1]].tolist())
 
     def add_branch(self, node: V, branch: Self):
-        """Add a branch to a node."""
+        """Add a branch to a node.
+
+        The nodes of the branch are copied into this tree, so nodes of branch are not nodes of this tree.
+        """
         if node.dummy:
             raise ValueError("Cannot add a branch to a dummy node.")
+        if branch.head is None:
+            raise ValueError("Cannot add an empty branch.")
+        parent = self._index_of(node)
 
-        if not node.next:
+        if not self._num_children[parent]:
             self.branches += 1
         self.branches += branch.branches - 1
         self.size += branch.size
         self.dummy_nodes += branch.dummy_nodes
 
-        node.next.append(branch.head)
+        self._extend(branch, 0, parent)
 
     # mutating
     @staticmethod
@@ -141,15 +555,14 @@ class Tree(Generic[V]):
         if not second_tree.head:
             return first_tree
 
-        if second_tree.head.next:
-            if first_tree.head.next:
+        if second_tree._num_children[0]:
+            if first_tree._num_children[0]:
                 first_tree.branches += 1
             first_tree.branches += second_tree.branches - 1
             first_tree.size += second_tree.size - 1
             first_tree.dummy_nodes += second_tree.dummy_nodes
 
-        for node in second_tree.head.next:
-            first_tree.head.add(node)
+        first_tree._extend(second_tree, 1, 0)
         return first_tree
 
     def __str__(self):
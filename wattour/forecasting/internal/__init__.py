@@ -1,3 +1,3 @@
 from .forecasting_model_base import ForecastingModelBase
-from .xgboost.regressor_base import XGBRegressorBase
-from .xgboost.time_features_regressor import XGBTimeFeaturesRegressor
\ No newline at end of file
+from .xgboost.regressor_base import ModelUpdate, XGBRegressorBase
+from .xgboost.time_features_regressor import XGBTimeFeaturesRegressor
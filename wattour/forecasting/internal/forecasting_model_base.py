@@ -1,6 +1,5 @@
 from abc import ABC, abstractmethod
 from pathlib import Path
-from typing import overload
 
 import pandas as pd
 
@@ -13,7 +12,7 @@ from wattour.core.lmp_timeseries_base import LMPTimeseriesBase
 
 class ForecastingModelBase(ABC):
     @abstractmethod
-    def predict(head: LMP, df:pd.DataFrame) -> LMPTimeseriesBase:
+    def predict(self, head: LMP, df: pd.DataFrame) -> LMPTimeseriesBase:
         pass
 
     @abstractmethod
@@ -1,29 +1,119 @@
+import multiprocessing
+import os
 import time
+import warnings
 from abc import abstractmethod
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+from typing import Literal, NamedTuple, Optional, Sequence
 
 import numpy as np
 import pandas as pd
 import pandera as pa
-import xgboost as xgb
-from matplotlib import pyplot as plt
 from pandera.typing import Series
-from sklearn.metrics import mean_squared_error
-from sklearn.model_selection import TimeSeriesSplit
 
-from wattour.core.lmp_timeseries_base import LMPTimeseriesBase
+from wattour.core.lmp_timeseries_base import LMPTimeseriesBase, timestamps_to_epoch_ns
+from wattour.core.scenario_tree import build_scenario_tree
 from wattour.forecasting.internal.forecasting_model_base import ForecastingModelBase
 
 
+def _fit_fold(
+    X: np.ndarray | pd.DataFrame,
+    y: np.ndarray,
+    train: slice,
+    test: slice,
+    params: dict,
+    num_boost_round: int,
+    early_stopping_rounds: Optional[int],
+) -> bytearray:
+    """Fit the model of one fold as XGBRegressor.fit does with the eval sets (train, test) and return it serialized.
+
+    The training matrix is built once and also serves as the first eval set, and the test matrix is binned with its
+    quantile cuts instead of sketching its own.
+    """
+    import xgboost as xgb
+
+    dtrain = xgb.QuantileDMatrix(X[train], y[train], enable_categorical=True)
+    dtest = xgb.QuantileDMatrix(X[test], y[test], ref=dtrain, enable_categorical=True)
+    booster = xgb.train(
+        params,
+        dtrain,
+        num_boost_round,
+        evals=[(dtrain, "validation_0"), (dtest, "validation_1")],
+        early_stopping_rounds=early_stopping_rounds,
+        verbose_eval=100,
+    )
+    return booster.save_raw("ubj")
+
+
+# the feature matrix and targets of a worker process of the fold pool, sent once per worker by _share_fold_data
+_fold_data: Optional[tuple[np.ndarray | pd.DataFrame, np.ndarray]] = None
+
+
+def _share_fold_data(X: np.ndarray | pd.DataFrame, y: np.ndarray) -> None:
+    global _fold_data
+    _fold_data = (X, y)
+
+
+def _fit_shared_fold(
+    train: slice, test: slice, params: dict, num_boost_round: int, early_stopping_rounds: Optional[int]
+) -> bytearray:
+    """Run _fit_fold on the data shared with the worker process."""
+    return _fit_fold(*_fold_data, train, test, params, num_boost_round, early_stopping_rounds)  # type: ignore[misc]
+
+
+def _iteration_range(booster) -> tuple[int, int]:
+    """Return the trees XGBRegressor.predict uses: up to the best iteration if the model was early stopped, else all."""
+    best_iteration = booster.attr("best_iteration")
+    return (0, int(best_iteration) + 1) if best_iteration is not None else (0, 0)
+
+
+def _without_early_stopping(booster):
+    """Drop the trees after the best iteration of an early stopped booster, so that new trees are used too."""
+    best_iteration = booster.attr("best_iteration")
+    if best_iteration is not None:
+        booster = booster[: int(best_iteration) + 1]
+    booster.set_attr(best_iteration=None, best_score=None)
+    return booster
+
+
+class ModelUpdate(NamedTuple):
+    action: Literal["continue", "refresh", "retrain", "retrain_required"]
+    rmse: float  # of the averaged models on the new data, before the update
+    baseline_rmse: float  # what rmse was compared against to detect drift
+
+
+class FeatureMatrix(NamedTuple):
+    """The output of create_features, with a row per row of the input frame.
+
+    values is one C-contiguous float32 block if every feature is numeric or boolean, else the DataFrame itself, so that
+    categorical and other features keep their dtypes. Both are sliced by row with values[rows].
+    """
+
+    key: np.ndarray  # hash of each input row the features were computed from
+    index: pd.Index
+    columns: list[str]
+    values: np.ndarray | pd.DataFrame
+
+
 # base class for forecasting XGBoost regressor models
 class XGBRegressorBase(ForecastingModelBase):
     class InputDataframe(pa.DataFrameModel):
         timestamp: Series[pd.DatetimeTZDtype(unit="ns", tz="UTC")]
 
+    # set by subclasses whose create_features never reads the y column, so that feature_matrix can ignore it
+    features_ignore_y = False
+
     def __init__(self, num_folds: int, y_col: str = "price"):
         self.num_folds = num_folds
         self.y_col = y_col
         self.regs = []
+        self._features: Optional[FeatureMatrix] = None
+        # set by train and used by update and predict_scenario_tree; unknown for loaded models
+        self.baseline_rmse: Optional[float] = None
+        self.residuals: Optional[np.ndarray] = None  # out-of-fold residuals of the test slices
+        self.test_size: Optional[int] = None
+        self._train_kwargs: dict = {}
 
     @abstractmethod
     # make static @staticmethod
@@ -39,6 +129,28 @@ class XGBRegressorBase(ForecastingModelBase):
 
         return df[["day_of_week", "weekend", "minute_of_day", "month"]]
 
+    def feature_matrix(self, df: pd.DataFrame) -> FeatureMatrix:
+        """Compute the features of df with create_features, reusing the last result if df has the same rows.
+
+        Rows are compared with every column, y included unless features_ignore_y is set, as features may be derived
+        from y (lags, rolling means). The features of the training frame are released when train returns.
+        """
+        rows = df.drop(columns=self.y_col, errors="ignore") if self.features_ignore_y else df
+        key = pd.util.hash_pandas_object(rows, index=False).to_numpy()
+        features = self._features
+        if features is not None and np.array_equal(features.key, key):
+            return features
+
+        X = self.create_features(df)
+        numeric = all(pd.api.types.is_numeric_dtype(dtype) for dtype in X.dtypes)
+        self._features = FeatureMatrix(
+            key=key,
+            index=X.index,
+            columns=[str(column) for column in X.columns],
+            values=np.ascontiguousarray(X.to_numpy(dtype=np.float32)) if numeric else X,
+        )
+        return self._features
+
     def save(self, path: Path):
         output_dir = Path(path)
         if not output_dir.exists():
@@ -48,6 +160,8 @@ class XGBRegressorBase(ForecastingModelBase):
             reg.save_model(output_dir / f"model_{i}.ubj")
 
     def load(self, paths: list[Path]):
+        import xgboost as xgb
+
         regs = []
         for path in paths:
             reg = xgb.XGBRegressor()
@@ -65,47 +179,80 @@ class XGBRegressorBase(ForecastingModelBase):
     def validate_test_data(self, df: pd.DataFrame):
         self.InputDataframe.validate(df)
 
-    def train(self, df: pd.DataFrame, test_size, verbose=False, **kwargs):
+    def train(self, df: pd.DataFrame, test_size, verbose=False, max_workers: int = 1, **kwargs):
+        """Train one model per TimeSeriesSplit fold and return the models and their RMSE scores on the test slices.
+
+        With max_workers > 1 the folds are trained in parallel on a process pool, and each fold's n_jobs defaults to the
+        number of cores divided by max_workers. The models are the same as with sequential training.
+        """
+        import xgboost as xgb
+        from sklearn.metrics import mean_squared_error
+        from sklearn.model_selection import TimeSeriesSplit
+
         self.validate_train_data(df)
+        if max_workers < 1:
+            raise ValueError("max_workers must be at least 1")
         tss = TimeSeriesSplit(n_splits=self.num_folds, test_size=test_size)
         scores = []
-        pred_indxs = []
         regs = []
+        residuals = []
 
         if verbose:
+            from matplotlib import pyplot as plt
+
             _, axs = plt.subplots(self.num_folds, 1, figsize=(20, 5))
 
         start_time = time.time()
 
-        for i, (train_idx, test_idx) in enumerate(tss.split(df)):
-            df_train = df.iloc[train_idx]
-            df_test = df.iloc[test_idx]
-            pred_indxs.append(test_idx)
-
-            X_train = self.create_features(df_train)
-            y_train = df_train[self.y_col]
-            X_test = self.create_features(df_test)
-            y_test = df_test[self.y_col]
-
+        # features of the whole frame, computed once and sliced per fold
+        features = self.feature_matrix(df)
+        y = df[self.y_col].to_numpy(dtype=np.float32)
+
+        n_jobs = kwargs.get("n_jobs", -1 if max_workers == 1 else max(1, (os.cpu_count() or 1) // max_workers))
+        n_estimators = kwargs.get("n_estimators", 500)
+        objective = kwargs.get("objective", "reg:squarederror")
+        eval_metric = kwargs.get("eval_metric", "rmse")
+        early_stopping_rounds = kwargs.get("early_stopping_rounds", 100)
+        params = {"objective": objective, "eval_metric": eval_metric, "nthread": n_jobs}
+
+        # the folds of a TimeSeriesSplit are contiguous, so slices give views instead of copies
+        folds = [
+            (slice(train_idx[0], train_idx[-1] + 1), slice(test_idx[0], test_idx[-1] + 1))
+            for train_idx, test_idx in tss.split(features.values)
+        ]
+        fit_args = [(train, test, params, n_estimators, early_stopping_rounds) for train, test in folds]
+        if max_workers == 1:
+            raw_models = [_fit_fold(features.values, y, *args) for args in fit_args]
+        else:
+            # spawn, as forking a process that has started XGBoost's OpenMP threads is unsafe. The data every fold
+            # slices is sent to each worker once, and the tasks only carry the fold's slices.
+            end = folds[-1][1].stop
+            with ProcessPoolExecutor(
+                max_workers=min(max_workers, len(folds)),
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_share_fold_data,
+                initargs=(features.values[:end], y[:end]),
+            ) as executor:
+                raw_models = list(executor.map(_fit_shared_fold, *zip(*fit_args)))
+
+        for i, ((_, test), raw_model) in enumerate(zip(folds, raw_models)):
             reg = xgb.XGBRegressor(
-                n_estimators=kwargs.get("n_estimators", 500),
-                objective=kwargs.get("objective", "reg:squarederror"),
-                n_jobs=kwargs.get("n_jobs", -1),
-            )
-            reg.set_params(
-                eval_metric=kwargs.get("eval_metric", "rmse"),
-                early_stopping_rounds=kwargs.get("early_stopping_rounds", 100),
+                n_estimators=n_estimators, objective=objective, n_jobs=n_jobs, enable_categorical=True
             )
-
-            reg.fit(X_train, y_train, eval_set=[(X_train, y_train), (X_test, y_test)], verbose=100)
+            reg.set_params(eval_metric=eval_metric, early_stopping_rounds=early_stopping_rounds)
+            reg.load_model(raw_model)
+            reg.get_booster().feature_names = features.columns
             regs.append(reg)
+
+            X_test, y_test = features.values[test], y[test]
             y_pred = reg.predict(X_test)
             score = np.sqrt(mean_squared_error(y_test, y_pred))
             scores.append(score)
+            residuals.append(y_test - y_pred)
             if verbose:
                 print(f"Training fold {i + 1}")
-                axs[i].plot(X_test.index, y_pred, label="Predicted")
-                axs[i].plot(X_test.index, y_test, label="Actual")
+                axs[i].plot(features.index[test], y_pred, label="Predicted")
+                axs[i].plot(features.index[test], y_test, label="Actual")
                 axs[i].legend()
                 _ = xgb.plot_importance(reg, height=0.9)
 
@@ -118,57 +265,146 @@ class XGBRegressorBase(ForecastingModelBase):
             print(f"Individual RMSE Scores: {scores}")
 
         self.regs = regs
+        self.baseline_rmse = float(np.mean(scores))
+        self.residuals = np.concatenate(residuals)
+        self.test_size = test_size
+        self._train_kwargs = {**kwargs, "max_workers": max_workers}
+        # don't keep a copy of the training features for the life of the model
+        self._features = None
 
         return regs, scores
 
-    def predict_to_df(self, df: pd.DataFrame, **kwargs) -> pd.DataFrame:
-        """Predict the LMP values for the given dataframe. The head is the first node of the LMP timeseries."""
+    def update(
+        self,
+        df_new: pd.DataFrame,
+        mode: Literal["continue", "refresh"] = "continue",
+        num_boost_round: int = 20,
+        drift_threshold: Optional[float] = 2.0,
+        history: Optional[pd.DataFrame] = None,
+        n_jobs: int = -1,
+    ) -> ModelUpdate:
+        """Update the models with new data instead of training them from scratch.
+
+        mode="continue" adds num_boost_round trees fitted to df_new to every model, and mode="refresh" re-fits the leaf
+        values of the existing trees to df_new (e.g. a sliding window of recent data). Both work on loaded models.
+
+        If the RMSE of the averaged models on df_new is above drift_threshold times the baseline (the mean fold score of
+        the last train, or the first update's RMSE for loaded models), the models are retrained on history and df_new
+        with the arguments of the last train instead. Without history the models are left as they are and the action is
+        "retrain_required", as df_new alone is too short to train on.
+        """
+        import xgboost as xgb
+
+        if not self.regs:
+            raise ValueError("The model has not been trained or loaded yet.")
+        if mode not in ("continue", "refresh"):
+            raise ValueError(f"Unknown update mode '{mode}'")
+        self.validate_train_data(df_new)
+
+        y = df_new[self.y_col].to_numpy(dtype=np.float32)
+        rmse = float(np.sqrt(np.mean((self.predict_array(df_new, average=True)[0] - y) ** 2)))
+        if self.baseline_rmse is None:
+            self.baseline_rmse = rmse
+        baseline_rmse = self.baseline_rmse
+
+        if drift_threshold is not None and rmse > drift_threshold * baseline_rmse:
+            if history is None:
+                return ModelUpdate("retrain_required", rmse, baseline_rmse)
+            if self.test_size is None:
+                raise ValueError("The models drifted, but they weren't trained here, so test_size is unknown.")
+            self.train(pd.concat([history, df_new], ignore_index=True), self.test_size, **self._train_kwargs)
+            return ModelUpdate("retrain", rmse, baseline_rmse)
+
+        features = self.feature_matrix(df_new)
+        # the refresh updater needs the raw values, not a QuantileDMatrix
+        dmatrix_type = xgb.QuantileDMatrix if mode == "continue" else xgb.DMatrix
+        dtrain = dmatrix_type(features.values, y, feature_names=features.columns, enable_categorical=True)
+        regs = []
+        for reg in self.regs:
+            booster = _without_early_stopping(reg.get_booster())
+            if mode == "continue":
+                booster = xgb.train({"nthread": n_jobs}, dtrain, num_boost_round, xgb_model=booster)
+            else:
+                params = {"nthread": n_jobs, "process_type": "update", "updater": "refresh", "refresh_leaf": True}
+                with warnings.catch_warnings():
+                    # XGBoost warns whenever updater is set, which refreshing requires
+                    warnings.simplefilter("ignore", UserWarning)
+                    booster = xgb.train(params, dtrain, booster.num_boosted_rounds(), xgb_model=booster)
+            updated = xgb.XGBRegressor(**reg.get_params())
+            updated.load_model(booster.save_raw("ubj"))
+            regs.append(updated)
+
+        self.regs = regs
+        return ModelUpdate(mode, rmse, baseline_rmse)
+
+    def predict_array(self, df: pd.DataFrame, average: bool = False) -> np.ndarray:
+        """Predict the LMP values for the given dataframe as an (n_models, T) float32 array, or (1, T) with average.
+
+        Every booster predicts in place on the same feature matrix, without intermediate DataFrames.
+        """
         if not self.regs:
             raise ValueError("The model has not been trained or loaded yet.")
 
         self.validate_test_data(df)
-        X = self.create_features(df)
-        preds = []
-        for reg in self.regs:
-            y_pred = reg.predict(X)
-            preds.append(y_pred)
+        X = self.feature_matrix(df).values
+        preds = np.empty((len(self.regs), len(X)), dtype=np.float32)
+        for i, reg in enumerate(self.regs):
+            booster = reg.get_booster()
+            preds[i] = booster.inplace_predict(X, iteration_range=_iteration_range(booster))
+
+        if average:
+            return preds.mean(axis=0, keepdims=True)
+        return preds
 
-        if kwargs.get("average", False):
-            avg_preds = np.mean(preds, axis=0)
-            result_df = pd.DataFrame({"timestamp": df["timestamp"], "price": avg_preds})
+    def predict_to_df(self, df: pd.DataFrame, **kwargs) -> pd.DataFrame:
+        """Predict the LMP values for the given dataframe. The head is the first node of the LMP timeseries."""
+        average = kwargs.get("average", False)
+        preds = self.predict_array(df, average)
+
+        if average:
+            result_df = pd.DataFrame({"timestamp": df["timestamp"], "price": preds[0]})
         else:
             result_df = pd.DataFrame({"timestamp": df["timestamp"]})
-            for pred in preds:
-                result_df[f"price_{len(result_df.columns) - 1}"] = pred
+            result_df = result_df.join(
+                pd.DataFrame({f"price_{i}": pred for i, pred in enumerate(preds)}, index=result_df.index)
+            )
 
         return result_df
 
     def predict_to_list(self, df: pd.DataFrame, **kwargs) -> list[LMPTimeseriesBase]:
-        predictions = self.predict_to_df(df, **kwargs)
-        timeseries = []
-
-        if kwargs.get("average", False):
-            lmps = LMPTimeseriesBase().create_branch_from_df(predictions)
-            timeseries.append(lmps)
-        else:
-            for i in range(0, len(predictions.columns) - 1):
-                temp_df = predictions[["timestamp", f"price_{i}"]].rename(columns={f"price_{i}": "price"})
-                lmps = LMPTimeseriesBase().create_branch_from_df(temp_df)
-                timeseries.append(lmps)
-
-        return timeseries
+        preds = self.predict_array(df, kwargs.get("average", False))
+        timestamps = timestamps_to_epoch_ns(df["timestamp"])
+        return [LMPTimeseriesBase().create_branches_from_arrays(timestamps, pred) for pred in preds]
 
     # all predictions will be connected to the head node; mutates and returns
     # FIXME: @carterjc lift kwargs to named args
     def predict(self, tree: LMPTimeseriesBase, df: pd.DataFrame, **kwargs) -> LMPTimeseriesBase:
-        predictions = self.predict_to_df(df, **kwargs)
-
-        if kwargs.get("average", False):
-            tree.create_branch_from_df(predictions, add_dummy=True, on_node=tree.head)
-        else:
-            for i in range(0, len(predictions.columns) - 1):
-                temp_df = predictions[["timestamp", f"price_{i}"]].rename(columns={f"price_{i}": "price"})
-                tree.create_branch_from_df(temp_df, add_dummy=True, on_node=tree.head)
-
+        preds = self.predict_array(df, kwargs.get("average", False))
+        # all branches in one bulk insert
+        tree.create_branches_from_arrays(
+            timestamps_to_epoch_ns(df["timestamp"]), preds, add_dummy=True, on_node=tree.head
+        )
         tree.calc_coefficients()
         return tree
+
+    def predict_scenario_tree(
+        self,
+        tree: LMPTimeseriesBase,
+        df: pd.DataFrame,
+        stages: Sequence[pd.Timedelta | int],
+        max_nodes: int,
+        residual_quantiles: int = 5,
+    ) -> LMPTimeseriesBase:
+        """Predict into a multi-stage tree of at most max_nodes nodes on the head, branching at stages.
+
+        The scenarios are every model's predictions shifted by residual_quantiles quantiles of the out-of-fold residuals
+        of training, so the tree branches on the models' disagreement and their error distribution (loaded models only
+        have their predictions). See build_scenario_tree; the tree's coefficients are the scenario probabilities.
+        """
+        preds = self.predict_array(df)
+        if self.residuals is not None and len(self.residuals) and residual_quantiles > 0:
+            offsets = np.quantile(self.residuals, (np.arange(residual_quantiles) + 0.5) / residual_quantiles)
+            preds = (preds[:, None, :] + offsets[None, :, None]).reshape(-1, preds.shape[1])
+        return build_scenario_tree(
+            tree, timestamps_to_epoch_ns(df["timestamp"]), preds, stages, max_nodes, on_node=tree.head
+        )
@@ -1 +1,13 @@
-from .pjm import get_latest_price, get_node_fivemin
\ No newline at end of file
+from .cache import CacheStats, PJMCache
+from .pjm import (
+    create_csv,
+    downcast_lmps,
+    get_latest_price,
+    get_node_fivemin,
+    get_node_lmps,
+    get_nodes_lmps,
+    iter_node_fivemin,
+    iter_node_frames,
+    iter_pjm,
+    write_pages,
+)
@@ -0,0 +1,183 @@
+import logging
+import os
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Optional
+
+import pandas as pd
+
+TIMESTAMP_COLUMN = "datetime_beginning_utc"
+MAX_RANGE = pd.Timedelta(days=366)  # longest datetime range PJM accepts in one query
+DEFAULT_MIN_AGE = pd.Timedelta(days=1)
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0  # day partitions read from disk
+    misses: int = 0  # day partitions fetched from PJM
+    requests: int = 0  # gap fetches sent to PJM
+    evictions: int = 0  # day partitions deleted by the retention policy
+
+
+class PJMCache:
+    """On-disk cache of PJM data, partitioned by endpoint, pnode_id and UTC day and stored as Parquet (needs pyarrow).
+
+    A request fetches only the days that aren't cached (one query per contiguous gap) and merges them with the cached
+    days. Only days with rows that ended at least min_age (default one day) ago are cached, since recent data may still
+    be unverified. Partitions of days older than retention aren't written, and the least recently used partitions
+    beyond max_bytes are evicted after each request. The sizes and use order of the partitions are read from disk once
+    and then kept up to date by the cache, so eviction doesn't scan the directory again.
+    """
+
+    def __init__(
+        self,
+        directory: str | os.PathLike,
+        retention: Optional[pd.Timedelta] = None,
+        max_bytes: Optional[int] = None,
+        min_age: Optional[pd.Timedelta] = None,
+    ):
+        self.directory = Path(directory)
+        self.retention = retention
+        self.max_bytes = max_bytes
+        self.min_age = DEFAULT_MIN_AGE if min_age is None else min_age
+        self.stats = CacheStats()
+        self._sizes: Optional[OrderedDict[Path, int]] = None  # partition sizes, least recently used first
+        self._total = 0  # sum of _sizes
+        self._cutoff: Optional[pd.Timestamp] = None  # retention cutoff the partitions were last checked against
+
+    def _path(self, endpoint: str, pnode_id: str | int, day: pd.Timestamp) -> Path:
+        return self.directory / endpoint / str(pnode_id) / f"{day:%Y-%m-%d}.parquet"
+
+    def _retention_cutoff(self) -> Optional[pd.Timestamp]:
+        if self.retention is None:
+            return None
+        return (pd.Timestamp.now(tz="UTC") - self.retention).floor("D")
+
+    def get(
+        self,
+        endpoint: str,
+        pnode_id: str | int,
+        start: pd.Timestamp,
+        end: pd.Timestamp,
+        fetch: Callable[[pd.Timestamp, pd.Timestamp], pd.DataFrame],
+    ) -> pd.DataFrame:
+        """Return the rows of [start, end) (UTC); fetch(range_start, range_end) downloads a day-aligned range."""
+        start, end = _to_utc(start), _to_utc(end)
+        if end <= start:
+            raise ValueError("end must be after start")
+
+        days = pd.date_range(start.floor("D"), (end - pd.Timedelta(1)).floor("D"), freq="D")
+        cacheable_before = pd.Timestamp.now(tz="UTC") - self.min_age - pd.Timedelta(days=1)
+        cutoff = self._retention_cutoff()
+        frames: dict[pd.Timestamp, pd.DataFrame] = {}
+        missing = []
+        for day in days:
+            path = self._path(endpoint, pnode_id, day)
+            if day <= cacheable_before and path.exists():
+                frames[day] = pd.read_parquet(path)
+                path.touch()  # for least recently used eviction
+                self._track(path)
+                self.stats.hits += 1
+            else:
+                missing.append(day)
+                self.stats.misses += 1
+
+        for gap_start, gap_end in _gaps(missing):
+            self.stats.requests += 1
+            df = fetch(gap_start, gap_end)
+            if df.empty:
+                day_of_row = None
+            elif TIMESTAMP_COLUMN in df:
+                day_of_row = df[TIMESTAMP_COLUMN].dt.floor("D")
+            else:
+                raise ValueError(f"Fetched rows have no '{TIMESTAMP_COLUMN}' column")
+            for day in pd.date_range(gap_start, gap_end - pd.Timedelta(days=1), freq="D"):
+                part = df if day_of_row is None else df[day_of_row == day]
+                frames[day] = part
+                # days without rows aren't cached, so that they are fetched again once PJM has them
+                if not part.empty and day <= cacheable_before and (cutoff is None or day >= cutoff):
+                    self._write(self._path(endpoint, pnode_id, day), part)
+
+        self.evict()
+
+        parts = [frames[day] for day in days if not frames[day].empty]
+        if not parts:
+            return pd.DataFrame()
+        df = pd.concat(parts, ignore_index=True)
+        df = df[(df[TIMESTAMP_COLUMN] >= start) & (df[TIMESTAMP_COLUMN] < end)]
+        return df.sort_values(TIMESTAMP_COLUMN, kind="stable", ignore_index=True)
+
+    def _write(self, path: Path, df: pd.DataFrame) -> None:
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError as e:
+            raise ImportError("The PJM cache requires pyarrow") from e
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # write and rename, so that a crash never leaves a partial partition behind
+        temp_path = path.with_suffix(".tmp")
+        df.to_parquet(temp_path, index=False)
+        temp_path.replace(path)
+        self._track(path, path.stat().st_size)
+
+    def _index(self) -> OrderedDict[Path, int]:
+        if self._sizes is None:
+            stats = {path: path.stat() for path in self.directory.glob("*/*/*.parquet")}
+            order = sorted(stats, key=lambda path: stats[path].st_mtime)
+            self._sizes = OrderedDict((path, stats[path].st_size) for path in order)
+            self._total = sum(self._sizes.values())
+        return self._sizes
+
+    def _track(self, path: Path, size: Optional[int] = None) -> None:
+        """Mark a partition as the most recently used, and record its size if it was written."""
+        if self.retention is None and self.max_bytes is None:
+            return
+        sizes = self._index()
+        if size is not None or path not in sizes:
+            size = path.stat().st_size if size is None else size
+            self._total += size - sizes.get(path, 0)
+            sizes[path] = size
+        sizes.move_to_end(path)
+
+    def evict(self) -> None:
+        """Apply the retention policy.
+
+        Partitions of days older than retention are only looked for when the retention cutoff moves to a new day, and
+        partitions are only removed by size while the cache is over max_bytes.
+        """
+        if self.retention is None and self.max_bytes is None:
+            return
+
+        sizes = self._index()
+        cutoff = self._retention_cutoff()
+        if cutoff is not None and (self._cutoff is None or cutoff > self._cutoff):
+            self._cutoff = cutoff
+            for path in [path for path in sizes if pd.Timestamp(path.stem, tz="UTC") < cutoff]:
+                self._remove(path)
+
+        if self.max_bytes is not None:
+            while sizes and self._total > self.max_bytes:
+                self._remove(next(iter(sizes)))
+
+    def _remove(self, path: Path) -> None:
+        path.unlink(missing_ok=True)
+        self._total -= self._index().pop(path, 0)
+        self.stats.evictions += 1
+        logging.debug(f"Evicted {path} from the PJM cache")
+
+
+def _to_utc(timestamp: pd.Timestamp | str) -> pd.Timestamp:
+    timestamp = pd.Timestamp(timestamp)
+    return timestamp.tz_localize("UTC") if timestamp.tzinfo is None else timestamp.tz_convert("UTC")
+
+
+def _gaps(days: list[pd.Timestamp]) -> list[tuple[pd.Timestamp, pd.Timestamp]]:
+    """Group missing days into contiguous [start, end) ranges of at most MAX_RANGE."""
+    gaps: list[tuple[pd.Timestamp, pd.Timestamp]] = []
+    for day in days:
+        if gaps and gaps[-1][1] == day and day + pd.Timedelta(days=1) - gaps[-1][0] <= MAX_RANGE:
+            gaps[-1] = (gaps[-1][0], day + pd.Timedelta(days=1))
+        else:
+            gaps.append((day, day + pd.Timedelta(days=1)))
+    return gaps
@@ -0,0 +1,94 @@
+import logging
+import random
+import threading
+import time
+from typing import Any, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class PJMError(Exception):
+    pass
+
+
+class TokenBucket:
+    """Thread-safe token bucket rate limiter.
+
+    Tokens refill at rate per second up to capacity (the largest burst); acquire blocks until a token is available.
+    """
+
+    def __init__(self, rate: float, capacity: float = 1):
+        if rate <= 0 or capacity < 1:
+            raise ValueError("rate must be positive and capacity at least 1")
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+def make_session(api_key: Optional[str], pool_size: int = 4) -> requests.Session:
+    """Create a keep-alive session with a connection pool of pool_size and the PJM subscription key header."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    if api_key is not None:
+        session.headers["Ocp-Apim-Subscription-Key"] = api_key
+    return session
+
+
+def _retry_delay(response: Optional[requests.Response], attempt: int, backoff: float) -> float:
+    if response is not None:
+        retry_after = response.headers.get("Retry-After")
+        if retry_after is not None and retry_after.isdigit():
+            return float(retry_after)
+    # exponential backoff with jitter, so that concurrent requests don't retry in lockstep
+    return backoff * 2**attempt * random.uniform(0.5, 1.0)  # noqa: S311
+
+
+def fetch_json(
+    session: requests.Session,
+    url: str,
+    limiter: TokenBucket,
+    max_retries: int = 5,
+    backoff: float = 1.0,
+    timeout: float = 30,
+) -> Any:
+    """GET url and return its JSON, taking a token from limiter for every attempt.
+
+    429, 5xx responses and connection errors are retried up to max_retries times with exponential backoff (or the
+    response's Retry-After); other errors raise PJMError.
+    """
+    for attempt in range(max_retries + 1):
+        limiter.acquire()
+        response = None
+        try:
+            response = session.get(url, timeout=timeout)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            error = f"{type(e).__name__}: {e}"
+        else:
+            if response.status_code == 200:
+                return response.json()
+            if response.status_code != 429 and response.status_code < 500:
+                raise PJMError(f"Status code was not 200, but {response.status_code}")
+            error = f"status code {response.status_code}"
+
+        if attempt == max_retries:
+            raise PJMError(f"Request failed after {max_retries + 1} attempts ({error})")
+        delay = _retry_delay(response, attempt, backoff)
+        logging.warning(f"Request failed ({error}), retrying in {delay:.1f} s")
+        time.sleep(delay)
@@ -1,95 +1,197 @@
+import collections
+import itertools
 import logging
 import os
-import time
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
-from typing import Any, Callable
+from typing import Any, Callable, Generator, Iterable, Literal, Optional
 
-import dotenv
 import pandas as pd
 import requests
 
+from wattour.core.lmp_timeseries_base import transform
+from wattour.forecasting.pjm.cache import MAX_RANGE, PJMCache, _to_utc
+from wattour.forecasting.pjm.client import PJMError, TokenBucket, fetch_json, make_session
 from wattour.forecasting.pjm.utils.constants import (
+    ALLOWED_ZONES,
     BATCH_SIZE,
     COMMON_LMP_ALLOWED_FIELDS,
+    DA_LMP_ALLOWED_FIELDS,
     RT_LMP_ALLOWED_FIELDS,
 )
 
-dotenv.load_dotenv()
+PJM_API = "https://api.pjm.com/api/v1"
 
+PJM_RATE_LIMIT = 6  # reqs/min
+PJM_MAX_WORKERS = 4  # concurrent page requests
+PJM_MAX_PNODES = 100  # pnode_ids per query, keeps the request URL short
 
-class PJMError(Exception):
-    pass
+# shared by every request of the process, so concurrent downloads stay within the allowance together
+PJM_RATE_LIMITER = TokenBucket(PJM_RATE_LIMIT / 60)
+_session: Optional[requests.Session] = None
 
 
-PJM_API = "https://api.pjm.com/api/v1"
-PJM_API_KEY = os.environ.get("PJM_API_KEY", None)
-if PJM_API_KEY is None:
-    raise OSError("No API key provided")
+def pjm_api_key() -> str:
+    """Read PJM_API_KEY from the environment, loading .env first; checked on the first request, not on import."""
+    import dotenv
+
+    dotenv.load_dotenv()
+    api_key = os.environ.get("PJM_API_KEY", None)
+    if api_key is None:
+        raise OSError("No API key provided")
+    return api_key
 
-PJM_RATE_LIMIT = 6  # reqs/sec
+
+def pjm_session() -> requests.Session:
+    """Return the process-wide keep-alive session for PJM requests."""
+    global _session
+    if _session is None:
+        _session = make_session(pjm_api_key(), PJM_MAX_WORKERS)
+    return _session
 
 
 # TODO: put this somewhere else
 # logging.basicConfig(level=logging.DEBUG, format="%(asctime)s - %(levelname)s - %(message)s")
 
 
-def create_csv(func: Callable[..., pd.DataFrame], output_file_path: str):
+def typed_page(items: list[dict[str, Any]]) -> pd.DataFrame:
+    """Build a DataFrame from one page of PJM items, with parsed timestamps and numeric prices and ids.
+
+    datetime_*_utc columns become UTC timestamps and other datetime_* columns (e.g. EPT) naive local timestamps.
+    """
+    df = pd.DataFrame.from_records(items)
+    for column in df.columns:
+        if column.startswith("datetime_"):
+            df[column] = pd.to_datetime(df[column], utc=column.endswith("_utc"), format="ISO8601")
+        elif column in DA_LMP_ALLOWED_FIELDS or column in RT_LMP_ALLOWED_FIELDS or column.endswith("_price_rt"):
+            df[column] = pd.to_numeric(df[column], errors="coerce").astype("float64")
+        elif column == "pnode_id":
+            df[column] = pd.to_numeric(df[column]).astype("int64")
+    return df
+
+
+def write_pages(
+    pages: Iterable[pd.DataFrame], output_file_path: str, file_format: Optional[Literal["csv", "parquet"]] = None
+) -> int:
+    """Append each page to a CSV or Parquet file as it arrives, so only one page is held in memory.
+
+    The format defaults to the file extension. Parquet needs pyarrow; its schema is taken from the first page. Returns
+    the number of rows written.
+    """
+    if file_format is None:
+        file_format = "parquet" if Path(output_file_path).suffix == ".parquet" else "csv"
+    if file_format not in ("csv", "parquet"):
+        raise ValueError(f"Unknown file format '{file_format}'")
+
+    rows = 0
+    if file_format == "csv":
+        for page in pages:
+            page.to_csv(output_file_path, mode="w" if rows == 0 else "a", header=rows == 0, index=False)
+            rows += len(page)
+        if rows == 0:
+            pd.DataFrame().to_csv(output_file_path, index=False)
+        return rows
+
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ImportError("Writing Parquet files requires pyarrow") from e
+
+    writer = None
+    try:
+        for page in pages:
+            table = pa.Table.from_pandas(page, preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(output_file_path, table.schema)
+            writer.write_table(table.cast(writer.schema))
+            rows += len(page)
+    finally:
+        if writer is not None:
+            writer.close()
+    if writer is None:
+        pq.write_table(pa.table({}), output_file_path)
+    return rows
+
+
+def create_csv(func: Callable[..., pd.DataFrame | Iterable[pd.DataFrame]], output_file_path: str):
+    """Wrap func to write its result to output_file_path; a func that yields pages (e.g. iter_pjm) is streamed."""
+
     def helper(*args, **kwargs):
-        df = func(*args, **kwargs)
-        df.to_csv(output_file_path, index=False)
+        result = func(*args, **kwargs)
+        write_pages([result] if isinstance(result, pd.DataFrame) else result, output_file_path, "csv")
         csv_size_mb = Path(output_file_path).stat().st_size / 1024 / 1024
         logging.info(f"Outputted file to {output_file_path} with size {csv_size_mb:.1f} MB")
 
     return helper
 
 
-def get_pjm(base_req_url: str, params: dict[str, Any]):
-    """Fetch data from PJM API endpoints in batches.
+def iter_pjm(
+    base_req_url: str,
+    params: dict[str, Any],
+    max_workers: int = PJM_MAX_WORKERS,
+    limiter: Optional[TokenBucket] = None,
+    session: Optional[requests.Session] = None,
+    max_retries: int = 5,
+    backoff: float = 1.0,
+) -> Generator[pd.DataFrame]:
+    """Fetch data from PJM API endpoints in batches, yielding each batch as a typed DataFrame (see typed_page).
+
+    The first page gives the total row count; the remaining pages are then requested max_workers at a time and yielded
+    in order, so at most about max_workers pages are held at once. Every request takes a token from limiter (the shared
+    PJM_RATE_LIMITER by default), and 429/5xx responses are retried with exponential backoff (see fetch_json).
 
     This is intended to be used in wrapper functions for particular PJM endpoints.
     """
     # LastYear, PSEG returns 6642349 rows - with batches of 50k this is ~120 requests, at 6req/min for ~20 minutes
-    sleep_rate_limit = 60 / PJM_RATE_LIMIT
-
-    # need rowCount (max 50k) and startRow (1-indexed)
-    data_rows = []
-    start_row = 1
-    total_rows = None
-    while True:
-        cur_params = {**params, "startRow": start_row, "rowCount": BATCH_SIZE}
-        req_url = f"{base_req_url}?{'&'.join(f'{k}={v}' for k, v in cur_params.items())}"
+    limiter = limiter or PJM_RATE_LIMITER
+    session = session or pjm_session()
+    batch_size = BATCH_SIZE
 
+    def fetch_page(start_row: int) -> tuple[pd.DataFrame, int]:
+        # need rowCount (max 50k) and startRow (1-indexed)
+        cur_params = {**params, "startRow": start_row, "rowCount": batch_size}
+        req_url = f"{base_req_url}?{'&'.join(f'{k}={v}' for k, v in cur_params.items())}"
+        res = fetch_json(session, req_url, limiter, max_retries, backoff)
+        # only the typed page is kept, not the raw JSON
+        return typed_page(res.get("items", [])), res.get("totalRows", 0)
+
+    page, total_rows = fetch_page(1)
+    if not page.empty:
+        yield page
+    del page
+
+    start_rows = iter(range(1 + batch_size, total_rows + 1, batch_size))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending: collections.deque[Future] = collections.deque(
+            executor.submit(fetch_page, start_row) for start_row in itertools.islice(start_rows, max_workers)
+        )
         try:
-            r = requests.get(req_url, timeout=30, headers={"Ocp-Apim-Subscription-Key": PJM_API_KEY})
-            r.raise_for_status()
-        except requests.exceptions.RequestException as e:
-            print(r)
-            logging.exception("Request failed")
-
-            if r.status_code == 429:
-                time.sleep(30)
-                continue
-
-            if r.status_code != 200:
-                raise PJMError(f"Status code was not 200, but {r.status_code}") from e
-
-        res = r.json()
-        total_rows = res.get("totalRows", 0)
-        data_rows.extend(res.get("items", []))
-
-        if start_row + BATCH_SIZE > total_rows:
-            break
-        else:
-            start_row = (start_row + BATCH_SIZE) % total_rows
-
-        time.sleep(sleep_rate_limit)
-
-    return pd.DataFrame(data_rows)
+            while pending:
+                page, _ = pending.popleft().result()
+                next_start_row = next(start_rows, None)
+                if next_start_row is not None:
+                    pending.append(executor.submit(fetch_page, next_start_row))
+                if not page.empty:
+                    yield page
+                del page
+        finally:
+            # don't send the queued requests if the caller stops early
+            for future in pending:
+                future.cancel()
+
+
+def get_pjm(base_req_url: str, params: dict[str, Any]) -> pd.DataFrame:
+    """Fetch data from PJM API endpoints into one typed DataFrame; use iter_pjm for large queries."""
+    pages = list(iter_pjm(base_req_url, params))
+    if not pages:
+        return pd.DataFrame()
+    return pd.concat(pages, ignore_index=True)
 
 
 # make this more abstract
-def get_node_fivemin(pnode_id: str) -> pd.DataFrame:
-    """Get a node's rt 5min LMP data for a specified time period."""
+def iter_node_fivemin(pnode_id: str) -> Generator[pd.DataFrame]:
+    """Get a node's rt 5min LMP data for a specified time period, one page at a time."""
     base_req_url = f"{PJM_API}/rt_fivemin_hrl_lmps"
 
     params = {
@@ -99,13 +201,142 @@ def get_node_fivemin(pnode_id: str) -> pd.DataFrame:
         "fields": ",".join(COMMON_LMP_ALLOWED_FIELDS + RT_LMP_ALLOWED_FIELDS),
     }
 
-    df = get_pjm(base_req_url, params)
+    return iter_pjm(base_req_url, params)
+
+
+def get_node_fivemin(pnode_id: str) -> pd.DataFrame:
+    """Get a node's rt 5min LMP data for a specified time period."""
+    pages = list(iter_node_fivemin(pnode_id))
+    df = pd.concat(pages, ignore_index=True) if pages else pd.DataFrame()
     if df.empty:
         raise PJMError("No data received for given node.")
 
     return df
 
 
+def _lmp_fields(endpoint: str) -> list[str]:
+    return COMMON_LMP_ALLOWED_FIELDS + (RT_LMP_ALLOWED_FIELDS if "rt_" in endpoint else DA_LMP_ALLOWED_FIELDS)
+
+
+def _time_range(start: pd.Timestamp, end: pd.Timestamp) -> str:
+    # PJM ranges include their end
+    return f"{start:%Y-%m-%d %H:%M} to {end - pd.Timedelta(minutes=1):%Y-%m-%d %H:%M}"
+
+
+def get_node_lmps(
+    pnode_id: str | int,
+    start: pd.Timestamp | str,
+    end: pd.Timestamp | str,
+    endpoint: str = "rt_fivemin_hrl_lmps",
+    cache: Optional[PJMCache] = None,
+) -> pd.DataFrame:
+    """Get a node's LMPs of [start, end) (UTC) from a PJM LMP endpoint.
+
+    With a cache, only the days that aren't cached yet are downloaded.
+    """
+
+    def fetch(range_start: pd.Timestamp, range_end: pd.Timestamp) -> pd.DataFrame:
+        params = {
+            "download": False,
+            "pnode_id": pnode_id,
+            "datetime_beginning_utc": _time_range(range_start, range_end),
+            "fields": ",".join(_lmp_fields(endpoint)),
+        }
+        return get_pjm(f"{PJM_API}/{endpoint}", params)
+
+    if cache is None:
+        return fetch(_to_utc(start), _to_utc(end))
+    return cache.get(endpoint, pnode_id, start, end, fetch)
+
+
+def downcast_lmps(df: pd.DataFrame) -> pd.DataFrame:
+    """Shrink a typed LMP frame: prices to float32, pnode_id to the smallest unsigned int and strings to categories."""
+    df = df.copy()
+    for column in df.columns:
+        if column in DA_LMP_ALLOWED_FIELDS or column in RT_LMP_ALLOWED_FIELDS:
+            df[column] = df[column].astype("float32")
+        elif column == "pnode_id":
+            df[column] = pd.to_numeric(df[column], downcast="unsigned")
+        elif df[column].dtype == object:
+            df[column] = df[column].astype("category")
+    return df
+
+
+def get_nodes_lmps(
+    start: pd.Timestamp | str,
+    end: pd.Timestamp | str,
+    pnode_ids: Iterable[str | int] = (),
+    zones: Iterable[str] = (),
+    endpoint: str = "rt_fivemin_hrl_lmps",
+    layout: Literal["long", "wide"] = "long",
+    price_column: Optional[str] = None,
+) -> pd.DataFrame:
+    """Get the LMPs of [start, end) (UTC) of many pnodes and zones (see ALLOWED_ZONES) in as few queries as possible.
+
+    pnode_ids are sent PJM_MAX_PNODES per query and all zones in one query, split into ranges of at most 366 days.
+    Pages are downcast (see downcast_lmps) as they arrive. The long layout has one row per timestamp and pnode, sorted
+    by both; the wide layout is a timestamp column and one price_column (total_lmp_rt or total_lmp_da by default)
+    column per pnode_id.
+    """
+    pnode_ids, zones = list(pnode_ids), list(zones)
+    unknown_zones = set(zones) - set(ALLOWED_ZONES)
+    if unknown_zones:
+        raise ValueError(f"Unknown zones {sorted(unknown_zones)}")
+    if not pnode_ids and not zones:
+        raise ValueError("No pnode_ids or zones were given")
+    if layout not in ("long", "wide"):
+        raise ValueError(f"Unknown layout '{layout}'")
+    start, end = _to_utc(start), _to_utc(end)
+    if end <= start:
+        raise ValueError("end must be after start")
+
+    filters = [
+        {"pnode_id": ";".join(map(str, pnode_ids[i : i + PJM_MAX_PNODES]))}
+        for i in range(0, len(pnode_ids), PJM_MAX_PNODES)
+    ]
+    if zones:
+        filters.append({"zone": ";".join(zones), "type": "ZONE"})
+    fields = ",".join(_lmp_fields(endpoint))
+
+    pages = []
+    for range_start in pd.date_range(start, end, freq=MAX_RANGE, inclusive="left"):
+        range_end = min(range_start + MAX_RANGE, end)
+        for node_filter in filters:
+            params = {
+                "download": False,
+                **node_filter,
+                "datetime_beginning_utc": _time_range(range_start, range_end),
+                "fields": fields,
+            }
+            pages.extend(downcast_lmps(page) for page in iter_pjm(f"{PJM_API}/{endpoint}", params))
+    if not pages:
+        raise PJMError("No data received for given nodes.")
+
+    df = pd.concat(pages, ignore_index=True)
+    del pages
+    df = downcast_lmps(df)  # categories of different pages concatenate to object
+    df = df[(df["datetime_beginning_utc"] >= start) & (df["datetime_beginning_utc"] < end)]
+    df = df.drop_duplicates(["datetime_beginning_utc", "pnode_id"]).sort_values(
+        ["datetime_beginning_utc", "pnode_id"], ignore_index=True
+    )
+    if layout == "long":
+        return df
+
+    price_column = price_column or ("total_lmp_rt" if "rt_" in endpoint else "total_lmp_da")
+    wide = df.pivot(index="datetime_beginning_utc", columns="pnode_id", values=price_column)
+    wide.columns.name = None
+    return wide.rename_axis("timestamp").reset_index()
+
+
+def iter_node_frames(df: pd.DataFrame, price_column: Optional[str] = None) -> Generator[tuple[int, pd.DataFrame]]:
+    """Split a long LMP frame into (pnode_id, [timestamp, price] frame) pairs ready for create_branch_from_df."""
+    if price_column is None:
+        price_column = "total_lmp_rt" if "total_lmp_rt" in df.columns else "total_lmp_da"
+    column_map = {"datetime_beginning_utc": "timestamp", price_column: "price"}
+    for pnode_id, group in df.groupby("pnode_id", sort=True, observed=True):
+        yield pnode_id, transform(group, column_map).reset_index(drop=True)
+
+
 # TODO: this function should get the latest available (unverified) lmp price for a given node
 # and return a tuple with (datetime, price) with datetime in UTC
 def get_latest_price(pnode_id: str) -> tuple[pd.Timestamp, float]:
@@ -127,10 +358,7 @@ def get_latest_price(pnode_id: str) -> tuple[pd.Timestamp, float]:
         return None
 
     last = df.iloc[0]
-    last_timestamp = last["datetime_beginning_utc"]
-    last_timestamp = pd.to_datetime(last_timestamp).tz_localize("UTC")
-
-    return last_timestamp, last["total_lmp_rt"]
+    return last["datetime_beginning_utc"], last["total_lmp_rt"]
 
 
 # https://github.com/gridstatus/gridstatus/blob/main/gridstatus/decorators.py
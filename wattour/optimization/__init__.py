@@ -1 +1,6 @@
-from .optimize_battery_control import BatteryControlResult, optimize_battery_control
+from .backends import HighsBackend, SolverBackend
+from .batch import OptimizationJob, optimize_many
+from .chain import ChainBackend
+from .optimize_battery_control import GurobiBackend, optimize_battery_control
+from .results import BatteryControlResult, DispatchSchedule, OptimizationStats, PhaseTime, dispatch_frame
+from .rolling_horizon import RollingHorizonOptimizer
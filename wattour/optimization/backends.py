@@ -0,0 +1,92 @@
+import time
+from abc import ABC, abstractmethod
+from typing import Optional
+
+import numpy as np
+
+from wattour.core import BatteryBase
+from wattour.core.lmp_timeseries_base import LMPTimeseriesBase
+
+from .battery_lp import BatteryLP, build_battery_lp
+from .results import BatteryControlResult, DispatchSchedule, OptimizationStats, timed_phase
+
+# linprog status -> Gurobi status code (optimal, iteration limit, infeasible, unbounded, numeric)
+_LINPROG_STATUS = {0: 2, 1: 7, 2: 3, 3: 5, 4: 12}
+
+
+# Abstract class for the solvers behind optimize_battery_control
+class SolverBackend(ABC):
+    # Solve the battery control problem. The timeseries is not empty and has coefficients, and the states of charge
+    # have been validated. stats is only passed when profiling; the backend times its phases in it and fills in what
+    # it knows of the model's size and the solver's work.
+    @abstractmethod
+    def solve(
+        self,
+        battery: BatteryBase,
+        lmps: LMPTimeseriesBase,
+        initial_soc: float,
+        final_soc: float,
+        stats: Optional[OptimizationStats] = None,
+    ) -> BatteryControlResult:
+        pass
+
+
+def lp_schedule(lp: BatteryLP, x: np.ndarray) -> DispatchSchedule:
+    """Spread a solution of the LP over arrays indexed by node id."""
+    charge = np.full(lp.num_nodes, np.nan)
+    discharge = np.full(lp.num_nodes, np.nan)
+    charge[lp.active] = lp.charge(x)
+    discharge[lp.active] = lp.discharge(x)
+    return DispatchSchedule(soe=lp.soe(x).copy(), charge=charge, discharge=discharge)
+
+
+# Solves the sparse battery LP with SciPy's HiGHS; needs no Gurobi license and has no model size limit
+class HighsBackend(SolverBackend):
+    def solve(
+        self,
+        battery: BatteryBase,
+        lmps: LMPTimeseriesBase,
+        initial_soc: float,
+        final_soc: float,
+        stats: Optional[OptimizationStats] = None,
+    ) -> BatteryControlResult:
+        from scipy.optimize import linprog
+
+        build_start_time = time.time()
+        with timed_phase(stats, "assembly"):
+            lp = build_battery_lp(battery, lmps, initial_soc, final_soc)
+            bounds = np.column_stack([lp.lb, lp.ub])
+        build_time = time.time() - build_start_time
+
+        start_time = time.time()
+        with timed_phase(stats, "optimize"):
+            # linprog minimizes
+            solution = linprog(-lp.c, A_eq=lp.A_eq, b_eq=lp.b_eq, bounds=bounds, method="highs")
+        end_time = time.time()
+
+        if stats is not None:
+            stats.num_vars = len(lp.c)
+            stats.num_constrs = lp.A_eq.shape[0]
+            stats.num_nonzeros = lp.A_eq.nnz
+            stats.iterations = int(solution.nit)
+
+        status = _LINPROG_STATUS.get(solution.status, 12)
+        if status == 2:
+            with timed_phase(stats, "extract"):
+                schedule = lp_schedule(lp, solution.x)
+            return BatteryControlResult(
+                status_num=status,
+                objective_value=-solution.fun,
+                runtime=end_time - start_time,
+                lmp_timeseries=lmps,
+                build_time=build_time,
+                latency=time.time() - build_start_time,
+                schedule=schedule,
+            )
+        else:
+            return BatteryControlResult(
+                status_num=status,
+                lmp_timeseries=lmps,
+                build_time=build_time,
+                latency=time.time() - build_start_time,
+            )
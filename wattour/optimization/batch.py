@@ -0,0 +1,80 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, Literal, NamedTuple, Optional
+
+from wattour.core import BatteryBase
+from wattour.core.lmp_timeseries_base import LMPTimeseriesBase
+
+from .backends import SolverBackend
+from .optimize_battery_control import optimize_battery_control
+from .results import BatteryControlResult
+
+
+class OptimizationJob(NamedTuple):
+    battery: BatteryBase
+    lmps: LMPTimeseriesBase
+    initial_soc: float = 0
+    final_soc: float = 0
+
+
+def _solve_job(
+    job: OptimizationJob,
+    assembly: Literal["scalar", "matrix"],
+    threads: int,
+    backend: Literal["auto", "gurobi", "highs", "chain"] | SolverBackend,
+    profile: bool = False,
+) -> BatteryControlResult:
+    """Solve one job in a worker process and return a result without the live model or the timeseries."""
+    result = optimize_battery_control(
+        job.battery,
+        job.lmps,
+        job.initial_soc,
+        job.final_soc,
+        assembly=assembly,
+        threads=threads,
+        backend=backend,
+        profile=profile,
+        dispose_model=True,
+    )
+    # the caller already has the timeseries, so it isn't sent back
+    return result._replace(lmp_timeseries=None)
+
+
+def optimize_many(
+    jobs: Iterable[OptimizationJob | tuple],
+    max_workers: Optional[int] = None,
+    threads_per_job: int = 1,
+    assembly: Literal["scalar", "matrix"] = "matrix",
+    backend: Literal["auto", "gurobi", "highs", "chain"] | SolverBackend = "auto",
+    profile: bool = False,
+) -> list[BatteryControlResult]:
+    """Optimize the battery control of many (battery, lmps, initial_soc[, final_soc]) jobs on a process pool.
+
+    Each job gets threads_per_job Gurobi threads and max_workers defaults to the number of cores divided by
+    threads_per_job, so the pool doesn't oversubscribe the machine. Trees are pickled as their node arrays. Results are
+    in the order of the jobs and hold the solved variables as a DispatchSchedule instead of the Gurobi model and
+    decision_vars. backend and profile are passed to optimize_battery_control; a SolverBackend instance must be
+    picklable.
+    """
+    jobs = [OptimizationJob(*job) for job in jobs]
+    if threads_per_job < 1:
+        raise ValueError("threads_per_job must be at least 1")
+    if max_workers is None:
+        max_workers = max(1, (os.cpu_count() or 1) // threads_per_job)
+    if not jobs:
+        return []
+
+    for job in jobs:
+        if job.lmps.head is None:
+            raise ValueError("Timeseries is empty")
+        # the same side effect as optimize_battery_control, so the returned timeseries match a sequential run
+        if job.lmps.head.coefficient is None:
+            job.lmps.calc_coefficients()
+
+    # spawn, as Gurobi environments must not be shared with forked children
+    with ProcessPoolExecutor(
+        max_workers=min(max_workers, len(jobs)), mp_context=multiprocessing.get_context("spawn")
+    ) as executor:
+        futures = [executor.submit(_solve_job, job, assembly, threads_per_job, backend, profile) for job in jobs]
+        return [future.result()._replace(lmp_timeseries=job.lmps) for future, job in zip(futures, jobs)]
@@ -0,0 +1,120 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, NamedTuple
+
+import numpy as np
+
+from wattour.core import BatteryBase
+from wattour.core.lmp_timeseries_base import LMPTimeseriesBase
+
+if TYPE_CHECKING:
+    import scipy.sparse as sp
+
+
+class BatteryLP(NamedTuple):
+    """Battery control LP in matrix form: maximize c @ x subject to A_eq @ x == b_eq and lb <= x <= ub.
+
+    x is [soe of every node, charge of every non-dummy node, discharge of every non-dummy node], with nodes in id order.
+    """
+
+    c: np.ndarray
+    A_eq: sp.csr_matrix
+    b_eq: np.ndarray
+    lb: np.ndarray
+    ub: np.ndarray
+    active: np.ndarray  # ids of the non-dummy nodes, which have charge and discharge variables
+
+    @property
+    def num_nodes(self) -> int:
+        return len(self.c) - 2 * len(self.active)
+
+    def soe(self, x: np.ndarray) -> np.ndarray:
+        return x[: self.num_nodes]
+
+    def charge(self, x: np.ndarray) -> np.ndarray:
+        return x[self.num_nodes : self.num_nodes + len(self.active)]
+
+    def discharge(self, x: np.ndarray) -> np.ndarray:
+        return x[self.num_nodes + len(self.active) :]
+
+
+def build_battery_lp(
+    battery: BatteryBase, timeseries: LMPTimeseriesBase, initial_soc: float = 0, min_final_soc: float = 0
+) -> BatteryLP:
+    """Build the battery control LP from the tree's arrays.
+
+    Charge, discharge and state of energy limits (and the initial state of energy) are variable bounds, and the state of
+    energy balances form one sparse equality constraint with a row per parent -> child edge. Coefficients must have been
+    calculated.
+    """
+    import scipy.sparse as sp
+
+    if timeseries.head is None:
+        raise ValueError("Timeseries is empty")
+
+    max_soe = battery.get_usable_capacity()
+    charge_eff = battery.get_charge_efficiency()
+    discharge_eff = battery.get_discharge_efficiency()
+
+    parent = timeseries.parent_ids()
+    is_dummy = timeseries.column("is_dummy")
+    hours = timeseries.column("elapsed_hours")
+    num_nodes = len(parent)
+    active = np.flatnonzero(~is_dummy)
+    num_active = len(active)
+    position = np.full(num_nodes, -1, dtype=np.int64)
+    position[active] = np.arange(num_active)
+
+    soe_lb = np.where(is_dummy, min_final_soc * max_soe, 0.0)
+    soe_ub = np.full(num_nodes, max_soe, dtype=np.float64)
+    soe_lb[0] = soe_ub[0] = initial_soc * max_soe
+    lb = np.concatenate([soe_lb, np.zeros(2 * num_active)])
+    ub = np.concatenate(
+        [soe_ub, np.full(num_active, battery.get_charge_rate()), np.full(num_active, battery.get_discharge_rate())]
+    )
+
+    # soe[child] - (1 - self_discharge * h) * soe[parent] - h * charge_eff * charge[parent]
+    # + h / discharge_eff * discharge[parent] == 0 for every edge with an elapsed time h
+    child = np.flatnonzero((parent >= 0) & ~np.isnan(hours))
+    edge_parent = parent[child]
+    edge_hours = hours[child]
+    rows = np.tile(np.arange(len(child)), 4)
+    cols = np.concatenate(
+        [
+            child,
+            edge_parent,
+            num_nodes + position[edge_parent],
+            num_nodes + num_active + position[edge_parent],
+        ]
+    )
+    data = np.concatenate(
+        [
+            np.ones(len(child)),
+            -(1 - battery.get_self_discharge_rate() * edge_hours),
+            -edge_hours * charge_eff,
+            edge_hours / discharge_eff,
+        ]
+    )
+    A_eq = sp.csr_matrix((data, (rows, cols)), shape=(len(child), num_nodes + 2 * num_active))
+
+    c = _objective(timeseries, child, active)
+
+    return BatteryLP(c=c, A_eq=A_eq, b_eq=np.zeros(len(child)), lb=lb, ub=ub, active=active)
+
+
+def battery_lp_objective(timeseries: LMPTimeseriesBase) -> np.ndarray:
+    """Build only the objective vector c of build_battery_lp, for re-pricing a model of the same shape."""
+    parent = timeseries.parent_ids()
+    child = np.flatnonzero((parent >= 0) & ~np.isnan(timeseries.column("elapsed_hours")))
+    return _objective(timeseries, child, np.flatnonzero(~timeseries.column("is_dummy")))
+
+
+def _objective(timeseries: LMPTimeseriesBase, child: np.ndarray, active: np.ndarray) -> np.ndarray:
+    # revenue of a node's dispatch is weighted by the elapsed time and coefficient of each of its children
+    num_nodes = timeseries._n
+    weight = timeseries.column("price") * np.bincount(
+        timeseries.parent_ids()[child],
+        weights=timeseries.column("elapsed_hours")[child] * timeseries.column("coefficient")[child],
+        minlength=num_nodes,
+    )
+    return np.concatenate([np.zeros(num_nodes), -weight[active], weight[active]])
@@ -0,0 +1,243 @@
+import bisect
+import time
+from typing import NamedTuple, Optional
+
+import numpy as np
+
+from wattour.core import BatteryBase
+from wattour.core.lmp_timeseries_base import LMPTimeseriesBase
+
+from .backends import HighsBackend, SolverBackend
+from .results import BatteryControlResult, DispatchSchedule, OptimizationStats, timed_phase
+
+
+class InfeasibleBoundsError(ValueError):
+    """The state of energy bounds of the chain can't be met."""
+
+
+class _Stage(NamedTuple):
+    """What the forward pass needs to recover the next state of energy at one edge."""
+
+    start: float  # start of the domain of the next node's value function
+    step_start: float  # start of the domain of the edge's revenue function
+    step_lengths: list[float]
+    # length of the next node's value function segments that are steeper than each revenue function segment
+    steeper_lengths: list[float]
+
+
+def is_chain(lmps: LMPTimeseriesBase) -> bool:
+    """Whether the timeseries is a single branch the chain solver can handle."""
+    parent = lmps.parent_ids()
+    return (
+        lmps.head is not None
+        and lmps.branches <= 1
+        and np.array_equal(parent[1:], np.arange(len(parent) - 1))
+        and not np.any(np.isnan(lmps.column("elapsed_hours")[1:]))
+        and not np.any(lmps.column("is_dummy")[:-1])
+    )
+
+
+def solve_chain(
+    battery: BatteryBase, lmps: LMPTimeseriesBase, initial_soc: float = 0, min_final_soc: float = 0
+) -> tuple[float, DispatchSchedule]:
+    """Solve the battery control LP of a single branch exactly by dynamic programming.
+
+    The value of the rest of the chain is a concave piecewise linear function of the state of energy. Going back one
+    edge is a sup-convolution with the edge's revenue function (a sorted merge of the segments by slope), a scaling by
+    the self discharge and a clip to the state of energy bounds, so the solve is about linear in the chain length.
+    Raises InfeasibleBoundsError if the state of energy bounds can't be met, and ValueError if self discharge empties
+    the battery within one step, which the scaling can't represent.
+    """
+    if not is_chain(lmps):
+        raise ValueError("The timeseries is not a single branch")
+
+    max_soe = battery.get_usable_capacity()
+    max_charge = battery.get_charge_rate()
+    max_discharge = battery.get_discharge_rate()
+    charge_eff = battery.get_charge_efficiency()
+    discharge_eff = battery.get_discharge_efficiency()
+    num_nodes = lmps._n
+    tolerance = 1e-9 * max(1.0, max_soe)
+
+    is_dummy = lmps.column("is_dummy")
+    lower = np.zeros(num_nodes)
+    upper = np.full(num_nodes, float(max_soe))
+    lower[is_dummy] = min_final_soc * max_soe
+    lower[0] = upper[0] = initial_soc * max_soe
+
+    # per edge: revenue weight of the parent's dispatch, energy stored per MW charged and drawn per MW discharged
+    hours = lmps.column("elapsed_hours")[1:]
+    weight = lmps.column("price")[:-1] * hours * lmps.column("coefficient")[1:]
+    charge_energy = hours * charge_eff
+    discharge_energy = hours / discharge_eff
+    retention = 1 - battery.get_self_discharge_rate() * hours
+    if np.any(retention <= 0):
+        raise ValueError("Self discharge empties the battery within one step")
+
+    # The revenue of an edge as a function of t, the energy taken out of the battery, starts at full charge
+    # (t = -charge_energy * max_charge) and rises with slope w / charge_energy while charging less and w /
+    # discharge_energy while discharging. At negative prices both segments swap, as charging and discharging at once
+    # pays off.
+    charge_slope = (weight / charge_energy).tolist()
+    discharge_slope = (weight / discharge_energy).tolist()
+    charge_length = (charge_energy * max_charge).tolist()
+    discharge_length = (discharge_energy * max_discharge).tolist()
+    step_value = (-weight * max_charge).tolist()
+    retention_list = retention.tolist()
+    lower_list = lower.tolist()
+    upper_list = upper.tolist()
+
+    # value function of the current node: the value at start, then segments by decreasing slope. Slopes are stored
+    # negated (for bisect) and divided by slope_scale, lengths divided by length_scale, so that scaling the function by
+    # the self discharge is O(1).
+    start, value = lower_list[-1], 0.0
+    keys: list[float] = []
+    lengths: list[float] = []
+    total = 0.0  # sum of the stored lengths
+    length_scale = slope_scale = 1.0
+    if upper_list[-1] > lower_list[-1]:
+        keys.append(0.0)
+        lengths.append(upper_list[-1] - lower_list[-1])
+        total = lengths[0]
+
+    stages: list[_Stage] = []
+    for edge in range(num_nodes - 2, -1, -1):
+        if charge_slope[edge] >= discharge_slope[edge]:
+            step = [(charge_slope[edge], charge_length[edge]), (discharge_slope[edge], discharge_length[edge])]
+        else:
+            step = [(discharge_slope[edge], discharge_length[edge]), (charge_slope[edge], charge_length[edge])]
+
+        # sup-convolution: merge the revenue function's segments into the value function's
+        steeper_lengths = []
+        for slope, _ in step:
+            index = bisect.bisect_left(keys, -slope / slope_scale)
+            steeper = sum(lengths[:index]) if index <= len(lengths) // 2 else total - sum(lengths[index:])
+            steeper_lengths.append(steeper * length_scale)
+        for slope, length in step:
+            key = -slope / slope_scale
+            index = bisect.bisect_left(keys, key)
+            keys.insert(index, key)
+            lengths.insert(index, length / length_scale)
+            total += length / length_scale
+        step_start = -charge_length[edge]
+        stages.append(_Stage(start, step_start, [length for _, length in step], steeper_lengths))
+        start += step_start
+        value += step_value[edge]
+
+        # the value function so far is of retention * soe
+        start /= retention_list[edge]
+        length_scale /= retention_list[edge]
+        slope_scale *= retention_list[edge]
+        if length_scale > 1e100 or slope_scale < 1e-100:
+            lengths = [length * length_scale for length in lengths]
+            keys = [key * slope_scale for key in keys]
+            total *= length_scale
+            length_scale = slope_scale = 1.0
+
+        # clip to the state of energy bounds of the edge's parent
+        if start < lower_list[edge]:
+            cut = lower_list[edge] - start
+            while lengths and cut > 0:
+                length = lengths[0] * length_scale
+                slope = -keys[0] * slope_scale
+                if length <= cut:
+                    value += length * slope
+                    cut -= length
+                    total -= lengths.pop(0)
+                    keys.pop(0)
+                else:
+                    value += cut * slope
+                    lengths[0] -= cut / length_scale
+                    total -= cut / length_scale
+                    cut = 0.0
+            if cut > tolerance:
+                raise InfeasibleBoundsError("Infeasible state of energy bounds")
+            start = lower_list[edge]
+        if start > upper_list[edge] + tolerance:
+            raise InfeasibleBoundsError("Infeasible state of energy bounds")
+        cut = start + total * length_scale - upper_list[edge]
+        while lengths and cut > 0:
+            length = lengths[-1] * length_scale
+            if length <= cut:
+                cut -= length
+                total -= lengths.pop()
+                keys.pop()
+            else:
+                lengths[-1] -= cut / length_scale
+                total -= cut / length_scale
+                cut = 0.0
+        if not lengths:
+            total = 0.0
+
+    # forward pass: follow the optimal split of each sup-convolution between the state of energy and the revenue
+    soe = [lower_list[0]]
+    for edge, stage in enumerate(reversed(stages)):
+        position = retention_list[edge] * soe[-1] - stage.start - stage.step_start
+        consumed = 0.0  # length of the revenue function used up so far
+        for steeper, length in zip(stage.steeper_lengths, stage.step_lengths):
+            if position <= steeper + consumed:
+                break
+            if position <= steeper + consumed + length:
+                consumed = position - steeper
+                break
+            consumed += length
+        soe.append(min(max(stage.start + position - consumed, lower_list[edge + 1]), upper_list[edge + 1]))
+
+    # the cheapest charge and discharge that store the energy u of each edge
+    soe_array = np.array(soe)
+    u = soe_array[1:] - retention * soe_array[:-1]
+    charge = np.where(
+        weight >= 0,
+        np.maximum(u, 0) / charge_energy,
+        np.minimum(max_charge, max_discharge * discharge_energy / charge_energy + u / charge_energy),
+    )
+    discharge = np.where(
+        weight >= 0, np.maximum(-u, 0) / discharge_energy, (charge * charge_energy - u) / discharge_energy
+    )
+    charge = np.append(np.clip(charge, 0, max_charge), 0.0)
+    discharge = np.append(np.clip(discharge, 0, max_discharge), 0.0)
+    if is_dummy[-1]:
+        charge[-1] = discharge[-1] = np.nan
+
+    return value, DispatchSchedule(soe=soe_array, charge=charge, discharge=discharge)
+
+
+# Solves single-branch timeseries exactly without an LP solver; optimize_battery_control picks it for them by default.
+# Steps in which self discharge empties the battery are left to the LP solver.
+class ChainBackend(SolverBackend):
+    def solve(
+        self,
+        battery: BatteryBase,
+        lmps: LMPTimeseriesBase,
+        initial_soc: float,
+        final_soc: float,
+        stats: Optional[OptimizationStats] = None,
+    ) -> BatteryControlResult:
+        if not is_chain(lmps):
+            raise ValueError("The timeseries is not a single branch")
+
+        if np.any(battery.get_self_discharge_rate() * lmps.column("elapsed_hours")[1:] >= 1):
+            return HighsBackend().solve(battery, lmps, initial_soc, final_soc, stats)
+
+        start_time = time.time()
+        try:
+            with timed_phase(stats, "optimize"):
+                objective_value, schedule = solve_chain(battery, lmps, initial_soc, final_soc)
+        except InfeasibleBoundsError:
+            return BatteryControlResult(
+                status_num=3,  # infeasible
+                lmp_timeseries=lmps,
+                build_time=0.0,
+                latency=time.time() - start_time,
+            )
+        end_time = time.time()
+
+        return BatteryControlResult(
+            status_num=2,
+            objective_value=objective_value,
+            runtime=end_time - start_time,
+            lmp_timeseries=lmps,
+            build_time=0.0,
+            latency=end_time - start_time,
+            schedule=schedule,
+        )
@@ -1,38 +1,38 @@
-import time
-from typing import Any, NamedTuple, Optional, TypeIs
-from uuid import UUID
+from __future__ import annotations
 
-import gurobipy as gp
-from gurobipy import GRB, Model, Var
+import time
+from typing import TYPE_CHECKING, Literal, Optional, Sequence, TypeIs
 
 from wattour.core import BatteryBase
-from wattour.core.lmp import LMP
 from wattour.core.lmp_timeseries_base import LMPTimeseriesBase
 
+from .backends import HighsBackend, SolverBackend
+from .battery_lp import BatteryLP, build_battery_lp
+from .chain import ChainBackend, is_chain
+from .results import (
+    BatteryControlResult,
+    LMPDecisionVariables,
+    OptimizationStats,
+    StatsHook,
+    model_schedule,
+    timed_phase,
+)
 
-class LMPDecisionVariables(NamedTuple):
-    soe: Var
-    charge: Optional[Var] = None
-    discharge: Optional[Var] = None
+# gurobipy is imported when a Gurobi model is built, not with the package
+if TYPE_CHECKING:
+    import gurobipy as gp
+    from gurobipy import Model, Var
 
-class BatteryControlResult(NamedTuple):
-    status_num: int
-    lmp_timeseries: LMPTimeseriesBase
-    objective_value: Optional[Any] = None
-    runtime: Optional[float] = None
-    model: Optional[gp.Model] = None
-    decision_vars: Optional[dict[UUID, LMPDecisionVariables]] = None
 
-
-def __create_gurobi_vars(timeseries: LMPTimeseriesBase, model: Model) -> dict[UUID, LMPDecisionVariables]:
+def __create_gurobi_vars(timeseries: LMPTimeseriesBase, model: Model) -> list[LMPDecisionVariables]:
     """Add gurobi decision variables to each node.
 
-    Returns: dict with nodes as keys and decision tuple as values
+    Returns: list of decision tuples indexed by node id
     """
     if timeseries.head is None:
         raise ValueError("Timeseries is empty")
 
-    decisions_vars = {}
+    decisions_vars: list[LMPDecisionVariables] = [None] * timeseries._n  # type: ignore[list-item]
     for node in timeseries.get_node_list():
         if node.dummy:
             decision_var = LMPDecisionVariables(soe=model.addVar())
@@ -49,13 +49,15 @@ def __create_gurobi_vars(timeseries: LMPTimeseriesBase, model: Model) -> dict[UU
 
 def __generate_constraints(
     timeseries: LMPTimeseriesBase,
-    decision_vars: dict[UUID, LMPDecisionVariables],
+    decision_vars: list[LMPDecisionVariables],
     model: Model,
     battery: BatteryBase,
     initial_soc: float = 0,
     min_final_soc: float = 0,
 ):
     """Generate constraints for a gurobi optimization problem."""
+    from gurobipy import Var
+
     if timeseries.head is None:
         raise ValueError("Timeseries is empty")
 
@@ -68,12 +70,13 @@ def __generate_constraints(
     def is_model_var(a: object) -> TypeIs[Var]:
         return a is not None and isinstance(a, Var)
 
-    def generate_constraints_helper(node: LMP):
+    model.addConstr(decision_vars[timeseries.head.id].soe == initial_soc * max_soe)
+    for node in timeseries.iter_preorder():
         # constraints
         model.addConstr(decision_vars[node.id].soe <= max_soe)
         if node.dummy:
             model.addConstr(decision_vars[node.id].soe >= min_final_soc * max_soe)
-            return
+            continue
 
         # for typing, for now
         soe = decision_vars[node.id].soe
@@ -104,16 +107,181 @@ def __generate_constraints(
                 )
                 * (child_node.elapsed_time.total_seconds() / 3600)
             )
-            generate_constraints_helper(child_node)
 
-    model.addConstr(decision_vars[timeseries.head.id].soe == initial_soc * max_soe)
-    generate_constraints_helper(timeseries.head)
+
+def _add_battery_lp(lp: BatteryLP, model: Model, stats: Optional[OptimizationStats] = None) -> gp.MVar:
+    """Add the battery control LP to a model as one vector of variables and one matrix constraint."""
+    from gurobipy import GRB
+
+    with timed_phase(stats, "variables"):
+        x = model.addMVar(len(lp.c), lb=lp.lb, ub=lp.ub, obj=lp.c)
+    with timed_phase(stats, "constraints"):
+        model.addMConstr(lp.A_eq, x, GRB.EQUAL, lp.b_eq)
+    model.ModelSense = GRB.MAXIMIZE
+    return x
+
+
+def _lp_decision_vars(lp: BatteryLP, x: gp.MVar) -> list[LMPDecisionVariables]:
+    """Split the variables of a matrix model into the per-node decision tuples of the scalar model."""
+    soe = lp.soe(x).tolist()
+    charge = lp.charge(x).tolist()
+    discharge = lp.discharge(x).tolist()
+    decision_vars = [LMPDecisionVariables(soe=var) for var in soe]
+    for position, node_id in enumerate(lp.active.tolist()):
+        decision_vars[node_id] = LMPDecisionVariables(
+            soe=soe[node_id], charge=charge[position], discharge=discharge[position]
+        )
+    return decision_vars
+
+
+def _optimize_gurobi(
+    battery: BatteryBase,
+    lmps: LMPTimeseriesBase,
+    initial_soc: float,
+    final_soc: float,
+    assembly: Literal["scalar", "matrix"],
+    threads: int,
+    stats: Optional[OptimizationStats] = None,
+    dispose_model: bool = False,
+) -> BatteryControlResult:
+    import gurobipy as gp
+    from gurobipy import GRB
+
+    build_start_time = time.time()
+    model = gp.Model("Battery Control Optimizer")
+
+    if assembly == "matrix":
+        with timed_phase(stats, "assembly"):
+            lp = build_battery_lp(battery, lmps, initial_soc, final_soc)
+        x = _add_battery_lp(lp, model, stats)
+        with timed_phase(stats, "decision_vars"):
+            decision_vars = _lp_decision_vars(lp, x)
+    else:
+        with timed_phase(stats, "variables"):
+            decision_vars = __create_gurobi_vars(lmps, model)
+        node_list = lmps.get_node_list(show_dummy=False)
+
+        # Objective function; charge and dischare are in power units
+        with timed_phase(stats, "objective"):
+            model.setObjective(
+                gp.quicksum(
+                    (decision_vars[node_list[i].id].discharge - decision_vars[node_list[i].id].charge)  # type: ignore[index, operator]
+                    * (child_node.elapsed_time.total_seconds() / 3600)  # type: ignore[union-attr]
+                    * child_node.coefficient
+                    * node_list[i].price
+                    for i in range(len(node_list))
+                    for child_node in node_list[i].next
+                ),
+                GRB.MAXIMIZE,
+            )
+
+        # Constraints
+        with timed_phase(stats, "constraints"):
+            __generate_constraints(lmps, decision_vars, model, battery, initial_soc, final_soc)
+
+    # Solve the model
+    model.setParam(GRB.Param.Threads, threads)
+    with timed_phase(stats, "update"):
+        model.update()
+    build_time = time.time() - build_start_time
+    start_time = time.time()
+    with timed_phase(stats, "optimize"):
+        model.optimize()
+    end_time = time.time()
+
+    if stats is not None:
+        stats.num_vars = model.NumVars
+        stats.num_constrs = model.NumConstrs
+        stats.num_nonzeros = model.NumNZs
+        stats.iterations = int(model.IterCount)
+        stats.barrier_iterations = model.BarIterCount
+        stats.work = model.Work
+
+    if model.Status == 2:
+        if dispose_model:
+            with timed_phase(stats, "extract"):
+                schedule = model_schedule(model, decision_vars)
+            result = BatteryControlResult(
+                status_num=model.Status,
+                objective_value=model.objVal,
+                runtime=end_time - start_time,
+                lmp_timeseries=lmps,
+                build_time=build_time,
+                schedule=schedule,
+            )
+        else:
+            result = BatteryControlResult(
+                status_num=model.Status,
+                objective_value=model.objVal,
+                runtime=end_time - start_time,
+                model=model,
+                lmp_timeseries=lmps,
+                decision_vars=decision_vars,
+                build_time=build_time,
+            )
+    else:
+        result = BatteryControlResult(status_num=model.Status, lmp_timeseries=lmps, build_time=build_time)
+
+    if dispose_model:
+        model.dispose()
+    return result._replace(latency=time.time() - build_start_time)
+
+
+# Solves the problem as a Gurobi model; results hold the live model and its decision variables, or with dispose_model
+# only the schedule, and the model's memory is freed right away
+class GurobiBackend(SolverBackend):
+    def __init__(self, assembly: Literal["scalar", "matrix"] = "scalar", threads: int = 0, dispose_model: bool = False):
+        if assembly not in ("scalar", "matrix"):
+            raise ValueError(f"Unknown assembly mode '{assembly}'")
+        self.assembly = assembly
+        self.threads = threads
+        self.dispose_model = dispose_model
+
+    def solve(
+        self,
+        battery: BatteryBase,
+        lmps: LMPTimeseriesBase,
+        initial_soc: float,
+        final_soc: float,
+        stats: Optional[OptimizationStats] = None,
+    ) -> BatteryControlResult:
+        return _optimize_gurobi(
+            battery, lmps, initial_soc, final_soc, self.assembly, self.threads, stats, self.dispose_model
+        )
 
 
 # LMPTimeseries has branches, this function will complete stochastic optimization
 def optimize_battery_control(
-    battery: BatteryBase, lmps: LMPTimeseriesBase, initial_soc: float = 0, final_soc: float = 0
+    battery: BatteryBase,
+    lmps: LMPTimeseriesBase,
+    initial_soc: float = 0,
+    final_soc: float = 0,
+    assembly: Literal["scalar", "matrix"] = "scalar",
+    threads: int = 0,
+    backend: Literal["auto", "gurobi", "highs", "chain"] | SolverBackend = "auto",
+    profile: bool = False,
+    hooks: Sequence[StatsHook] = (),
+    dispose_model: bool = False,
 ) -> BatteryControlResult:
+    """Maximize the battery's arbitrage revenue over the LMP timeseries.
+
+    assembly="matrix" builds the model from the tree's arrays with a few matrix calls instead of one call per variable
+    and constraint, which is much faster for large trees and yields the same solution. threads is Gurobi's Threads
+    parameter (0 lets Gurobi use every core). Both only apply to the Gurobi backend.
+
+    backend="highs" solves the same LP with SciPy's HiGHS instead, without a Gurobi license, and backend="chain" solves
+    single-branch timeseries exactly by dynamic programming. backend="auto" uses the chain solver for single-branch
+    timeseries and Gurobi otherwise. Results of other backends than Gurobi have a schedule instead of a model and
+    decision_vars. dispose_model=True gives Gurobi results a schedule too and frees the model right away, so that
+    long-running callers don't hold on to the solver's memory. result.dispatch_schedule() and result.dispatch_frame()
+    read the solution of any backend as arrays indexed by node id or as a DataFrame per scenario.
+
+    profile=True (or any hooks) collects OptimizationStats on the result's stats: wall and CPU time per phase
+    ("coefficients", then the backend's: "assembly", "variables", "objective", "constraints", "decision_vars",
+    "update", "optimize" and "extract", as far as it has them), the model's size and the solver's iteration and work
+    counters. Each hook is then called with the stats, e.g. to send stats.to_dict() to a metrics system. Without
+    profiling nothing is timed or counted.
+    """
     if lmps.head is None:
         raise ValueError("Timeseries is empty")
 
@@ -123,47 +291,27 @@ def optimize_battery_control(
     if final_soc > 1 or final_soc < 0:
         raise ValueError("Invalid final state of charge")
 
-    model = gp.Model("Battery Control Optimizer")
+    if backend == "auto":
+        backend = ChainBackend() if is_chain(lmps) else GurobiBackend(assembly, threads, dispose_model)
+    elif backend == "gurobi":
+        backend = GurobiBackend(assembly, threads, dispose_model)
+    elif backend == "highs":
+        backend = HighsBackend()
+    elif backend == "chain":
+        backend = ChainBackend()
+    elif not isinstance(backend, SolverBackend):
+        raise ValueError(f"Unknown solver backend '{backend}'")
 
-    if lmps.head.coefficient is None:
-        lmps.calc_coefficients()
-
-    decision_vars = __create_gurobi_vars(lmps, model)
-    node_list = lmps.get_node_list(show_dummy=False)
-
-    # Objective function; charge and dischare are in power units
-    model.setObjective(
-        gp.quicksum(
-            (decision_vars[node_list[i].id].discharge - decision_vars[node_list[i].id].charge)  # type: ignore
-            * (child_node.elapsed_time.total_seconds() / 3600)  # type: ignore
-            * child_node.coefficient
-            * node_list[i].price
-            for i in range(len(node_list))
-            for child_node in node_list[i].next
-        ),
-        GRB.MAXIMIZE,
-    )
-
-    # Constraints
-    __generate_constraints(lmps, decision_vars, model, battery, initial_soc, final_soc)
+    if not profile and not hooks:
+        if lmps.head.coefficient is None:
+            lmps.calc_coefficients()
+        return backend.solve(battery, lmps, initial_soc, final_soc)
 
-    # Solve the model
-    model.setParam(GRB.Param.Threads, 0)
-    start_time = time.time()
-    model.optimize()
-    end_time = time.time()
-
-    if model.Status == 2:
-        return BatteryControlResult(
-            status_num=model.Status,
-            objective_value=model.objVal,
-            runtime=end_time - start_time,
-            model=model,
-            lmp_timeseries=lmps,
-            decision_vars=decision_vars,
-        )
-    else:
-        return BatteryControlResult(
-            status_num=model.Status,
-            lmp_timeseries=lmps,
-        )
+    stats = OptimizationStats(backend=type(backend).__name__)
+    if lmps.head.coefficient is None:
+        with stats.phase("coefficients"):
+            lmps.calc_coefficients()
+    result = backend.solve(battery, lmps, initial_soc, final_soc, stats=stats)._replace(stats=stats)
+    for hook in hooks:
+        hook(stats)
+    return result
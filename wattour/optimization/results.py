@@ -0,0 +1,167 @@
+from __future__ import annotations
+
+import time
+from contextlib import AbstractContextManager, contextmanager, nullcontext
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Any, Callable, Iterator, NamedTuple, Optional
+
+import numpy as np
+import pandas as pd
+
+from wattour.core.lmp_timeseries_base import LMPTimeseriesBase
+
+if TYPE_CHECKING:
+    import gurobipy as gp
+
+
+class LMPDecisionVariables(NamedTuple):
+    soe: gp.Var
+    charge: Optional[gp.Var] = None
+    discharge: Optional[gp.Var] = None
+
+
+class DispatchSchedule(NamedTuple):
+    """Solved decision variables as arrays indexed by node id; charge and discharge are NaN for dummy nodes."""
+
+    soe: np.ndarray
+    charge: np.ndarray
+    discharge: np.ndarray
+
+
+def model_schedule(model: gp.Model, decision_vars: list[LMPDecisionVariables]) -> DispatchSchedule:
+    """Read the solution of every decision variable of a solved model with a single getAttr call."""
+    num_nodes = len(decision_vars)
+    active = [node_id for node_id in range(num_nodes) if decision_vars[node_id].charge is not None]
+    variables = [decision_vars[node_id].soe for node_id in range(num_nodes)]
+    variables += [decision_vars[node_id].charge for node_id in active]
+    variables += [decision_vars[node_id].discharge for node_id in active]
+    values = np.array(model.getAttr("X", variables))
+
+    num_active = len(active)
+    charge = np.full(num_nodes, np.nan)
+    discharge = np.full(num_nodes, np.nan)
+    charge[active] = values[num_nodes : num_nodes + num_active]
+    discharge[active] = values[num_nodes + num_active :]
+    return DispatchSchedule(soe=values[:num_nodes], charge=charge, discharge=discharge)
+
+
+def dispatch_frame(timeseries: LMPTimeseriesBase, schedule: DispatchSchedule) -> pd.DataFrame:
+    """Lay out the schedule along every scenario (path from the head to a leaf), one row per scenario and node.
+
+    Scenarios are numbered in the order of their leaves' ids and rows are in time order within each scenario, so nodes
+    shared by several scenarios appear once in each. probability is the coefficient of the scenario's leaf.
+    """
+    parent = timeseries.parent_ids()
+    leaves = timeseries.leaf_ids()
+
+    # walk all paths up to the head at once, one level per step
+    nodes, scenarios, levels = [], [], []
+    node_ids, scenario = leaves, np.arange(len(leaves))
+    level = 0
+    while len(node_ids):
+        nodes.append(node_ids)
+        scenarios.append(scenario)
+        levels.append(np.full(len(node_ids), level))
+        has_parent = parent[node_ids] >= 0
+        node_ids, scenario = parent[node_ids][has_parent], scenario[has_parent]
+        level -= 1
+    order = np.lexsort((np.concatenate(levels), np.concatenate(scenarios)))
+    node_ids = np.concatenate(nodes)[order]
+    scenario = np.concatenate(scenarios)[order]
+
+    coefficient = timeseries.column("coefficient")
+    return pd.DataFrame(
+        {
+            "scenario": scenario,
+            "node_id": node_ids,
+            "timestamp": timeseries.timestamps(node_ids),
+            "price": timeseries.column("price")[node_ids],
+            "probability": coefficient[leaves][scenario],
+            "soe": schedule.soe[node_ids],
+            "charge": schedule.charge[node_ids],
+            "discharge": schedule.discharge[node_ids],
+        }
+    )
+
+
+@dataclass
+class PhaseTime:
+    wall: float = 0.0  # seconds
+    cpu: float = 0.0  # CPU seconds of the process, so solver threads add up
+
+
+@dataclass
+class OptimizationStats:
+    """Where an optimization spent its time, the size of its model and the solver's work.
+
+    Phases are filled in the order they ran; a backend only times the phases it has (see optimize_battery_control).
+    Sizes and counters are None when the backend has no such thing, e.g. the chain solver has no LP.
+    """
+
+    backend: str = ""
+    phases: dict[str, PhaseTime] = field(default_factory=dict)
+    num_vars: Optional[int] = None
+    num_constrs: Optional[int] = None
+    num_nonzeros: Optional[int] = None
+    iterations: Optional[int] = None  # simplex iterations (HiGHS reports all of its iterations here)
+    barrier_iterations: Optional[int] = None
+    work: Optional[float] = None  # Gurobi work units, a deterministic measure of the solve time
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """Add the wall and CPU time of the block to the phase name."""
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            phase = self.phases.setdefault(name, PhaseTime())
+            phase.wall += time.perf_counter() - wall
+            phase.cpu += time.process_time() - cpu
+
+    def to_dict(self) -> dict[str, Any]:
+        """Flat metrics, e.g. {"backend": "highs", "phase.optimize.wall": 0.2, ..., "num_vars": 1000, ...}."""
+        metrics: dict[str, Any] = {"backend": self.backend}
+        for name, phase in self.phases.items():
+            metrics[f"phase.{name}.wall"] = phase.wall
+            metrics[f"phase.{name}.cpu"] = phase.cpu
+        for key in ("num_vars", "num_constrs", "num_nonzeros", "iterations", "barrier_iterations", "work"):
+            if getattr(self, key) is not None:
+                metrics[key] = getattr(self, key)
+        return metrics
+
+
+StatsHook = Callable[[OptimizationStats], None]
+
+_NO_PHASE = nullcontext()
+
+
+def timed_phase(stats: Optional[OptimizationStats], name: str) -> AbstractContextManager:
+    """stats.phase(name), or a shared no-op context when stats aren't collected."""
+    return _NO_PHASE if stats is None else stats.phase(name)
+
+
+class BatteryControlResult(NamedTuple):
+    status_num: int  # a Gurobi status code (2 is optimal) whatever the backend
+    lmp_timeseries: LMPTimeseriesBase
+    objective_value: Optional[Any] = None
+    runtime: Optional[float] = None  # time spent solving the model
+    model: Optional[gp.Model] = None  # only set by the Gurobi backend
+    decision_vars: Optional[list[LMPDecisionVariables]] = None  # indexed by node id, only set by the Gurobi backend
+    build_time: Optional[float] = None  # time spent building the model
+    latency: Optional[float] = None  # wall time of the whole call (build, solve and result)
+    schedule: Optional[DispatchSchedule] = None  # set on results without a live model
+    stats: Optional[OptimizationStats] = None  # set when optimize_battery_control profiles
+
+    def dispatch_schedule(self) -> DispatchSchedule:
+        """Return the solved decision variables as arrays by node id, read from the live model if there is one."""
+        if self.schedule is not None:
+            return self.schedule
+        if self.model is None or self.decision_vars is None:
+            raise ValueError("The result has no solution")
+        return model_schedule(self.model, self.decision_vars)
+
+    def dispatch_frame(self) -> pd.DataFrame:
+        """Return the solution as a DataFrame of the schedule along every scenario, see dispatch_frame."""
+        if self.lmp_timeseries is None:
+            raise ValueError("The result has no timeseries")
+        return dispatch_frame(self.lmp_timeseries, self.dispatch_schedule())
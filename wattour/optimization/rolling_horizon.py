@@ -0,0 +1,107 @@
+from __future__ import annotations
+
+import time
+from typing import TYPE_CHECKING, Optional
+
+import numpy as np
+
+from wattour.core import BatteryBase
+from wattour.core.lmp_timeseries_base import LMPTimeseriesBase
+
+from .battery_lp import battery_lp_objective, build_battery_lp
+from .optimize_battery_control import _add_battery_lp, _lp_decision_vars
+from .results import BatteryControlResult, LMPDecisionVariables
+
+if TYPE_CHECKING:
+    import gurobipy as gp
+
+
+class RollingHorizonOptimizer:
+    """Re-dispatch a battery every tick of a rolling horizon (MPC) with one persistent Gurobi model.
+
+    The first tick builds the model. Later ticks whose horizon has the same shape as the previous one (same branching
+    and elapsed times, e.g. the next 288 5-minute prices) only update the objective prices and the initial state of
+    energy in place, and Gurobi re-solves from the previous basis. A horizon with a different shape rebuilds the model.
+
+    Results share the live model and decision_vars, so their variable values are those of the latest tick.
+    """
+
+    def __init__(self, battery: BatteryBase, final_soc: float = 0):
+        if final_soc > 1 or final_soc < 0:
+            raise ValueError("Invalid final state of charge")
+
+        self.battery = battery
+        self.final_soc = final_soc
+        self.model: Optional[gp.Model] = None
+        self.warm_start = False  # whether the latest tick re-used the model
+        self._x: Optional[gp.MVar] = None
+        self._decision_vars: Optional[list[LMPDecisionVariables]] = None
+        self._shape: Optional[tuple[np.ndarray, ...]] = None
+
+    def step(self, lmps: LMPTimeseriesBase, initial_soc: float = 0) -> BatteryControlResult:
+        """Optimize battery control for the horizon of one tick, starting at initial_soc."""
+        if lmps.head is None:
+            raise ValueError("Timeseries is empty")
+        if initial_soc > 1 or initial_soc < 0:
+            raise ValueError("Invalid initial state of charge")
+
+        build_start_time = time.time()
+        if lmps.head.coefficient is None:
+            lmps.calc_coefficients()
+
+        shape = (lmps.parent_ids(), lmps.column("is_dummy"), lmps.column("elapsed_hours"))
+        self.warm_start = self._shape is not None and all(
+            np.array_equal(new, old, equal_nan=new.dtype.kind == "f") for new, old in zip(shape, self._shape)
+        )
+        if self.warm_start:
+            self._x.Obj = battery_lp_objective(lmps)  # type: ignore[union-attr]
+            # only the head's state of energy bounds depend on the tick
+            self._x[0].LB = self._x[0].UB = initial_soc * self.battery.get_usable_capacity()  # type: ignore[index]
+        else:
+            import gurobipy as gp
+            from gurobipy import GRB
+
+            lp = build_battery_lp(self.battery, lmps, initial_soc, self.final_soc)
+            self.close()
+            self.model = gp.Model("Battery Control Optimizer")
+            self.model.setParam(GRB.Param.Threads, 0)
+            # simplex, so that later ticks can start from the basis of the previous one
+            self.model.setParam(GRB.Param.Method, GRB.METHOD_DUAL)
+            self._x = _add_battery_lp(lp, self.model)
+            self._decision_vars = _lp_decision_vars(lp, self._x)
+            self._shape = tuple(array.copy() for array in shape)
+
+        model = self.model
+        model.update()  # type: ignore[union-attr]
+        build_time = time.time() - build_start_time
+        start_time = time.time()
+        model.optimize()  # type: ignore[union-attr]
+        end_time = time.time()
+
+        if model.Status == 2:  # type: ignore[union-attr]
+            return BatteryControlResult(
+                status_num=model.Status,  # type: ignore[union-attr]
+                objective_value=model.objVal,  # type: ignore[union-attr]
+                runtime=end_time - start_time,
+                model=model,
+                lmp_timeseries=lmps,
+                decision_vars=self._decision_vars,
+                build_time=build_time,
+                latency=time.time() - build_start_time,
+            )
+        else:
+            return BatteryControlResult(
+                status_num=model.Status,  # type: ignore[union-attr]
+                lmp_timeseries=lmps,
+                build_time=build_time,
+                latency=time.time() - build_start_time,
+            )
+
+    def close(self) -> None:
+        """Free the persistent model; the next tick builds a new one."""
+        if self.model is not None:
+            self.model.dispose()
+        self.model = None
+        self._x = None
+        self._decision_vars = None
+        self._shape = None
@@ -0,0 +1,28 @@
+import json
+
+from wattour.benchmarks.suite import Case, compare, main, make_tree, run_suite
+
+
+def test_suite_trees():
+    chain = make_tree(Case("chain", "5min", 100))
+    assert (chain._n, chain.branches) == (100, 1)
+
+    bushy = make_tree(Case("bushy", "hourly", 1000))
+    assert bushy._n <= 1000
+    assert bushy.branches > 1
+
+
+def test_suite_flags_regressions(tmp_path):
+    baseline = run_suite([Case("chain", "hourly", 50), Case("bushy", "5min", 400)], repeat=1, log=lambda line: None)
+    assert {result["operation"] for result in baseline["results"]} >= {"build", "merge_trees", "solve_highs"}
+    assert compare(baseline, baseline) == []
+
+    slower = json.loads(json.dumps(baseline))
+    slower["results"][0]["seconds"] += 1
+    slower["results"][1]["peak_mb"] = slower["results"][1]["peak_mb"] * 2 + 1
+    assert len(compare(baseline, slower)) == 2
+
+    (tmp_path / "baseline.json").write_text(json.dumps(baseline))
+    (tmp_path / "slower.json").write_text(json.dumps(slower))
+    assert main(["compare", str(tmp_path / "baseline.json"), str(tmp_path / "baseline.json")]) == 0
+    assert main(["compare", str(tmp_path / "baseline.json"), str(tmp_path / "slower.json")]) == 1
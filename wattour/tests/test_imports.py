@@ -0,0 +1,10 @@
+import pytest
+
+from wattour.benchmarks.imports import IMPORT_BUDGETS, measure_import
+
+
+@pytest.mark.parametrize("module", list(IMPORT_BUDGETS))
+def test_import_is_lazy(module):
+    # also checks that importing the PJM module doesn't need an API key
+    _, imported = measure_import(module)
+    assert imported == []
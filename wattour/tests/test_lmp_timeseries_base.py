@@ -0,0 +1,368 @@
+import io
+import json
+import pickle
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from wattour.core.lmp import LMP
+from wattour.core.lmp_timeseries_base import LMPTimeseriesBase
+from wattour.core.scenario_tree import build_scenario_tree, stage_branching
+
+
+def make_df(prices, start="2021-01-01", freq="h"):
+    return pd.DataFrame(
+        {
+            "timestamp": pd.date_range(start=start, periods=len(prices), freq=freq, tz="UTC", unit="ns"),
+            "price": prices,
+        }
+    )
+
+
+def test_create_branch_from_df():
+    ts = LMPTimeseriesBase().create_branch_from_df(make_df([1.0, 2.0, 3.0]))
+
+    assert (ts.size, ts.branches, ts.dummy_nodes) == (4, 1, 1)
+    nodes = ts.get_node_list()
+    assert [node.price for node in nodes] == [1.0, 2.0, 3.0, 0.0]
+    assert [node.dummy for node in nodes] == [False, False, False, True]
+    assert nodes[0].elapsed_time is None
+    assert nodes[1].elapsed_time == pd.Timedelta(hours=1)
+    assert nodes[3].timestamp == pd.Timestamp("2021-01-01 03:00", tz="UTC")
+    assert len(ts.get_node_list(show_dummy=False)) == 3
+
+
+def test_append_binds_node_to_tree():
+    ts = LMPTimeseriesBase()
+    head = LMP(price=5.0, timestamp=pd.Timestamp("2021-01-01", tz="UTC"))
+    ts.append(None, head)
+    child = LMP(price=6.0, timestamp=pd.Timestamp("2021-01-01 00:05", tz="UTC"))
+    ts.append(head, child)
+
+    assert ts.head == head
+    assert head.next == [child]
+    assert child.elapsed_hours == pytest.approx(5 / 60)
+
+    child.coefficient = 0.5
+    assert ts.head.next[0].coefficient == 0.5
+
+    with pytest.raises(ValueError):
+        ts.append(None, LMP(price=1.0, timestamp=pd.Timestamp("2021-01-02", tz="UTC")))
+    with pytest.raises(ValueError):
+        ts.append(child, LMP(price=1.0, timestamp=pd.Timestamp("2020-01-01", tz="UTC")))
+
+
+def test_add_branch_and_merge_trees():
+    ts = LMPTimeseriesBase().create_branch_from_df(make_df([1.0, 2.0]))
+    branch = LMPTimeseriesBase().create_branch_from_df(make_df([3.0, 4.0], start="2021-01-01 01:00"))
+    ts.add_branch(ts.head, branch)
+
+    # add_branch counts a new branch only on a node without children
+    assert (ts.size, ts.branches, ts.dummy_nodes) == (6, 1, 2)
+    assert [node.price for node in ts.head.next] == [2.0, 3.0]
+
+    first = LMPTimeseriesBase().create_branch_from_df(make_df([1.0, 2.0, 3.0]))
+    second = LMPTimeseriesBase().create_branch_from_df(make_df([1.0, 5.0, 6.0]))
+    merged = LMPTimeseriesBase.merge_trees(first, second)
+
+    assert merged is first
+    assert (merged.size, merged.branches, merged.dummy_nodes) == (7, 2, 2)
+    assert [node.price for node in merged.head.next] == [2.0, 5.0]
+    assert [node.price for node in merged.iter_nodes()] == [1.0, 2.0, 5.0, 3.0, 6.0, 0.0, 0.0]
+
+
+def test_copy_is_independent():
+    ts = LMPTimeseriesBase().create_branch_from_df(make_df([1.0, 2.0, 3.0]))
+    ts.calc_coefficients()
+    copy = ts.copy()
+    copy.weight_coefficients(0.5)
+
+    assert str(copy) == str(ts)
+    assert [node.coefficient for node in ts.iter_nodes()] == [1.0] * 4
+    assert [node.coefficient for node in copy.iter_nodes()] == [0.5] * 4
+
+    # a copy reuses the cached child index until either tree changes
+    index = ts.child_index()
+    copy = ts.copy()
+    assert copy.child_index() is index
+    copy.append_dummy(copy.node(2), LMP(price=0.0, timestamp=pd.Timestamp("2021-01-01 03:00", tz="UTC"), is_dummy=True))
+    assert (len(copy.child_index()[1]), len(ts.child_index()[1])) == (4, 3)
+
+
+def test_lmps_compare_by_value():
+    timestamp = pd.Timestamp("2021-01-01", tz="UTC")
+    ts = LMPTimeseriesBase().create_branch_from_df(make_df([1.0, 1.0]))
+
+    assert LMP(price=1.0, timestamp=timestamp) == LMP(price=1.0, timestamp=timestamp)
+    assert LMP(price=1.0, timestamp=timestamp) != LMP(price=2.0, timestamp=timestamp)
+    assert ts.head == LMP(price=1.0, timestamp=timestamp)
+    assert ts.node(1) != ts.head
+    with pytest.raises(TypeError):
+        hash(ts.head)
+
+
+def test_timestamps_keep_their_time_zone(tmp_path):
+    ts = LMPTimeseriesBase()
+    ts.append(None, LMP(price=1.0, timestamp=pd.Timestamp("2021-01-01 00:00")))
+    ts.append(ts.head, LMP(price=2.0, timestamp=pd.Timestamp("2021-01-01 01:00")))
+    assert ts.node(1).timestamp == pd.Timestamp("2021-01-01 01:00")
+    assert ts.node(1).timestamp.tzinfo is None
+
+    eastern = LMPTimeseriesBase()
+    eastern.append(None, LMP(price=1.0, timestamp=pd.Timestamp("2021-01-01 00:00", tz="US/Eastern")))
+    eastern.save(tmp_path / "tree.npz")
+    for tree in (eastern, eastern.copy(), LMPTimeseriesBase.deserialize(eastern.serialize())):
+        assert str(tree.head.timestamp) == "2021-01-01 00:00:00-05:00"
+    assert str(LMPTimeseriesBase.load(tmp_path / "tree.npz").head.timestamp.tz) == "US/Eastern"
+
+
+def test_nodes_are_slotted():
+    ts = LMPTimeseriesBase().create_branch_from_df(make_df([1.0, 2.0]))
+
+    for node in (ts.head, LMP(price=1.0, timestamp=pd.Timestamp("2021-01-01", tz="UTC"))):
+        assert not hasattr(node, "__dict__")
+        with pytest.raises(AttributeError):
+            node.label = "peak"
+
+
+def test_serialize_round_trip():
+    ts = LMPTimeseriesBase().create_branch_from_df(make_df([1.0, 2.0]))
+    ts.create_branch_from_df(make_df([3.0, 4.0], start="2021-01-01 01:00"), on_node=ts.head)
+    ts.calc_coefficients()
+
+    restored = LMPTimeseriesBase.deserialize(ts.serialize())
+
+    assert restored.serialize() == ts.serialize()
+    assert np.array_equal(restored.child_index()[1], ts.child_index()[1])
+
+
+def test_bulk_ingestion_matches_append():
+    df = make_df([1.0, 2.0, 3.0], start="2021-01-01 01:00", freq="5min")
+    df["price_1"] = [4.0, 5.0, 6.0]
+    bulk = LMPTimeseriesBase()
+    bulk.append(None, LMP(price=0.0, timestamp=pd.Timestamp("2021-01-01", tz="UTC")))
+    bulk.create_branches_from_df(df, on_node=bulk.head)
+
+    expected = LMPTimeseriesBase()
+    expected.append(None, LMP(price=0.0, timestamp=pd.Timestamp("2021-01-01", tz="UTC")))
+    for column in ["price", "price_1"]:
+        prev = expected.head
+        for timestamp, price in zip(df["timestamp"], df[column]):
+            node = LMP(price=price, timestamp=timestamp)
+            expected.append(prev, node)
+            prev = node
+        expected.append_dummy(prev, LMP(price=0, timestamp=prev.timestamp + prev.elapsed_time, is_dummy=True))
+
+    assert str(bulk) == str(expected) == "Tree: 9 nodes, 2 branches, 2 dummy nodes"
+    assert bulk.serialize() == expected.serialize()
+
+
+def test_bulk_ingestion_validates_timestamps():
+    ts = LMPTimeseriesBase().create_branch_from_df(make_df([1.0, 2.0]))
+
+    with pytest.raises(ValueError):
+        ts.create_branch_from_df(make_df([3.0, 4.0]), on_node=ts.head)
+    with pytest.raises(ValueError):
+        LMPTimeseriesBase().create_branch_from_df(make_df([1.0, 2.0]).iloc[::-1])
+    with pytest.raises(ValueError):
+        LMPTimeseriesBase().create_branches_from_df(make_df([1.0, 2.0]).assign(price_1=0.0))
+    assert str(ts) == "Tree: 3 nodes, 1 branches, 1 dummy nodes"
+
+
+def test_deep_tree_does_not_recurse():
+    n = 20_000
+    df = pd.DataFrame(
+        {"timestamp": pd.date_range("2021-01-01", periods=n, freq="5min", tz="UTC", unit="ns"), "price": np.arange(n)}
+    )
+    ts = LMPTimeseriesBase().create_branch_from_df(df)
+    ts.calc_coefficients()
+
+    assert ts.preorder_ids()[-1] == n
+    assert ts.postorder_ids()[0] == n
+    assert LMPTimeseriesBase.deserialize(ts.serialize()).size == n + 1
+
+
+def test_traversal_orders():
+    ts = LMPTimeseriesBase().create_branch_from_df(make_df([1.0, 2.0]))
+    ts.create_branch_from_df(make_df([3.0], start="2021-01-01 02:00"), on_node=ts.head.next[0])
+    ts.create_branch_from_df(make_df([4.0], start="2021-01-01 01:00"), on_node=ts.head)
+    ts.calc_coefficients()
+
+    # ids: 0 -> 1 -> 2 (dummy), 1 -> 3 -> 4 (dummy), 0 -> 5 -> 6 (dummy)
+    assert ts.preorder_ids().tolist() == [0, 1, 2, 3, 4, 5, 6]
+    assert ts.postorder_ids().tolist() == [2, 4, 3, 1, 6, 5, 0]
+    assert [node.price for node in ts.iter_preorder(show_dummy=False)] == [1.0, 2.0, 3.0, 4.0]
+    assert ts.column("coefficient").tolist() == [1.0, 0.5, 0.25, 0.25, 0.25, 0.5, 0.5]
+
+    ts.create_branch_from_df(make_df([5.0], start="2021-01-01 01:00"), on_node=ts.head)
+    assert ts.preorder_ids().tolist() == [0, 1, 2, 3, 4, 5, 6, 7, 8]
+
+
+def make_fan(prices):
+    """Build a head at 00:00 with one branch per row of prices starting at 01:00."""
+    ts = LMPTimeseriesBase().create_branch_from_df(make_df([0.0]), add_dummy=False)
+    df = make_df(prices[0], start="2021-01-01 01:00")
+    df = df.join(pd.DataFrame({f"price_{i}": row for i, row in enumerate(prices[1:], start=1)}))
+    return ts.create_branches_from_df(df, on_node=ts.head)
+
+
+def test_reduce_scenarios():
+    rng = np.random.default_rng(0)
+    centers = np.array([[10.0, 20.0, 30.0], [10.0, 50.0, 5.0]])
+    prices = np.repeat(centers, 10, axis=0) + rng.normal(0, 0.1, (20, 3))
+    ts = make_fan(prices)
+
+    reduction = ts.reduce_scenarios(num_scenarios=2, merge_tolerance=1.0)
+    reduced = reduction.timeseries
+
+    assert reduction.num_scenarios == 2
+    assert reduction.distance < 1.0
+    # the first stage of both clusters merges into one node
+    assert (reduced.size, reduced.branches, reduced.dummy_nodes) == (8, 2, 2)
+    assert len(reduced.head.next) == 1
+    leaves = [node for node in reduced.iter_nodes() if not node.next]
+    assert sum(node.coefficient for node in leaves) == pytest.approx(1.0)
+    assert sorted(round(node.coefficient, 6) for node in leaves) == [0.5, 0.5]
+    assert sorted(round(node.price) for node in reduced.head.next[0].next) == [20, 50]
+
+
+def test_reduce_scenarios_tolerance():
+    ts = make_fan(np.array([[1.0, 2.0], [1.0, 2.0], [3.0, 4.0]]))
+
+    reduction = ts.reduce_scenarios()
+    assert reduction.num_scenarios == 2
+    assert reduction.distance == 0.0
+    assert [round(node.coefficient, 6) for node in reduction.timeseries.head.next] == [0.666667, 0.333333]
+
+    assert ts.reduce_scenarios(tolerance=10.0).num_scenarios == 1
+    with pytest.raises(ValueError):
+        ts.reduce_scenarios(num_scenarios=0)
+
+
+def test_save_load_round_trip(tmp_path):
+    ts = make_fan(np.array([[1.0, 2.0], [3.0, 4.0]]))
+    ts.calc_coefficients()
+    path = tmp_path / "tree.npz"
+    ts.save(path)
+
+    loaded = LMPTimeseriesBase.load(path)
+    assert isinstance(loaded._columns["price"].base, np.memmap)
+    assert loaded.serialize() == ts.serialize()
+    assert str(loaded) == str(ts)
+
+    # copy-on-write: neither in place changes nor appends reach the file
+    loaded.weight_coefficients(0.5)
+    loaded.create_branch_from_df(make_df([5.0], start="2021-01-01 01:00"), on_node=loaded.head)
+    assert LMPTimeseriesBase.load(path).serialize() == ts.serialize()
+
+    buffer = io.BytesIO()
+    ts.save(buffer)
+    buffer.seek(0)
+    assert LMPTimeseriesBase.load(buffer).serialize() == ts.serialize()
+
+
+def test_load_reads_json(tmp_path):
+    ts = make_fan(np.array([[1.0, 2.0], [3.0, 4.0]]))
+    path = tmp_path / "tree.json"
+    path.write_text(json.dumps(ts.serialize()))
+
+    assert LMPTimeseriesBase.load(path).serialize() == ts.serialize()
+    assert LMPTimeseriesBase.load(io.StringIO(path.read_text())).serialize() == ts.serialize()
+
+
+def assert_indexes_match_bfs(ts):
+    depth = {}
+    for node in ts.iter_nodes():
+        depth[node.id] = 0 if node.id == 0 else depth[ts.parent_ids()[node.id]] + 1
+    assert ts.depths().tolist() == [depth[node_id] for node_id in range(ts._n)]
+    assert ts.leaf_ids().tolist() == sorted(node.id for node in ts.iter_nodes() if not node.next)
+    for level in range(max(depth.values()) + 2):
+        assert ts.ids_at_depth(level).tolist() == sorted(i for i, d in depth.items() if d == level)
+    timestamps = ts.column("timestamp")
+    start, end = pd.Timestamp("2021-01-01 01:00", tz="UTC"), pd.Timestamp("2021-01-01 03:00", tz="UTC")
+    expected = [i for i in range(ts._n) if start.value <= timestamps[i] < end.value]
+    assert ts.ids_between(start, end).tolist() == sorted(expected, key=lambda i: (timestamps[i], i))
+
+
+def test_indexes_follow_every_change(tmp_path):
+    ts = LMPTimeseriesBase().create_branch_from_df(make_df([1.0, 2.0, 3.0]))
+    assert_indexes_match_bfs(ts)
+
+    ts.append(ts.head, LMP(price=4.0, timestamp=pd.Timestamp("2021-01-01 02:00", tz="UTC")))
+    ts.append_dummy(ts.node(4), LMP(price=0.0, timestamp=pd.Timestamp("2021-01-01 04:00", tz="UTC"), is_dummy=True))
+    assert_indexes_match_bfs(ts)
+
+    ts.add_branch(ts.node(1), LMPTimeseriesBase().create_branch_from_df(make_df([5.0, 6.0], start="2021-01-01 02:00")))
+    ts.create_branches_from_df(make_df([7.0, 8.0], start="2021-01-01 01:00"), on_node=ts.head)
+    assert_indexes_match_bfs(ts)
+
+    merged = LMPTimeseriesBase.merge_trees(ts.copy(), make_fan(np.array([[1.0, 2.0], [3.0, 4.0]])))
+    assert_indexes_match_bfs(merged)
+    assert_indexes_match_bfs(ts)
+
+    # setting a timestamp through a node drops the timestamp index
+    ts.node(2).timestamp = pd.Timestamp("2021-01-01 05:00", tz="UTC")
+    assert_indexes_match_bfs(ts)
+
+    ts.save(tmp_path / "tree.npz")
+    assert_indexes_match_bfs(LMPTimeseriesBase.load(tmp_path / "tree.npz"))
+    assert_indexes_match_bfs(pickle.loads(pickle.dumps(ts)))  # noqa: S301
+    with pytest.raises(ValueError):
+        ts.ids_in_range("price", 0, 10)
+
+
+def test_time_slice():
+    ts = make_fan(np.array([[1.0, 2.0, 3.0], [4.0, 5.0, 6.0]]))
+    ts.calc_coefficients()
+    window = ts.time_slice(pd.Timestamp("2021-01-01 01:00", tz="UTC"), pd.Timestamp("2021-01-01 03:00", tz="UTC"))
+
+    assert window["price"].tolist() == [1.0, 4.0, 2.0, 5.0]
+    assert window["timestamp"].is_monotonic_increasing
+    assert window["coefficient"].tolist() == [0.5] * 4
+    assert window["depth"].tolist() == [1, 1, 2, 2]
+
+
+def test_build_scenario_tree_respects_budget():
+    rng = np.random.default_rng(0)
+    timestamps = pd.date_range("2024-01-01 00:05", periods=288, freq="5min", tz="UTC")
+    scenarios = 30 + rng.normal(0, 5, (60, 288)).cumsum(axis=1)
+    stages = [pd.Timedelta(hours=1), pd.Timedelta(hours=4), pd.Timedelta(hours=12)]
+
+    for max_nodes in (289, 600, 2000, 20_000):
+        ts = LMPTimeseriesBase()
+        ts.append(None, LMP(price=30.0, timestamp=timestamps[0] - pd.Timedelta(minutes=5)))
+        build_scenario_tree(ts, timestamps.asi8, scenarios, stages, max_nodes)
+
+        assert ts._n - 1 <= max_nodes
+        assert ts.size == ts._n
+        leaves = ts.column("is_dummy")
+        assert ts.branches == ts.dummy_nodes == np.count_nonzero(leaves)
+        np.testing.assert_allclose(ts.column("coefficient")[leaves].sum(), 1.0)
+        # branches only start at the stages
+        ptr, child_ids = ts.child_index()
+        branching_times = ts.column("timestamp")[child_ids[ptr[np.flatnonzero(np.diff(ptr) > 1)]]]
+        assert set(branching_times) <= {(timestamps[0] + stage).value for stage in stages}
+
+    # the tree's coefficients are the scenario probabilities, which calc_coefficients splits evenly instead
+    ts.calc_coefficients()
+    parent, num_children = ts.parent_ids(), np.diff(ts.child_index()[0])
+    expected = [1.0]
+    for node_id in range(1, ts._n):
+        expected.append(expected[parent[node_id]] / num_children[parent[node_id]])
+    assert ts.column("coefficient").tolist() == expected
+
+    assert stage_branching([12, 36, 96, 144], 2000, 60) == [2, 2, 2]
+    assert stage_branching([12, 36, 96, 144], 100_000, 8) == [2, 2, 2]
+    with pytest.raises(ValueError):
+        stage_branching([12, 36, 96, 144], 100, 60)
+
+
+def test_build_scenario_tree_uses_probability_quantiles():
+    timestamps = pd.date_range("2024-01-01", periods=4, freq="h", tz="UTC").asi8
+    scenarios = np.array([[10, 10, 1, 1], [10, 10, 2, 2], [10, 10, 3, 3], [10, 10, 4, 4]], dtype=float)
+    ts = build_scenario_tree(LMPTimeseriesBase(), timestamps, scenarios, [2], 8, probabilities=[1, 1, 1, 3])
+
+    assert ts.column("price").tolist() == [10, 10, 2, 2, 4, 4, 0, 0]
+    assert ts.parent_ids().tolist() == [-1, 0, 1, 2, 1, 4, 3, 5]
+    np.testing.assert_allclose(ts.column("coefficient"), [1, 1, 0.5, 0.5, 0.5, 0.5, 0.5, 0.5])
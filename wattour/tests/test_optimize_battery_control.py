@@ -1,4 +1,6 @@
+import numpy as np
 import pandas as pd
+import pytest
 
 from wattour.core.battery import GenericBattery
 from wattour.core.lmp_timeseries_base import LMPTimeseriesBase
@@ -67,6 +69,171 @@ lmp_timeseries_5min.create_branch_from_df(lmps_5min)
 lmp_timeseries_5min.calc_coefficients()
 
 
+def make_branched_timeseries() -> LMPTimeseriesBase:
+    ts = LMPTimeseriesBase()
+    ts.create_branch_from_df(lmps.iloc[:1], add_dummy=False)
+    for shift in range(3):
+        branch = lmps.iloc[1:].assign(price=lmps["price"].iloc[1:].to_numpy()[::-1] * shift - 20)
+        ts.create_branch_from_df(branch, on_node=ts.head)
+    return ts
+
+
+def test_optimize_simple_arbitrage():
+    ts = LMPTimeseriesBase().create_branch_from_df(lmps.iloc[:3].assign(price=[0, 10, 0]))
+    simple_battery = GenericBattery(10, 1, 1, 1, 1, 0)
+
+    for assembly in ["scalar", "matrix"]:
+        result = optimize_battery_control(simple_battery, ts, assembly=assembly, backend="gurobi")
+        assert result.objective_value == pytest.approx(10)
+        assert result.build_time is not None
+
+
+@pytest.mark.parametrize("make_timeseries", [lambda: lmp_timeseries.copy(), make_branched_timeseries])
+def test_matrix_assembly_matches_scalar(make_timeseries):
+    scalar = optimize_battery_control(battery, make_timeseries(), initial_soc=0.3, final_soc=0.2, backend="gurobi")
+    matrix = optimize_battery_control(
+        battery, make_timeseries(), initial_soc=0.3, final_soc=0.2, assembly="matrix", backend="gurobi"
+    )
+
+    assert matrix.objective_value == pytest.approx(scalar.objective_value)
+    assert len(matrix.decision_vars) == len(scalar.decision_vars)
+    assert matrix.model.NumVars == scalar.model.NumVars
+    for node_id, variables in enumerate(scalar.decision_vars):
+        assert (variables.charge is None) == (matrix.decision_vars[node_id].charge is None)
+    soe = [variables.soe.X for variables in scalar.decision_vars]
+    assert [variables.soe.X for variables in matrix.decision_vars] == pytest.approx(soe, abs=1e-6)
+
+
+@pytest.mark.parametrize("make_timeseries", [lambda: lmp_timeseries_5min.copy(), make_branched_timeseries])
+def test_highs_backend_matches_gurobi(make_timeseries):
+    gurobi = optimize_battery_control(
+        battery, make_timeseries(), initial_soc=0.3, final_soc=0.2, assembly="matrix", backend="gurobi"
+    )
+    highs = optimize_battery_control(battery, make_timeseries(), initial_soc=0.3, final_soc=0.2, backend="highs")
+
+    assert highs.status_num == 2
+    assert highs.model is None and highs.decision_vars is None
+    assert highs.objective_value == pytest.approx(gurobi.objective_value)
+    assert highs.schedule.soe[0] == pytest.approx(0.3 * battery.get_usable_capacity())
+    assert highs.schedule.soe[-1] >= 0.2 * battery.get_usable_capacity() - 1e-6
+
+    with pytest.raises(ValueError):
+        optimize_battery_control(battery, make_timeseries(), backend="cplex")
+
+
+@pytest.mark.parametrize(
+    "prices,initial_soc,final_soc",
+    [
+        (lmps_5min, 0.3, 0.2),
+        (lmps.assign(price=lmps["price"] - 150), 0.5, 0.0),  # negative prices
+        (lmps.iloc[:3].assign(price=[0, 10, 0]), 0.0, 0.0),
+    ],
+)
+def test_chain_backend_matches_gurobi(prices, initial_soc, final_soc):
+    ts = LMPTimeseriesBase().create_branch_from_df(prices)
+    gurobi = optimize_battery_control(battery, ts, initial_soc, final_soc, assembly="matrix", backend="gurobi")
+    chain = optimize_battery_control(battery, ts, initial_soc, final_soc)
+
+    assert chain.model is None
+    assert chain.objective_value == pytest.approx(gurobi.objective_value, rel=1e-9, abs=1e-9)
+    # the schedules may differ where several are optimal, so check that the chain's earns its objective
+    revenue = ts.column("price")[:-1] * ts.column("elapsed_hours")[1:] * ts.column("coefficient")[1:]
+    schedule = chain.schedule
+    assert np.dot(revenue, schedule.discharge[:-1] - schedule.charge[:-1]) == pytest.approx(chain.objective_value)
+    assert schedule.soe[0] == pytest.approx(gurobi.decision_vars[0].soe.X)
+
+
+def test_chain_backend_reports_infeasible_bounds():
+    ts = LMPTimeseriesBase().create_branch_from_df(lmps.iloc[:2])
+    # one hour of charging can't fill the battery
+    result = optimize_battery_control(battery, ts, initial_soc=0, final_soc=1, backend="chain")
+
+    assert result.status_num == 3
+    assert result.objective_value is None
+    with pytest.raises(ValueError):
+        optimize_battery_control(battery, make_branched_timeseries(), backend="chain")
+
+
+def test_chain_backend_matches_highs_when_self_discharge_empties_the_battery():
+    daily = lmps.iloc[:4].assign(timestamp=pd.date_range("2021-01-01", periods=4, freq="D", tz="UTC", unit="ns"))
+    leaky_battery = GenericBattery(100, 10, 10, 0.9, 0.9, 0.05)
+    ts = LMPTimeseriesBase().create_branch_from_df(daily)
+    assert ts._n == 5
+
+    chain = optimize_battery_control(leaky_battery, ts)
+    highs = optimize_battery_control(leaky_battery, ts, backend="highs")
+    gurobi = optimize_battery_control(leaky_battery, ts, assembly="matrix", backend="gurobi")
+
+    assert chain.status_num == highs.status_num == gurobi.status_num == 2
+    assert chain.objective_value == pytest.approx(highs.objective_value, abs=1e-9)
+    assert chain.objective_value == pytest.approx(gurobi.objective_value, abs=1e-9)
+
+
+@pytest.mark.parametrize(
+    "backend,assembly,phases",
+    [
+        ("gurobi", "scalar", ["coefficients", "variables", "objective", "constraints", "update", "optimize"]),
+        (
+            "gurobi",
+            "matrix",
+            ["coefficients", "assembly", "variables", "constraints", "decision_vars", "update", "optimize"],
+        ),
+        ("highs", "scalar", ["coefficients", "assembly", "optimize", "extract"]),
+    ],
+)
+def test_profile_stats(backend, assembly, phases):
+    reported = []
+    result = optimize_battery_control(
+        battery, make_branched_timeseries(), assembly=assembly, backend=backend, hooks=[reported.append]
+    )
+
+    stats = result.stats
+    assert reported == [stats]
+    assert list(stats.phases) == phases
+    assert all(phase.wall >= 0 and phase.cpu >= 0 for phase in stats.phases.values())
+    assert stats.num_vars == 3 * 31 + 3
+    assert stats.num_nonzeros > stats.num_constrs > 0
+    assert stats.iterations >= 0
+    assert stats.to_dict()["phase.optimize.wall"] == stats.phases["optimize"].wall
+
+    assert optimize_battery_control(battery, make_branched_timeseries(), backend=backend).stats is None
+    chain = optimize_battery_control(battery, lmp_timeseries.copy(), profile=True)
+    assert (chain.stats.backend, list(chain.stats.phases), chain.stats.num_vars) == ("ChainBackend", ["optimize"], None)
+
+
+@pytest.mark.parametrize("assembly", ["scalar", "matrix"])
+def test_dispatch_schedule_and_disposed_model(assembly):
+    live = optimize_battery_control(battery, make_branched_timeseries(), assembly=assembly, backend="gurobi")
+    disposed = optimize_battery_control(
+        battery, make_branched_timeseries(), assembly=assembly, backend="gurobi", dispose_model=True
+    )
+
+    schedule = live.dispatch_schedule()
+    assert schedule.soe == pytest.approx([variables.soe.X for variables in live.decision_vars])
+    assert schedule.charge[1] == pytest.approx(live.decision_vars[1].charge.X)
+    assert np.isnan(schedule.discharge[live.lmp_timeseries.column("is_dummy")]).all()
+    assert disposed.model is None and disposed.decision_vars is None
+    assert disposed.objective_value == pytest.approx(live.objective_value)
+    assert disposed.dispatch_schedule().soe == pytest.approx(schedule.soe, abs=1e-6)
+
+
+def test_dispatch_frame():
+    ts = make_branched_timeseries()
+    result = optimize_battery_control(battery, ts, backend="highs")
+    frame = result.dispatch_frame()
+
+    # 3 scenarios of the head, 10 prices and a dummy
+    assert len(frame) == 3 * 12
+    assert frame["scenario"].tolist() == sorted(frame["scenario"].tolist())
+    first = frame[frame["scenario"] == 0]
+    assert first["node_id"].iloc[0] == 0
+    assert first["timestamp"].is_monotonic_increasing
+    assert first["probability"].iloc[0] == pytest.approx(1 / 3)
+    assert frame["probability"].groupby(frame["scenario"]).first().sum() == pytest.approx(1)
+    assert first["soe"].tolist() == pytest.approx(result.schedule.soe[first["node_id"]].tolist())
+    assert first["price"].tolist() == pytest.approx(ts.column("price")[first["node_id"]].tolist())
+
+
 if __name__ == "__main__":
     results = optimize_battery_control(battery, lmp_timeseries)
     results_5min = optimize_battery_control(battery, lmp_timeseries_5min)
@@ -0,0 +1,62 @@
+import pickle
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from wattour.core.battery import GenericBattery
+from wattour.core.lmp_timeseries_base import LMPTimeseriesBase
+from wattour.optimization import optimize_battery_control, optimize_many
+
+
+def make_timeseries(seed):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame(
+        {
+            "timestamp": pd.date_range("2021-01-01", periods=24, freq="h", tz="UTC", unit="ns"),
+            "price": 50 + 30 * np.sin(np.arange(24) / 4) + rng.normal(0, 10, 24),
+        }
+    )
+    df["price_1"] = df["price"] + rng.normal(0, 10, 24)
+    ts = LMPTimeseriesBase().create_branch_from_df(df.iloc[:1], add_dummy=False)
+    return ts.create_branches_from_df(df.iloc[1:], on_node=ts.head)
+
+
+def make_battery(capacity):
+    return GenericBattery(
+        usable_capacity=capacity,
+        charge_rate=10,
+        discharge_rate=10,
+        charge_efficiency=0.9,
+        discharge_efficiency=0.9,
+        self_discharge_rate=0.01,
+    )
+
+
+def test_pickle_ships_arrays():
+    ts = make_timeseries(0)
+    ts.calc_coefficients()
+    ts.child_index()
+    restored = pickle.loads(pickle.dumps(ts))  # noqa: S301
+
+    assert restored.serialize() == ts.serialize()
+    assert str(restored) == str(ts)
+    assert np.array_equal(restored.child_index()[1], ts.child_index()[1])
+    assert len(restored._parent) == ts._n
+
+
+def test_optimize_many_matches_sequential():
+    jobs = [(make_battery(20 + 10 * i), make_timeseries(i), 0.5) for i in range(3)]
+    results = optimize_many(jobs, max_workers=2)
+
+    for (battery, lmps, soc), result in zip(jobs, results):
+        expected = optimize_battery_control(battery, lmps, soc)
+        assert result.model is None and result.decision_vars is None
+        assert result.lmp_timeseries is lmps
+        assert result.objective_value == pytest.approx(expected.objective_value)
+        soe = [expected.decision_vars[node_id].soe.X for node_id in range(lmps._n)]
+        assert result.schedule.soe == pytest.approx(soe, abs=1e-6)
+        assert np.isnan(result.schedule.charge[lmps.column("is_dummy")]).all()
+
+    with pytest.raises(ValueError):
+        optimize_many(jobs, threads_per_job=0)
@@ -0,0 +1,240 @@
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pandas as pd
+import pytest
+
+os.environ.setdefault("PJM_API_KEY", "test")
+
+from wattour.core import LMPTimeseriesBase  # noqa: E402
+from wattour.forecasting.pjm import pjm  # noqa: E402
+from wattour.forecasting.pjm.cache import PJMCache  # noqa: E402
+from wattour.forecasting.pjm.client import PJMError, TokenBucket, make_session  # noqa: E402
+
+
+def make_items(start, count):
+    return [
+        {
+            "datetime_beginning_utc": (pd.Timestamp("2024-01-01") + pd.Timedelta(minutes=5 * i)).isoformat(),
+            "pnode_id": "32412297",
+            "pnode_name": "PSEG",
+            "total_lmp_rt": str(20.5 + i),
+        }
+        for i in range(start, start + count)
+    ]
+
+
+def test_typed_page():
+    page = pjm.typed_page(make_items(0, 3))
+
+    assert page["datetime_beginning_utc"].dtype == "datetime64[ns, UTC]"
+    assert page["total_lmp_rt"].dtype == "float64"
+    assert page["pnode_id"].dtype == "int64"
+    assert page["total_lmp_rt"].tolist() == [20.5, 21.5, 22.5]
+
+
+@pytest.fixture
+def stub_server():
+    """Serve a local PJM stub with 5 rows; the first request for row 3 gets a 429 and the first for row 5 a 503."""
+    requests_seen = []
+    failures = {3: 429, 5: 503}
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):  # noqa: N802
+            query = parse_qs(urlparse(self.path).query)
+            start_row, row_count = int(query["startRow"][0]), int(query["rowCount"][0])
+            requests_seen.append((start_row, self.headers.get("Ocp-Apim-Subscription-Key")))
+            status = failures.pop(start_row, 200)
+            body = b""
+            if status == 200:
+                items = make_items(start_row - 1, max(0, min(row_count, 6 - start_row)))
+                body = json.dumps({"totalRows": 5, "items": items}).encode()
+            self.send_response(status)
+            if status == 429:
+                self.send_header("Retry-After", "0")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}/lmps", requests_seen
+    server.shutdown()
+    server.server_close()
+
+
+def test_iter_pjm_against_stub_server(stub_server, monkeypatch):
+    url, requests_seen = stub_server
+    monkeypatch.setattr(pjm, "BATCH_SIZE", 2)
+    session = make_session("key", pool_size=2)
+
+    limiter = TokenBucket(1000, 10)
+    pages = list(pjm.iter_pjm(url, {"pnode_id": 1}, max_workers=2, limiter=limiter, session=session, backoff=0.01))
+
+    assert [len(page) for page in pages] == [2, 2, 1]
+    assert pd.concat(pages)["total_lmp_rt"].tolist() == [20.5 + i for i in range(5)]
+    # both failed pages were retried once
+    assert sorted(start_row for start_row, _ in requests_seen) == [1, 3, 3, 5, 5]
+    assert {key for _, key in requests_seen} == {"key"}
+
+
+def test_iter_pjm_raises_after_retries(stub_server, monkeypatch):
+    url, _ = stub_server
+    monkeypatch.setattr(pjm, "BATCH_SIZE", 2)
+
+    with pytest.raises(PJMError):
+        list(pjm.iter_pjm(url, {}, limiter=TokenBucket(1000, 10), session=make_session(None), max_retries=0))
+
+
+def test_token_bucket_limits_rate():
+    bucket = TokenBucket(rate=50, capacity=2)
+    start = time.monotonic()
+    for _ in range(7):
+        bucket.acquire()
+
+    # the first two tokens are a burst, the other five take 1/50 s each
+    assert time.monotonic() - start >= 0.09
+
+
+def test_write_pages_csv(tmp_path):
+    pages = (pjm.typed_page(make_items(start, 2)) for start in (0, 2, 4))
+    path = tmp_path / "lmps.csv"
+
+    assert pjm.write_pages(pages, str(path)) == 6
+    df = pd.read_csv(path)
+    assert len(df) == 6
+    assert df["total_lmp_rt"].tolist() == [20.5 + i for i in range(6)]
+
+    pjm.create_csv(lambda: iter([pjm.typed_page(make_items(0, 1))]), str(path))()
+    assert len(pd.read_csv(path)) == 1
+
+
+def test_write_pages_parquet(tmp_path):
+    pytest.importorskip("pyarrow")
+    pages = (pjm.typed_page(make_items(start, 2)) for start in (0, 2))
+    path = tmp_path / "lmps.parquet"
+
+    assert pjm.write_pages(pages, str(path)) == 4
+    assert pd.read_parquet(path)["total_lmp_rt"].tolist() == [20.5 + i for i in range(4)]
+
+
+def test_cache_fetches_only_missing_days(tmp_path):
+    pytest.importorskip("pyarrow")
+    fetched = []
+
+    def fetch(range_start, range_end):
+        fetched.append((range_start, range_end))
+        count = int((range_end - range_start) / pd.Timedelta(hours=1))
+        offset = int((range_start - pd.Timestamp("2024-01-01", tz="UTC")) / pd.Timedelta(minutes=5))
+        return pjm.typed_page(make_items(offset, count * 12)[::12])  # hourly rows
+
+    cache = PJMCache(tmp_path)
+    df = cache.get("rt_fivemin_hrl_lmps", 1, "2024-01-02", "2024-01-04", fetch)
+    assert len(df) == 48
+    assert (cache.stats.hits, cache.stats.misses, cache.stats.requests) == (0, 2, 1)
+
+    df = cache.get("rt_fivemin_hrl_lmps", 1, "2024-01-01 12:00", "2024-01-05", fetch)
+    assert (cache.stats.hits, cache.stats.misses, cache.stats.requests) == (2, 4, 3)
+    assert fetched[1:] == [
+        (pd.Timestamp("2024-01-01", tz="UTC"), pd.Timestamp("2024-01-02", tz="UTC")),
+        (pd.Timestamp("2024-01-04", tz="UTC"), pd.Timestamp("2024-01-05", tz="UTC")),
+    ]
+    assert len(df) == 84
+    assert df["datetime_beginning_utc"].is_monotonic_increasing
+    assert df["datetime_beginning_utc"].iloc[0] == pd.Timestamp("2024-01-01 12:00", tz="UTC")
+
+    # days that may still be unverified are always fetched
+    recent = pd.Timestamp.now(tz="UTC").floor("D")
+    cache.get("rt_fivemin_hrl_lmps", 1, recent - pd.Timedelta(days=1), recent, fetch)
+    cache.get("rt_fivemin_hrl_lmps", 1, recent - pd.Timedelta(days=1), recent, fetch)
+    assert cache.stats.requests == 5
+
+
+def test_cache_skips_empty_days_and_checks_rows(tmp_path):
+    pytest.importorskip("pyarrow")
+    cache = PJMCache(tmp_path)
+    # a gap without data isn't cached as empty, so it's fetched again
+    for _ in range(2):
+        assert cache.get("rt_fivemin_hrl_lmps", 1, "2024-01-01", "2024-01-03", lambda *_: pd.DataFrame()).empty
+    assert cache.stats.requests == 2
+    assert not list(tmp_path.glob("*/*/*.parquet"))
+
+    with pytest.raises(ValueError):
+        cache.get("rt_fivemin_hrl_lmps", 1, "2024-01-01", "2024-01-03", lambda *_: pd.DataFrame({"price": [1.0]}))
+
+
+def test_cache_eviction(tmp_path):
+    pytest.importorskip("pyarrow")
+
+    def fetch(range_start, range_end):
+        days = pd.date_range(range_start, range_end, freq="D", inclusive="left")
+        return pjm.typed_page(make_items(0, len(days))).assign(datetime_beginning_utc=days)
+
+    cache = PJMCache(tmp_path, max_bytes=1)
+    cache.get("rt_fivemin_hrl_lmps", 1, "2024-01-01", "2024-01-03", fetch)
+    assert cache.stats.evictions == 2
+    assert not list(tmp_path.glob("*/*/*.parquet"))
+
+    # partitions over max_bytes are evicted least recently used first
+    cache = PJMCache(tmp_path)
+    cache.get("rt_fivemin_hrl_lmps", 1, "2024-01-01", "2024-01-04", fetch)
+    size = max(path.stat().st_size for path in tmp_path.glob("*/*/*.parquet"))
+    cache = PJMCache(tmp_path, max_bytes=2 * size)
+    cache.get("rt_fivemin_hrl_lmps", 1, "2024-01-01", "2024-01-02", fetch)
+    cache.get("rt_fivemin_hrl_lmps", 1, "2024-01-04", "2024-01-05", fetch)
+    assert sorted(path.stem for path in tmp_path.glob("*/*/*.parquet")) == ["2024-01-01", "2024-01-04"]
+    assert cache.stats.evictions == 2
+
+    # old partitions are evicted, and old days aren't written
+    cache = PJMCache(tmp_path, retention=pd.Timedelta(days=30))
+    cache.get("rt_fivemin_hrl_lmps", 1, "2024-01-01", "2024-01-03", fetch)
+    assert cache.stats.evictions == 2
+    assert not list(tmp_path.glob("*/*/*.parquet"))
+
+
+def test_get_nodes_lmps_batches_queries(monkeypatch):
+    queries = []
+
+    def fake_iter_pjm(base_req_url, params):
+        queries.append(params)
+        pnode_ids = params["pnode_id"].split(";") if "pnode_id" in params else ["1069452904"]
+        items = [
+            {**item, "pnode_id": pnode_id, "pnode_name": f"NODE{pnode_id}", "total_lmp_rt": str(float(pnode_id))}
+            for pnode_id in pnode_ids
+            for item in make_items(0, 3)
+        ]
+        yield pjm.typed_page(items)
+
+    monkeypatch.setattr(pjm, "iter_pjm", fake_iter_pjm)
+    monkeypatch.setattr(pjm, "PJM_MAX_PNODES", 2)
+
+    df = pjm.get_nodes_lmps("2024-01-01", "2024-01-02", pnode_ids=[3, 1, 2], zones=["PSEG"])
+    assert len(queries) == 3
+    assert [query.get("pnode_id") for query in queries] == ["3;1", "2", None]
+    assert queries[2]["zone"] == "PSEG"
+    assert queries[0]["datetime_beginning_utc"] == "2024-01-01 00:00 to 2024-01-01 23:59"
+    assert len(df) == 12
+    assert df["total_lmp_rt"].dtype == "float32"
+    assert df["pnode_id"].dtype == "uint32"
+    assert df["pnode_name"].dtype == "category"
+    assert df["pnode_id"].tolist()[:4] == [1, 2, 3, 1069452904]
+
+    wide = pjm.get_nodes_lmps("2024-01-01", "2024-01-02", pnode_ids=[1, 2], layout="wide")
+    assert wide.columns.tolist() == ["timestamp", 1, 2]
+    assert wide[2].tolist() == [2.0, 2.0, 2.0]
+
+    frames = dict(pjm.iter_node_frames(df))
+    assert list(frames) == [1, 2, 3, 1069452904]
+    assert frames[2].columns.tolist() == ["timestamp", "price"]
+    assert LMPTimeseriesBase().create_branch_from_df(frames[2]).branches == 1
+
+    with pytest.raises(ValueError):
+        pjm.get_nodes_lmps("2024-01-01", "2024-01-02", zones=["NOWHERE"])
@@ -0,0 +1,49 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from wattour.core.battery import GenericBattery
+from wattour.core.lmp_timeseries_base import LMPTimeseriesBase
+from wattour.optimization import RollingHorizonOptimizer, optimize_battery_control
+
+battery = GenericBattery(
+    usable_capacity=100,
+    charge_rate=10,
+    discharge_rate=10,
+    charge_efficiency=0.9,
+    discharge_efficiency=0.9,
+    self_discharge_rate=0.01,
+)
+
+prices = pd.DataFrame(
+    {
+        "timestamp": pd.date_range("2021-01-01", periods=60, freq="5min", tz="UTC", unit="ns"),
+        "price": 50 + 30 * np.sin(np.arange(60) / 6) + np.random.default_rng(0).normal(0, 10, 60),
+    }
+)
+
+
+def test_rolling_horizon_matches_cold_solves():
+    optimizer = RollingHorizonOptimizer(battery, final_soc=0.1)
+    soc = 0.5
+    models = set()
+
+    for tick in range(10):
+        horizon = prices.iloc[tick : tick + 48]
+        result = optimizer.step(LMPTimeseriesBase().create_branch_from_df(horizon), soc)
+        cold = optimize_battery_control(
+            battery, LMPTimeseriesBase().create_branch_from_df(horizon), soc, final_soc=0.1, assembly="matrix"
+        )
+
+        assert optimizer.warm_start == (tick > 0)
+        assert result.objective_value == pytest.approx(cold.objective_value)
+        assert result.latency >= result.build_time + result.runtime
+        models.add(id(result.model))
+        soc = result.decision_vars[1].soe.X / battery.get_usable_capacity()
+
+    assert len(models) == 1
+
+    # a horizon of a different shape rebuilds the model
+    optimizer.step(LMPTimeseriesBase().create_branch_from_df(prices.iloc[:24]), soc)
+    assert not optimizer.warm_start
+    optimizer.close()
@@ -0,0 +1,174 @@
+import numpy as np
+import pandas as pd
+
+from wattour.core import LMP, LMPTimeseriesBase
+from wattour.forecasting.internal import XGBTimeFeaturesRegressor
+
+
+class CountingRegressor(XGBTimeFeaturesRegressor):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.calls = 0
+
+    def create_features(self, _df):
+        self.calls += 1
+        features = super().create_features(_df)
+        features["hour"] = features["minute_of_day"] // 60
+        return features
+
+
+def make_df(hours=24 * 14):
+    timestamps = pd.date_range("2023-01-01", periods=hours, freq="h", tz="UTC")
+    prices = 30 + 10 * np.sin(2 * np.pi * timestamps.hour / 24) + np.random.default_rng(0).normal(0, 1, hours)
+    return pd.DataFrame({"timestamp": timestamps, "price": prices})
+
+
+def test_train_computes_features_once():
+    df = make_df()
+    model = CountingRegressor(num_folds=3)
+    regs, scores = model.train(df, test_size=24, n_estimators=20, early_stopping_rounds=5, n_jobs=1)
+
+    assert model.calls == 1
+    assert len(regs) == len(scores) == 3
+    assert regs[0].get_booster().feature_names == ["day_of_week", "weekend", "minute_of_day", "month", "hour"]
+    # the training features are released
+    assert model._features is None
+
+    future = pd.DataFrame({"timestamp": df["timestamp"] + pd.Timedelta(days=14)})
+    predictions = model.predict_to_df(future)
+    assert model.calls == 2
+    assert predictions.columns.tolist() == ["timestamp", "price_0", "price_1", "price_2"]
+    assert model.feature_matrix(future).values.dtype == np.float32
+    assert model.feature_matrix(future).values.flags.c_contiguous
+    model.predict_to_df(future)
+    assert model.calls == 2
+
+
+class LagRegressor(XGBTimeFeaturesRegressor):
+    def create_features(self, _df):
+        features = super().create_features(_df)
+        features["lag_1"] = _df["price"].shift(1).to_numpy()
+        return features
+
+
+class CategoricalRegressor(XGBTimeFeaturesRegressor):
+    features_ignore_y = True
+
+    def create_features(self, _df):
+        features = super().create_features(_df)
+        features["season"] = pd.Categorical((features["month"] % 12) // 3)
+        return features
+
+
+def test_feature_cache_keys_and_dtypes():
+    df = make_df()
+    model = LagRegressor(num_folds=3)
+    first = model.feature_matrix(df)
+    assert model.feature_matrix(df) is first
+
+    # features derived from y are recomputed when only y changes
+    revised = df.assign(price=df["price"] + 1)
+    np.testing.assert_allclose(model.feature_matrix(revised).values[1:, -1], first.values[1:, -1] + 1, rtol=1e-6)
+
+    # categorical features keep their dtype, and a model whose features ignore y reuses them without it
+    model = CategoricalRegressor(num_folds=3)
+    model.train(df, test_size=24, n_estimators=20, early_stopping_rounds=5, n_jobs=1)
+    features = model.feature_matrix(df)
+    assert isinstance(features.values["season"].dtype, pd.CategoricalDtype)
+    assert model.feature_matrix(df[["timestamp"]]) is features
+    assert model.predict_array(df).shape == (3, len(df))
+
+
+def test_parallel_training_matches_sequential():
+    df = make_df()
+    kwargs = {"n_estimators": 30, "early_stopping_rounds": 5}
+    sequential = XGBTimeFeaturesRegressor(num_folds=3)
+    _, sequential_scores = sequential.train(df, test_size=24, n_jobs=1, **kwargs)
+    parallel = XGBTimeFeaturesRegressor(num_folds=3)
+    _, parallel_scores = parallel.train(df, test_size=24, max_workers=3, **kwargs)
+
+    assert parallel_scores == sequential_scores
+    future = pd.DataFrame({"timestamp": df["timestamp"] + pd.Timedelta(days=14)})
+    pd.testing.assert_frame_equal(parallel.predict_to_df(future), sequential.predict_to_df(future))
+
+
+def test_predict_array_builds_tree_in_bulk():
+    df = make_df()
+    model = XGBTimeFeaturesRegressor(num_folds=3)
+    regs, _ = model.train(df, test_size=24, n_estimators=30, early_stopping_rounds=5, n_jobs=1)
+    future = pd.DataFrame({"timestamp": df["timestamp"].iloc[-48:] + pd.Timedelta(days=2)})
+
+    preds = model.predict_array(future)
+    features = model.create_features(future)
+    assert preds.shape == (3, 48)
+    for pred, reg in zip(preds, regs):
+        np.testing.assert_array_equal(pred, reg.predict(features))
+    np.testing.assert_allclose(model.predict_array(future, average=True)[0], preds.mean(axis=0))
+
+    tree = LMPTimeseriesBase()
+    tree.append(None, LMP(price=31.5, timestamp=future["timestamp"].iloc[0] - pd.Timedelta(hours=1)))
+    model.predict(tree, future)
+    assert tree.branches == 3
+    assert tree._n == 1 + 3 * 49
+    for branch, pred in enumerate(preds):
+        leaf_prices = tree.column("price")[1 + branch * 49 : (branch + 1) * 49]
+        np.testing.assert_allclose(leaf_prices, pred, rtol=1e-6)
+
+    timeseries = model.predict_to_list(future)
+    assert [ts.branches for ts in timeseries] == [1, 1, 1]
+    np.testing.assert_allclose(timeseries[1].column("price")[:48], preds[1], rtol=1e-6)
+
+
+def test_update_continues_refreshes_and_retrains(tmp_path):
+    df = make_df(24 * 21)
+    history, df_new = df.iloc[:-48], df.iloc[-48:]
+    model = XGBTimeFeaturesRegressor(num_folds=3)
+    model.train(history, test_size=24, n_estimators=30, early_stopping_rounds=5, n_jobs=1)
+    rounds = [reg.get_booster().num_boosted_rounds() for reg in model.regs]
+
+    update = model.update(df_new, num_boost_round=10)
+    assert update.action == "continue"
+    assert update.baseline_rmse == model.baseline_rmse
+    # trees after the early stopping point are dropped, then 10 are added
+    assert all(reg.get_booster().num_boosted_rounds() <= rounds[i] + 10 for i, reg in enumerate(model.regs))
+    assert all(reg.get_booster().attr("best_iteration") is None for reg in model.regs)
+
+    before = model.predict_array(df_new)
+    rounds = [reg.get_booster().num_boosted_rounds() for reg in model.regs]
+    assert model.update(df_new, mode="refresh").action == "refresh"
+    assert [reg.get_booster().num_boosted_rounds() for reg in model.regs] == rounds
+    assert not np.array_equal(model.predict_array(df_new), before)
+
+    # saved and loaded models can be updated; their baseline is the first update's error
+    model.save(tmp_path)
+    loaded = XGBTimeFeaturesRegressor(num_folds=3)
+    loaded.load([tmp_path / f"model_{i}.ubj" for i in range(3)])
+    update = loaded.update(df_new, num_boost_round=5)
+    assert update.action == "continue"
+    assert update.baseline_rmse == update.rmse
+
+    # a level shift is drift, which retrains on the history and the new data, or leaves the models without history
+    shifted = df_new.assign(price=df_new["price"] + 100)
+    regs = model.regs
+    update = model.update(shifted)
+    assert update.action == "retrain_required"
+    assert model.regs is regs
+    update = model.update(shifted, history=history)
+    assert update.action == "retrain"
+    assert update.rmse > 2 * update.baseline_rmse
+    assert model.regs[0].get_booster().num_boosted_rounds() <= 30
+
+
+def test_predict_scenario_tree():
+    df = make_df()
+    model = XGBTimeFeaturesRegressor(num_folds=3)
+    model.train(df, test_size=24, n_estimators=30, early_stopping_rounds=5, n_jobs=1)
+    future = pd.DataFrame({"timestamp": pd.date_range(df["timestamp"].iloc[-1], periods=24, freq="h")[1:]})
+
+    tree = LMPTimeseriesBase()
+    tree.append(None, LMP(price=31.5, timestamp=df["timestamp"].iloc[-1]))
+    model.predict_scenario_tree(tree, future, [pd.Timedelta(hours=1), pd.Timedelta(hours=6)], max_nodes=150)
+
+    assert tree._n - 1 <= 150
+    assert tree.branches > 3
+    np.testing.assert_allclose(tree.column("coefficient")[tree.column("is_dummy")].sum(), 1.0)